@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Matching Benchmark
+
+Times the near-duplicate search indexes in hash_index.py against the blocked
+brute-force scan on synthetic 64-bit hashes, and checks that every index
+returns exactly the brute-force result.
+
+Each run indexes N random platform hashes and queries them with local hashes
+derived from platform hashes by flipping up to --max-distance bits (plus a
+share of unrelated random hashes that should not match anything).
+
+Usage:
+    python3 benchmark_matching.py [--sizes 10000 100000 1000000] [--max-distance K]
+
+Example:
+    python3 benchmark_matching.py --max-distance 4 --methods mih brute
+"""
+
+import argparse
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from hash_index import BKTree, MultiIndexHash, blocked_search
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_QUERIES = 1_000
+
+# Share of queries that are unrelated random hashes
+NOISE_FRACTION = 0.2
+
+
+def make_hashes(size: int, queries: int, max_distance: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generate platform hashes and queries near a sample of them.
+
+    Args:
+        size: Number of platform hashes
+        queries: Number of query hashes
+        max_distance: Maximum number of bits flipped per query
+        seed: Random seed
+
+    Returns:
+        (platform_hashes, query_hashes) uint64 arrays
+    """
+    rng = np.random.default_rng(seed)
+    platform = rng.integers(0, 2 ** 64, size, dtype=np.uint64)
+
+    query = platform[rng.integers(0, size, queries)]
+    for row in range(queries):
+        for bit in rng.choice(64, rng.integers(0, max_distance + 1), replace=False):
+            query[row] ^= np.uint64(1) << np.uint64(bit)
+
+    noise = rng.random(queries) < NOISE_FRACTION
+    query[noise] = rng.integers(0, 2 ** 64, int(noise.sum()), dtype=np.uint64)
+    return platform, query
+
+
+def run_mih(platform: np.ndarray, queries: np.ndarray, max_distance: int) -> Tuple[float, List]:
+    start = time.perf_counter()
+    index = MultiIndexHash(platform)
+    build_time = time.perf_counter() - start
+    query_ids, positions, distances = index.search(queries, max_distance)
+    return build_time, list(zip(query_ids.tolist(), positions.tolist(), distances.tolist()))
+
+
+def run_bktree(platform: np.ndarray, queries: np.ndarray, max_distance: int) -> Tuple[float, List]:
+    start = time.perf_counter()
+    tree = BKTree(platform.tolist())
+    build_time = time.perf_counter() - start
+    matches = []
+    for query_id, value in enumerate(queries.tolist()):
+        matches.extend((query_id, position, distance) for position, distance in tree.search(value, max_distance))
+    return build_time, matches
+
+
+def run_brute(platform: np.ndarray, queries: np.ndarray, max_distance: int) -> Tuple[float, List]:
+    query_ids, positions, distances = blocked_search(queries, platform, max_distance)
+    return 0.0, list(zip(query_ids.tolist(), positions.tolist(), distances.tolist()))
+
+
+METHODS: Dict[str, Callable] = {
+    'brute': run_brute,
+    'mih': run_mih,
+    'bktree': run_bktree,
+}
+
+
+def main():
+    """Main execution function."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark near-duplicate hash search against brute force",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 benchmark_matching.py
+  python3 benchmark_matching.py --sizes 10000 100000 --max-distance 6
+  python3 benchmark_matching.py --methods mih brute --queries 5000
+        """
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Platform hash counts to benchmark (default: 10000 100000 1000000)")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES,
+                        help=f"Number of query hashes (default: {DEFAULT_QUERIES})")
+    parser.add_argument("--max-distance", type=int, default=4, metavar="K",
+                        help="Search radius in bits (default: 4)")
+    parser.add_argument("--methods", nargs="+", choices=list(METHODS), default=list(METHODS),
+                        help="Methods to run (default: all; brute is always run as the reference)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    methods = ['brute'] + [name for name in args.methods if name != 'brute']
+
+    print("⏱️  Near-Duplicate Matching Benchmark")
+    print("=" * 72)
+    print(f"Queries: {args.queries}, radius: {args.max_distance} bits")
+    print(f"{'size':>10}  {'method':<8} {'build (s)':>10} {'query (s)':>10} {'ms/query':>9} {'matches':>8}  {'check':<5}")
+    print("-" * 72)
+
+    for size in args.sizes:
+        platform, queries = make_hashes(size, args.queries, args.max_distance, args.seed)
+        reference = None
+
+        for name in methods:
+            start = time.perf_counter()
+            build_time, matches = METHODS[name](platform, queries, args.max_distance)
+            query_time = time.perf_counter() - start - build_time
+
+            matches = sorted(matches)
+            if reference is None:
+                reference = matches
+            check = "ok" if matches == reference else "DIFF"
+
+            print(f"{size:>10}  {name:<8} {build_time:>10.3f} {query_time:>10.3f} "
+                  f"{query_time / len(queries) * 1000:>9.3f} {len(matches):>8}  {check:<5}")
+        print("-" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Incremental Drive Sync Check
+
+Runs the incremental sync of fingerprint_google_drive.py against the
+in-memory Drive stand-in (drive_stand_in.py) and checks, after every edit,
+that the synced rows equal a full rescan of the folder and that the change
+feed reports the rows that were added, replaced and removed.
+
+The scripted steps cover a content change, a file rename, trash and delete,
+a new file, a shortcut to a file outside the tree, a folder rename, a folder
+moved out of the tree and one moved in, and a trashed folder; --random-rounds
+follows them with rounds of random edits. Syncs with nothing to do must cost
+a single changes.list call.
+
+Usage:
+    python3 check_drive_sync.py [--max-depth N] [--random-rounds N] [--seed S]
+
+Example:
+    python3 check_drive_sync.py --max-depth 1 --random-rounds 50
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+from drive_stand_in import ROOT_ID, DriveStandIn
+from drive_state import DriveSyncState
+from fingerprint_google_drive import (
+    DriveServicePool, build_drive_row, hash_drive_files, iter_folder_tree, sync_drive_folder
+)
+
+DEFAULT_RANDOM_ROUNDS = 20
+
+# Most edits made per random round
+MAX_EDITS_PER_ROUND = 6
+
+
+class DriveTree:
+    """
+    Stand-in Drive with a creatives folder to sync, plus the ids the edits pick from.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.drive = DriveStandIn()
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(seed)
+
+        self.root = self.drive.add_folder('creatives')
+        self.archive = self.drive.add_folder('archive')
+        self.folders = {'root': self.root, 'archive': self.archive}
+        for name, parent in (('summer', 'root'), ('banners', 'summer'), ('winter', 'root'), ('old', 'archive')):
+            self.folders[name] = self.drive.add_folder(name, self.folders[parent])
+
+        self.files = {}
+        for name, folder in (('a.png', 'root'), ('b.png', 'summer'), ('c.png', 'banners'),
+                             ('d.png', 'winter'), ('e.png', 'old')):
+            self.files[name] = self.drive.add_file(name, self.folders[folder], self.image())
+        self.drive.add_file('notes.txt', self.root, b'not an image', 'text/plain')
+
+        # Files with shortcuts to them; a full scan reaches them through any one route
+        self.shortcut_targets: Set[str] = set()
+
+    def image(self) -> bytes:
+        """Encode a random image as PNG."""
+        buffer = io.BytesIO()
+        Image.fromarray(self.rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def add_shortcut(self, name: str, folder_id: str, target_id: str) -> None:
+        self.drive.add_shortcut(name, folder_id, target_id)
+        self.shortcut_targets.add(target_id)
+
+    def alive(self, ids: List[str]) -> List[str]:
+        files = [self.drive.file(file_id) for file_id in ids]
+        return [file_id for file_id, file in zip(ids, files) if file is not None and not file['trashed']]
+
+    def is_within(self, folder_id: str, ancestor_id: str) -> bool:
+        while folder_id not in (None, ROOT_ID):
+            if folder_id == ancestor_id:
+                return True
+            parents = self.drive.file(folder_id)['parents']
+            folder_id = parents[0] if parents else None
+        return False
+
+    def random_edit(self, label: str) -> None:
+        """Make one random edit to the folders and files created so far."""
+        files = self.alive(list(self.files.values()))
+        folders = self.alive(list(self.folders.values()))
+        movable = [folder_id for folder_id in folders if folder_id != self.root]
+        choice = self.random.random()
+
+        if choice < 0.15 or not files:
+            name = f"new_{label}.png"
+            self.files[name] = self.drive.add_file(name, self.random.choice(folders), self.image())
+        elif choice < 0.30:
+            self.drive.update_content(self.random.choice(files), self.image())
+        elif choice < 0.40:
+            self.drive.rename(self.random.choice(files), f"renamed_{label}.png")
+        elif choice < 0.55:
+            self.drive.move(self.random.choice(files), self.random.choice(folders))
+        elif choice < 0.62:
+            self.drive.trash(self.random.choice(files))
+        elif choice < 0.66:
+            self.drive.delete(self.random.choice(files))
+        elif choice < 0.76 and movable:
+            folder_id, target_id = self.random.choice(movable), self.random.choice(folders)
+            if not self.is_within(target_id, folder_id):
+                self.drive.move(folder_id, target_id)
+        elif choice < 0.80:
+            self.folders[f"new_{label}"] = self.drive.add_folder(f"new_{label}", self.random.choice(folders))
+        elif choice < 0.84 and movable:
+            self.drive.trash(self.random.choice(movable))
+        elif choice < 0.92:
+            self.add_shortcut(f"shortcut_{label}.png", self.random.choice(folders), self.random.choice(files))
+        elif movable:
+            self.drive.rename(self.random.choice(movable), f"renamed_{label}")
+
+
+def scripted_steps(tree: DriveTree) -> List[Tuple[str, Callable[[], None]]]:
+    """
+    Edits covering each kind of change the sync has to follow.
+
+    Returns:
+        List of (step name, edit function)
+    """
+    folders, files, drive = tree.folders, tree.files, tree.drive
+    return [
+        ("no changes", lambda: None),
+        ("content change", lambda: drive.update_content(files['b.png'], tree.image())),
+        ("file rename", lambda: drive.rename(files['a.png'], 'a_renamed.png')),
+        ("file trash", lambda: drive.trash(files['d.png'])),
+        ("new file", lambda: files.update({'f.png': drive.add_file('f.png', folders['banners'], tree.image())})),
+        ("file shortcut", lambda: tree.add_shortcut('e_link.png', folders['winter'], files['e.png'])),
+        ("folder rename", lambda: drive.rename(folders['summer'], 'summer_2024')),
+        ("folder move out", lambda: drive.move(folders['summer'], folders['archive'])),
+        ("folder move in", lambda: drive.move(folders['old'], folders['winter'])),
+        ("folder trash", lambda: drive.trash(folders['winter'])),
+        ("file delete", lambda: drive.delete(files['a.png'])),
+    ]
+
+
+def full_scan(services: DriveServicePool, folder_id: str, max_depth: Optional[int]) -> List[Dict[str, str]]:
+    """
+    Rows of a fresh, non-incremental scan of the folder.
+
+    Args:
+        services: Service objects talking to the stand-in
+        folder_id: Folder to scan
+        max_depth: Maximum subfolder depth (None = unlimited)
+
+    Returns:
+        List of output rows
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        files = iter_folder_tree(services, folder_id, max_depth=max_depth)
+        return [build_drive_row(file, hashes) for file, hashes in hash_drive_files(services, files)]
+
+
+def comparable(rows: List[Dict[str, str]], shortcut_targets: Set[str]) -> Dict[str, Dict[str, str]]:
+    # folder_path of a file reachable through shortcuts depends on the route a scan happens to take
+    return {row['file_id']: {**row, 'folder_path': ''} if row['file_id'] in shortcut_targets else row
+            for row in rows}
+
+
+def expected_changes(old: Dict[str, Dict], new: Dict[str, Dict]) -> Dict[str, str]:
+    changes = {file_id: 'added' for file_id in new if file_id not in old}
+    changes.update({file_id: 'replaced' for file_id in new if file_id in old and old[file_id] != new[file_id]})
+    changes.update({file_id: 'removed' for file_id in old if file_id not in new})
+    return changes
+
+
+def main():
+    """Main execution function."""
+    parser = argparse.ArgumentParser(
+        description="Check incremental Drive syncs against full rescans on a local Drive stand-in",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 check_drive_sync.py
+  python3 check_drive_sync.py --max-depth 1
+  python3 check_drive_sync.py --random-rounds 100 --seed 7
+        """
+    )
+    parser.add_argument("--max-depth", type=int, default=None, metavar="N",
+                        help="Maximum subfolder depth to sync (default: unlimited)")
+    parser.add_argument("--random-rounds", type=int, default=DEFAULT_RANDOM_ROUNDS, metavar="N",
+                        help=f"Rounds of random edits after the scripted steps (default: {DEFAULT_RANDOM_ROUNDS})")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    tree = DriveTree(args.seed)
+    services = DriveServicePool(None, build_service=tree.drive.build_service)
+
+    steps = [("initial sync", lambda: None)] + scripted_steps(tree)
+    for round_number in range(1, args.random_rounds + 1):
+        def edit(label: str = f"r{round_number}") -> None:
+            for _ in range(tree.random.randint(1, MAX_EDITS_PER_ROUND)):
+                tree.random_edit(label)
+        steps.append((f"random round {round_number}", edit))
+    steps.append(("no changes", lambda: None))
+
+    print("🔄 Incremental Drive Sync Check")
+    print("=" * 72)
+    print(f"Max depth: {'unlimited' if args.max_depth is None else args.max_depth}, seed: {args.seed}")
+    print(f"{'step':<22} {'added':>6} {'replaced':>9} {'removed':>8} {'rows':>6} {'requests':>9}  {'check':<5}")
+    print("-" * 72)
+
+    failures = 0
+    previous = {}
+    with tempfile.TemporaryDirectory() as state_dir, \
+            DriveSyncState(os.path.join(state_dir, 'drive_sync.db')) as state:
+        for name, edit in steps:
+            edit()
+
+            requests = tree.drive.requests
+            with contextlib.redirect_stdout(io.StringIO()):
+                rows, changes = sync_drive_folder(services, state, tree.root, max_depth=args.max_depth)
+            requests = tree.drive.requests - requests
+
+            synced = comparable(rows, tree.shortcut_targets)
+            reference = comparable(full_scan(services, tree.root, args.max_depth), tree.shortcut_targets)
+            reported = dict(zip(changes['file_id'], changes['change']))
+            expected = expected_changes(previous, reference)
+            previous = reference
+
+            problems = []
+            if synced != reference:
+                problems.append("rows differ from a full rescan")
+            # A shortcut target can show up as replaced when the sync keeps another route to it
+            if {k: v for k, v in reported.items() if k not in tree.shortcut_targets} != \
+                    {k: v for k, v in expected.items() if k not in tree.shortcut_targets}:
+                problems.append("change feed differs from the rescan's changes")
+            if name == "no changes" and requests != 1:
+                problems.append(f"{requests} requests for a sync with nothing to do")
+
+            counts = changes['change'].value_counts()
+            print(f"{name:<22} {counts.get('added', 0):>6} {counts.get('replaced', 0):>9} "
+                  f"{counts.get('removed', 0):>8} {len(rows):>6} {requests:>9}  {'DIFF' if problems else 'ok':<5}")
+            for problem in problems:
+                print(f"   ❌ {problem}")
+            failures += bool(problems)
+
+    print("-" * 72)
+    if failures:
+        print(f"❌ {failures} of {len(steps)} syncs did not match")
+        sys.exit(1)
+    print(f"✅ All {len(steps)} syncs matched a full rescan")
+
+
+if __name__ == "__main__":
+    main()
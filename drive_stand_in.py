@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Local Google Drive Stand-In
+
+An in-memory Drive that answers the v3 REST calls made by
+fingerprint_google_drive.py (files.list, files.get, media downloads,
+changes.getStartPageToken and changes.list), so listing, downloading and
+incremental syncs can be exercised without a Google account or network access.
+
+Services are real googleapiclient clients built from the bundled discovery
+document, talking to the stand-in instead of www.googleapis.com, so paging,
+retries and chunked media downloads run through the same code as in
+production. Every edit is logged as a change, like Drive does.
+
+Example:
+    drive = DriveStandIn()
+    folder = drive.add_folder('creatives')
+    drive.add_file('banner.png', folder, png_bytes)
+    services = DriveServicePool(None, build_service=drive.build_service)
+"""
+
+import hashlib
+import json
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httplib2
+from googleapiclient.discovery import build
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SHORTCUT_MIME_TYPE = 'application/vnd.google-apps.shortcut'
+
+# Id of the stand-in's My Drive root folder
+ROOT_ID = 'root'
+
+# The only files.list query the stand-in understands
+PARENT_QUERY = re.compile(r"^'([^']+)' in parents and trashed=false$")
+
+# Time of the stand-in's first edit; each edit advances the clock by a second
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class DriveStandIn:
+    """
+    In-memory Drive with a change log, reachable through googleapiclient services.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {ROOT_ID: {'id': ROOT_ID, 'name': 'My Drive', 'mimeType': FOLDER_MIME_TYPE,
+                                 'parents': [], 'trashed': False}}
+        self._content = {}
+        self._changes = []
+        self._next_id = 0
+        self.requests = 0
+
+    def add_folder(self, name: str, parent_id: str = ROOT_ID) -> str:
+        """
+        Create a folder.
+
+        Returns:
+            The new folder's id
+        """
+        return self._create({'name': name, 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent_id]})
+
+    def add_file(self, name: str, parent_id: str, content: bytes, mime_type: str = 'image/png') -> str:
+        """
+        Create a file with the given content.
+
+        Returns:
+            The new file's id
+        """
+        return self._create({'name': name, 'mimeType': mime_type, 'parents': [parent_id]}, content)
+
+    def add_shortcut(self, name: str, parent_id: str, target_id: str) -> str:
+        """
+        Create a shortcut to a file or folder.
+
+        Returns:
+            The new shortcut's id
+        """
+        with self._lock:
+            target_type = self._files[target_id]['mimeType']
+        return self._create({'name': name, 'mimeType': SHORTCUT_MIME_TYPE, 'parents': [parent_id],
+                             'shortcutDetails': {'targetId': target_id, 'targetMimeType': target_type}})
+
+    def update_content(self, file_id: str, content: bytes) -> None:
+        """Replace a file's content."""
+        with self._lock:
+            self._content[file_id] = content
+            self._touch(file_id, md5Checksum=hashlib.md5(content).hexdigest(), size=str(len(content)))
+
+    def rename(self, file_id: str, name: str) -> None:
+        """Rename a file or folder."""
+        with self._lock:
+            self._touch(file_id, name=name)
+
+    def move(self, file_id: str, parent_id: str) -> None:
+        """Move a file or folder to another folder."""
+        with self._lock:
+            self._touch(file_id, parents=[parent_id])
+
+    def trash(self, file_id: str) -> None:
+        """Move a file or folder to the trash (its contents disappear from listings with it)."""
+        with self._lock:
+            self._touch(file_id, trashed=True)
+
+    def delete(self, file_id: str) -> None:
+        """Delete a file, or a folder and everything in it, for good."""
+        with self._lock:
+            children = [child_id for child_id, file in self._files.items() if file_id in file['parents']]
+        for child_id in children:
+            self.delete(child_id)
+        with self._lock:
+            del self._files[file_id]
+            self._content.pop(file_id, None)
+            self._log(file_id)
+
+    def file(self, file_id: str) -> Optional[Dict]:
+        """
+        Current metadata of a file or folder.
+
+        Returns:
+            Copy of the file resource, or None if it was deleted
+        """
+        with self._lock:
+            file = self._files.get(file_id)
+            return json.loads(json.dumps(file)) if file is not None else None
+
+    def _create(self, file: Dict, content: Optional[bytes] = None) -> str:
+        with self._lock:
+            self._next_id += 1
+            file_id = f"sid{self._next_id:06d}"
+            file.update(id=file_id, trashed=False, webViewLink=f"https://drive.stand-in/file/d/{file_id}/view")
+            if content is not None:
+                self._content[file_id] = content
+                file.update(md5Checksum=hashlib.md5(content).hexdigest(), size=str(len(content)))
+            self._files[file_id] = file
+            self._touch(file_id)
+        return file_id
+
+    def _touch(self, file_id: str, **fields) -> None:
+        file = self._files[file_id]
+        file.update(fields)
+        file['modifiedTime'] = (EPOCH + timedelta(seconds=len(self._changes))).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        self._log(file_id)
+
+    def _log(self, file_id: str) -> None:
+        self._changes.append(file_id)
+
+    def build_service(self, creds: object = None) -> object:
+        """
+        Build a Drive v3 client that talks to this stand-in.
+
+        Matches the signature of build_drive_service, for DriveServicePool.
+
+        Args:
+            creds: Ignored
+
+        Returns:
+            googleapiclient service object
+        """
+        return build('drive', 'v3', http=StandInHttp(self), static_discovery=True, cache_discovery=False)
+
+    def handle(self, uri: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Answer a GET request.
+
+        Returns:
+            (HTTP status, response headers, body)
+        """
+        url = urlparse(uri)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        route = unquote(url.path).split('/drive/v3/', 1)[-1].split('/')
+
+        with self._lock:
+            self.requests += 1
+            if route == ['files']:
+                return self._list_files(params)
+            if route == ['changes', 'startPageToken']:
+                return self._json({'kind': 'drive#startPageToken', 'startPageToken': str(len(self._changes))})
+            if route == ['changes']:
+                return self._list_changes(params)
+            if len(route) == 2 and route[0] == 'files':
+                file = self._files.get(route[1])
+                if file is None:
+                    return self._error(404, f"File not found: {route[1]}")
+                if params.get('alt') == 'media':
+                    return self._media(route[1], headers)
+                return self._json(file)
+        return self._error(404, f"Not found: {url.path}")
+
+    def _list_files(self, params: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        match = PARENT_QUERY.match(params.get('q', ''))
+        if not match:
+            return self._error(400, f"Unsupported query: {params.get('q')}")
+        files = [file for file in self._files.values() if match.group(1) in file['parents'] and not file['trashed']]
+        return self._json(self._page(files, params, 'files'))
+
+    def _list_changes(self, params: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        # Like Drive, a file changed several times is reported once, with its current state
+        start = int(params['pageToken'])
+        latest = {}
+        for position, file_id in enumerate(self._changes[start:], start):
+            latest.pop(file_id, None)
+            latest[file_id] = position
+
+        changes = []
+        for file_id, position in latest.items():
+            change = {'kind': 'drive#change', 'changeType': 'file', 'fileId': file_id,
+                      'removed': file_id not in self._files, 'position': position + 1}
+            if not change['removed']:
+                change['file'] = self._files[file_id]
+            changes.append(change)
+
+        page = self._page(changes, {**params, 'pageToken': None}, 'changes')
+        if 'nextPageToken' in page:
+            page['nextPageToken'] = str(page['changes'][-1]['position'])
+        else:
+            page['newStartPageToken'] = str(len(self._changes))
+        for change in page['changes']:
+            del change['position']
+        return self._json(page)
+
+    def _media(self, file_id: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        content = self._content.get(file_id)
+        if content is None:
+            return self._error(403, f"File has no downloadable content: {file_id}")
+        first, last = 0, len(content) - 1
+        match = re.match(r'bytes=(\d+)-(\d+)', headers.get('range', ''))
+        if match:
+            first, last = int(match.group(1)), min(int(match.group(2)), len(content) - 1)
+        return 206, {'content-range': f"bytes {first}-{last}/{len(content)}"}, content[first:last + 1]
+
+    @staticmethod
+    def _page(items: List[Dict], params: Dict[str, str], key: str) -> Dict:
+        offset = int(params.get('pageToken') or 0)
+        size = int(params.get('pageSize') or 100)
+        page = {key: [dict(item) for item in items[offset:offset + size]]}
+        if offset + size < len(items):
+            page['nextPageToken'] = str(offset + size)
+        return page
+
+    @staticmethod
+    def _json(body: Dict) -> Tuple[int, Dict[str, str], bytes]:
+        return 200, {'content-type': 'application/json'}, json.dumps(body).encode()
+
+    @staticmethod
+    def _error(status: int, message: str) -> Tuple[int, Dict[str, str], bytes]:
+        body = {'error': {'code': status, 'message': message, 'errors': [{'message': message}]}}
+        return status, {'content-type': 'application/json'}, json.dumps(body).encode()
+
+
+class StandInHttp:
+    """
+    httplib2.Http replacement that sends requests to a DriveStandIn.
+    """
+
+    def __init__(self, drive: DriveStandIn):
+        self.drive = drive
+
+    def request(self, uri: str, method: str = 'GET', body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None, redirections: int = 5,
+                connection_type: object = None) -> Tuple[httplib2.Response, bytes]:
+        if method != 'GET':
+            status, response_headers, content = DriveStandIn._error(405, f"Method not allowed: {method}")
+        else:
+            status, response_headers, content = self.drive.handle(uri, headers or {})
+        return httplib2.Response({'status': status, **response_headers}), content
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Incremental Google Drive Sync State
+
+SQLite record of a Drive folder scanned by fingerprint_google_drive.py
+--incremental, so later runs only process what the Changes API reports.
+
+The state holds the changes page token to resume from, the tracked folder
+tree (each folder with its parent, so moves and renames can be followed
+without listing anything), the file shortcuts in it and, per image file,
+the folder it was found in and its hashes. The output file is rebuilt from
+these rows on every run.
+"""
+
+import json
+import sqlite3
+from typing import Dict, Iterable, Optional
+
+# File resource fields kept per tracked file
+STATE_FILE_FIELDS = ('id', 'name', 'mimeType', 'size', 'md5Checksum', 'modifiedTime', 'webViewLink')
+
+
+class DriveSyncState:
+    """
+    Page token, folder tree and file hashes of the last incremental Drive sync.
+
+    Folders, shortcuts and files are dictionaries keyed by Drive id:
+        folders: {'parent': parent folder id (None for the root), 'name': str,
+                  'source_id': id of the listed item, i.e. the shortcut for
+                  folders reached through one}
+        shortcuts: {'folder_id': str, 'target_id': str}, for every shortcut
+                   to a file (a file reachable several ways is tracked through
+                   one of them, and falls back on the others)
+        files: {'source_id': str, 'folder_id': str, 'file': resource with
+                STATE_FILE_FIELDS, 'hashes': dictionary of hash columns, or
+                None while the file still has to be (re)hashed}
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Open (or create) the state database.
+
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path
+
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS folders (
+                    folder_id TEXT PRIMARY KEY,
+                    parent_id TEXT,
+                    name TEXT NOT NULL,
+                    source_id TEXT NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS shortcuts (
+                    shortcut_id TEXT PRIMARY KEY,
+                    folder_id TEXT NOT NULL,
+                    target_id TEXT NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id TEXT PRIMARY KEY,
+                    source_id TEXT NOT NULL,
+                    folder_id TEXT NOT NULL,
+                    file TEXT NOT NULL,
+                    hashes TEXT
+                )
+                """
+            )
+
+    def _meta(self, name: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def options(self) -> Optional[Dict]:
+        """
+        Scan options the stored state was built with.
+
+        Returns:
+            Dictionary of options, or None for a new state
+        """
+        value = self._meta('options')
+        return json.loads(value) if value else None
+
+    def page_token(self) -> Optional[str]:
+        """
+        Changes page token to resume from.
+
+        Returns:
+            The token, or None if the folder has not been scanned yet
+        """
+        return self._meta('page_token')
+
+    def folders(self) -> Dict[str, Dict]:
+        """
+        The tracked folders, including the root.
+
+        Returns:
+            Dictionary of folder entries keyed by folder id
+        """
+        rows = self._conn.execute("SELECT folder_id, parent_id, name, source_id FROM folders").fetchall()
+        return {folder_id: {'parent': parent_id, 'name': name, 'source_id': source_id}
+                for folder_id, parent_id, name, source_id in rows}
+
+    def shortcuts(self) -> Dict[str, Dict]:
+        """
+        The file shortcuts in the tracked folders.
+
+        Returns:
+            Dictionary of shortcut entries keyed by shortcut id
+        """
+        rows = self._conn.execute("SELECT shortcut_id, folder_id, target_id FROM shortcuts").fetchall()
+        return {shortcut_id: {'folder_id': folder_id, 'target_id': target_id}
+                for shortcut_id, folder_id, target_id in rows}
+
+    def files(self) -> Dict[str, Dict]:
+        """
+        The tracked image files, in the order they were added.
+
+        Returns:
+            Dictionary of file entries keyed by file id
+        """
+        rows = self._conn.execute("SELECT file_id, source_id, folder_id, file, hashes FROM files ORDER BY rowid")
+        return {file_id: {'source_id': source_id, 'folder_id': folder_id, 'file': json.loads(file),
+                          'hashes': json.loads(hashes) if hashes else None}
+                for file_id, source_id, folder_id, file, hashes in rows}
+
+    def apply(self, options: Dict, page_token: str, folders: Dict[str, Dict], shortcuts: Dict[str, Dict],
+              upserted: Dict[str, Dict], removed: Iterable[str], reset: bool = False) -> None:
+        """
+        Record the result of a sync, in a single transaction.
+
+        Args:
+            options: Scan options the state was built with
+            page_token: Changes page token to resume from next time
+            folders: The complete tracked folder tree
+            shortcuts: All file shortcuts in the tracked folders
+            upserted: New or changed file entries, keyed by file id
+            removed: Ids of the files no longer tracked
+            reset: Discard all stored files first (e.g. when the options changed)
+        """
+        with self._conn:
+            if reset:
+                self._conn.execute("DELETE FROM files")
+            else:
+                self._conn.executemany("DELETE FROM files WHERE file_id = ?", ((file_id,) for file_id in removed))
+
+            self._conn.execute("DELETE FROM folders")
+            self._conn.executemany(
+                "INSERT INTO folders (folder_id, parent_id, name, source_id) VALUES (?, ?, ?, ?)",
+                ((folder_id, folder['parent'], folder['name'], folder['source_id'])
+                 for folder_id, folder in folders.items())
+            )
+
+            self._conn.execute("DELETE FROM shortcuts")
+            self._conn.executemany(
+                "INSERT INTO shortcuts (shortcut_id, folder_id, target_id) VALUES (?, ?, ?)",
+                ((shortcut_id, shortcut['folder_id'], shortcut['target_id'])
+                 for shortcut_id, shortcut in shortcuts.items())
+            )
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (file_id, source_id, folder_id, file, hashes) VALUES (?, ?, ?, ?, ?)",
+                ((file_id, entry['source_id'], entry['folder_id'],
+                  json.dumps({field: entry['file'][field] for field in STATE_FILE_FIELDS if field in entry['file']}),
+                  json.dumps(entry['hashes']) if entry['hashes'] is not None else None)
+                 for file_id, entry in upserted.items())
+            )
+
+            for name, value in (('options', json.dumps(options, sort_keys=True)), ('page_token', page_token)):
+                self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def close(self) -> None:
+        """Close the database."""
+        self._conn.close()
+
+    def __enter__(self) -> "DriveSyncState":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
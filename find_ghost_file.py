@@ -4,11 +4,18 @@ Ghost File Detection Script
 
 This script identifies local creative files that don't have matching perceptual hashes
 in the platform data, helping to isolate data discrepancies.
+
+With --max-distance K, a local creative only counts as a ghost if no platform
+hash is within K bits of it.
 """
 
+import argparse
 import pandas as pd
 import os
 
+from hash_codec import hashes_to_hex, hex_to_hashes
+from hash_index import find_near_duplicates
+
 def load_csv_files():
     """Load the CSV files and return DataFrames."""
     try:
@@ -23,8 +30,12 @@ def load_csv_files():
         
         # Load the CSVs
         print("📂 Loading CSV files...")
-        local_df = pd.read_csv("local_creative_hashes.csv")
-        platform_df = pd.read_csv("platform_creative_hashes_META.csv")
+        local_df = pd.read_csv("local_creative_hashes.csv", dtype={'phash': str})
+        platform_df = pd.read_csv("platform_creative_hashes_META.csv", dtype={'phash': str})
+        
+        # Compare hashes as integers rather than strings
+        local_df['phash'] = hex_to_hashes(local_df['phash'])
+        platform_df['phash'] = hex_to_hashes(platform_df['phash'])
         
         print(f"✅ Loaded {len(local_df)} local creatives")
         print(f"✅ Loaded {len(platform_df)} platform creatives")
@@ -35,19 +46,28 @@ def load_csv_files():
         print(f"❌ Error loading CSV files: {e}")
         return None, None
 
-def find_ghost_files(local_df, platform_df):
-    """Find local creatives that don't match any platform creative."""
+def find_ghost_files(local_df, platform_df, max_distance=0):
+    """Find local creatives that don't match any platform creative within max_distance bits."""
     print("\n🔍 Searching for ghost files...")
     
-    # Find local phashes not present in platform phashes
-    ghosts = local_df[~local_df['phash'].isin(platform_df['phash'])]
+    if max_distance > 0:
+        # Find local rows with no platform hash within max_distance bits
+        local_rows, _, _ = find_near_duplicates(
+            local_df['phash'].to_numpy(), platform_df['phash'].to_numpy(), max_distance
+        )
+        matched = pd.Series(False, index=local_df.index)
+        matched.iloc[local_rows] = True
+        ghosts = local_df[~matched]
+    else:
+        # Find local phashes not present in platform phashes
+        ghosts = local_df[~local_df['phash'].isin(platform_df['phash'])]
     
     if not ghosts.empty:
         print(f"\n👻 Found {len(ghosts)} ghost file(s):")
         print("-" * 40)
-        for _, row in ghosts.iterrows():
+        for (_, row), phash in zip(ghosts.iterrows(), hashes_to_hex(ghosts['phash'].to_numpy())):
             print(f"📁 {row['filename']}")
-            print(f"   Hash: {row['phash']}")
+            print(f"   Hash: {phash}")
             print(f"   Path: {row['file_path']}")
             print(f"   Size: {row['file_size']} bytes")
             print()
@@ -58,6 +78,16 @@ def find_ghost_files(local_df, platform_df):
 
 def main():
     """Main execution function."""
+    parser = argparse.ArgumentParser(description="Find local creatives with no matching platform hash")
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        default=0,
+        metavar="K",
+        help="Treat platform hashes within K bits as matches (default: 0, exact only)"
+    )
+    args = parser.parse_args()
+    
     print("👻 Ghost File Detection")
     print("=" * 30)
     
@@ -70,7 +100,7 @@ def main():
         return
     
     # Find ghost files
-    ghosts = find_ghost_files(local_df, platform_df)
+    ghosts = find_ghost_files(local_df, platform_df, args.max_distance)
     
     # Summary
     print("=" * 30)
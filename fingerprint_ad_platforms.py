@@ -16,13 +16,14 @@ import os
 import sys
 import argparse
 import logging
-from typing import List, Dict, Optional
+from collections import Counter
+from itertools import chain
+from typing import Iterable, Iterator, List, Dict, Optional, Sequence, Tuple
 from urllib.parse import urlparse
 import time
 
 import pandas as pd
 import requests
-import imagehash
 from PIL import Image, UnidentifiedImageError
 from facebook_business.api import FacebookAdsApi
 from facebook_business.adobjects.adaccount import AdAccount
@@ -33,6 +34,9 @@ from google.ads.googleads.errors import GoogleAdsException
 import base64
 import io
 
+from hash_writer import StreamingHashWriter
+from image_hashing import DEFAULT_HASHES, BatchHasher, parse_hash_algorithms
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -44,6 +48,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Output columns shared by Meta and Google rows in the combined CSV
+PLATFORM_FIELDNAMES = ['ad_id', 'platform', 'phash', 'creative_name', 'thumbnail_url', 'asset_name', 'image_source']
+
+
+def platform_fieldnames(algorithms: Sequence[str] = DEFAULT_HASHES) -> List[str]:
+    """
+    Output columns for the combined CSV, with one column per hash algorithm.
+    
+    Args:
+        algorithms: Hash algorithms computed per creative
+        
+    Returns:
+        Ordered list of column names
+    """
+    return ['ad_id', 'platform', *algorithms] + PLATFORM_FIELDNAMES[3:]
+
 
 def setup_meta_api(access_token: str, app_id: str, app_secret: str) -> None:
     """
@@ -154,17 +174,37 @@ def download_image_from_url(url: str, timeout: int = 30) -> Optional[Image.Image
         return None
 
 
-def get_meta_hashes(ad_account_id: str) -> List[Dict[str, str]]:
+def build_platform_row(creative_info: Dict[str, str], hashes: Dict[str, str]) -> Dict[str, str]:
     """
-    Fetch all ad creatives from Meta Marketing API and generate perceptual hashes.
+    Build an output row, placing the hash columns right after ad_id and platform.
     
     Args:
-        ad_account_id: Meta ad account ID (e.g., 'act_123456789')
+        creative_info: Creative details (ad_id, platform and descriptive fields)
+        hashes: Dictionary of hash columns
         
     Returns:
-        List of dictionaries containing ad_id, platform, and phash
+        Output row dictionary
+    """
+    return {
+        'ad_id': creative_info['ad_id'],
+        'platform': creative_info['platform'],
+        **hashes,
+        **{key: value for key, value in creative_info.items() if key not in ('ad_id', 'platform')}
+    }
+
+
+def iter_meta_hashes(ad_account_id: str, algorithms: Sequence[str] = DEFAULT_HASHES) -> Iterator[Dict[str, str]]:
+    """
+    Fetch all ad creatives from Meta Marketing API and generate perceptual hashes,
+    yielding each row as soon as it is available.
+    
+    Args:
+        ad_account_id: Meta ad account ID (e.g., 'act_123456789')
+        algorithms: Hash algorithms to compute per creative; each becomes a column
+        
+    Yields:
+        Dictionaries containing ad_id, platform, and phash
     """
-    meta_image_data = []
     processed_count = 0
     skipped_count = 0
     error_count = 0
@@ -192,6 +232,16 @@ def get_meta_hashes(ad_account_id: str) -> List[Dict[str, str]]:
         print(f"Processing {len(creatives)} Meta ad creatives...")
         print("=" * 60)
         
+        # Images are queued and their phash computed in vectorized batches
+        batcher = BatchHasher(algorithms)
+        
+        def emit(completed: List[Tuple[Dict[str, str], Dict[str, str]]]) -> Iterator[Dict[str, str]]:
+            nonlocal processed_count
+            for creative_info, hashes in completed:
+                processed_count += 1
+                print(f"✅ Processed: {creative_info['creative_name']}")
+                yield build_platform_row(creative_info, hashes)
+        
         # Loop through each creative
         for creative in creatives:
             creative_id = creative.get('id')
@@ -222,20 +272,13 @@ def get_meta_hashes(ad_account_id: str) -> List[Dict[str, str]]:
                     error_count += 1
                     continue
                 
-                # Calculate perceptual hash
-                image_hash = imagehash.phash(image)
-                
-                # Store the result
-                meta_image_data.append({
+                # Calculate every requested hash from the one download
+                completed = batcher.add({
                     'ad_id': creative_id,
                     'platform': 'Meta',
-                    'phash': str(image_hash),
                     'creative_name': creative_name,
                     'thumbnail_url': thumbnail_url
-                })
-                
-                processed_count += 1
-                print(f"✅ Processed: {creative_name}")
+                }, image)
                 
                 # Add a small delay to be respectful to the API
                 time.sleep(0.1)
@@ -244,10 +287,17 @@ def get_meta_hashes(ad_account_id: str) -> List[Dict[str, str]]:
                 logger.error(f"Facebook API error for creative {creative_id}: {e}")
                 print(f"❌ Error: {creative_name} (API error)")
                 error_count += 1
+                continue
             except Exception as e:
                 logger.error(f"Unexpected error processing creative {creative_id}: {e}")
                 print(f"❌ Error: {creative_name} (unexpected error)")
                 error_count += 1
+                continue
+            
+            # Emit the results of any batch this creative completed
+            yield from emit(completed)
+        
+        yield from emit(batcher.flush())
         
         print("=" * 60)
         print(f"Processing complete!")
@@ -262,21 +312,34 @@ def get_meta_hashes(ad_account_id: str) -> List[Dict[str, str]]:
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         raise
-    
-    return meta_image_data
 
 
-def get_google_hashes(customer_id: str) -> List[Dict[str, str]]:
+def get_meta_hashes(ad_account_id: str, algorithms: Sequence[str] = DEFAULT_HASHES) -> List[Dict[str, str]]:
     """
-    Fetch all image-based ad creatives from Google Ads API and generate perceptual hashes.
+    Fetch all ad creatives from Meta Marketing API and generate perceptual hashes.
     
     Args:
-        customer_id: Google Ads customer ID (without dashes)
+        ad_account_id: Meta ad account ID (e.g., 'act_123456789')
+        algorithms: Hash algorithms to compute per creative; each becomes a column
         
     Returns:
         List of dictionaries containing ad_id, platform, and phash
     """
-    google_image_data = []
+    return list(iter_meta_hashes(ad_account_id, algorithms))
+
+
+def iter_google_hashes(customer_id: str, algorithms: Sequence[str] = DEFAULT_HASHES) -> Iterator[Dict[str, str]]:
+    """
+    Fetch all image-based ad creatives from Google Ads API and generate perceptual hashes,
+    yielding each row as soon as it is available.
+    
+    Args:
+        customer_id: Google Ads customer ID (without dashes)
+        algorithms: Hash algorithms to compute per creative; each becomes a column
+        
+    Yields:
+        Dictionaries containing ad_id, platform, and phash
+    """
     processed_count = 0
     skipped_count = 0
     error_count = 0
@@ -315,6 +378,16 @@ def get_google_hashes(customer_id: str) -> List[Dict[str, str]]:
         print(f"Processing Google Ads creatives...")
         print("=" * 60)
         
+        # Images are queued and their phash computed in vectorized batches
+        batcher = BatchHasher(algorithms)
+        
+        def emit(completed: List[Tuple[Dict[str, str], Dict[str, str]]]) -> Iterator[Dict[str, str]]:
+            nonlocal processed_count
+            for creative_info, hashes in completed:
+                processed_count += 1
+                print(f"✅ Processed: {creative_info['creative_name']} ({creative_info['image_source']})")
+                yield build_platform_row(creative_info, hashes)
+        
         # Process each ad group ad
         for row in response:
             try:
@@ -347,21 +420,14 @@ def get_google_hashes(customer_id: str) -> List[Dict[str, str]]:
                     skipped_count += 1
                     continue
                 
-                # Calculate perceptual hash
-                image_hash = imagehash.phash(image)
-                
-                # Store the result
-                google_image_data.append({
+                # Calculate every requested hash from the one download
+                completed = batcher.add({
                     'ad_id': str(ad_id),
                     'platform': 'Google',
-                    'phash': str(image_hash),
                     'creative_name': ad_name,
                     'asset_name': asset_name,
                     'image_source': image_source
-                })
-                
-                processed_count += 1
-                print(f"✅ Processed: {ad_name} ({image_source})")
+                }, image)
                 
                 # Add a small delay to be respectful to the API
                 time.sleep(0.1)
@@ -370,10 +436,17 @@ def get_google_hashes(customer_id: str) -> List[Dict[str, str]]:
                 logger.error(f"Google Ads API error for ad {ad_id}: {e}")
                 print(f"❌ Error: {ad_name} (API error)")
                 error_count += 1
+                continue
             except Exception as e:
                 logger.error(f"Unexpected error processing ad {ad_id}: {e}")
                 print(f"❌ Error: {ad_name} (unexpected error)")
                 error_count += 1
+                continue
+            
+            # Emit the results of any batch this ad completed
+            yield from emit(completed)
+        
+        yield from emit(batcher.flush())
         
         print("=" * 60)
         print(f"Processing complete!")
@@ -388,46 +461,72 @@ def get_google_hashes(customer_id: str) -> List[Dict[str, str]]:
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         raise
+
+
+def get_google_hashes(customer_id: str, algorithms: Sequence[str] = DEFAULT_HASHES) -> List[Dict[str, str]]:
+    """
+    Fetch all image-based ad creatives from Google Ads API and generate perceptual hashes.
     
-    return google_image_data
+    Args:
+        customer_id: Google Ads customer ID (without dashes)
+        algorithms: Hash algorithms to compute per creative; each becomes a column
+        
+    Returns:
+        List of dictionaries containing ad_id, platform, and phash
+    """
+    return list(iter_google_hashes(customer_id, algorithms))
 
 
-def save_to_csv(data: List[Dict[str, str]], output_file: str = "platform_creative_hashes_ALL.csv") -> None:
+def save_to_csv(data: Iterable[Dict[str, str]], output_file: str = "platform_creative_hashes_ALL.csv",
+                algorithms: Sequence[str] = DEFAULT_HASHES) -> Dict[str, int]:
     """
-    Save the creative data to a CSV file.
+    Stream the creative data to a CSV file.
+    
+    Rows are appended in batches as they arrive and the file is moved into
+    place atomically once all rows have been written. Meta and Google rows
+    share one header; columns a platform does not provide are left empty.
     
     Args:
-        data: List of dictionaries containing creative information
+        data: Iterable of dictionaries containing creative information
         output_file: Name of the output CSV file
+        algorithms: Hash algorithms present in the rows, one column each
+        
+    Returns:
+        Number of records saved per platform
     """
-    if not data:
-        logger.warning("No creative data to save.")
-        print("⚠️  No creative data to save.")
-        return
+    platform_counts = Counter()
+    fieldnames = platform_fieldnames(algorithms)
+    
+    def count(rows: Iterable[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+        for row in rows:
+            platform_counts[row.get('platform')] += 1
+            yield row
     
     try:
-        # Convert the list to a pandas DataFrame
-        df = pd.DataFrame(data)
-        
-        # Save to CSV
-        df.to_csv(output_file, index=False)
-        logger.info(f"Saved {len(data)} records to: {output_file}")
-        print(f"✅ Saved {len(data)} records to: {output_file}")
-        
-        # Display a preview of the data
-        print("\nPreview of generated data:")
-        print(df.head())
-        
-        # Show breakdown by platform
-        if 'platform' in df.columns:
-            platform_counts = df['platform'].value_counts()
-            print(f"\nPlatform breakdown:")
-            for platform, count in platform_counts.items():
-                print(f"  {platform}: {count} creatives")
-        
+        with StreamingHashWriter(output_file, fieldnames=fieldnames) as writer:
+            writer.write_many(count(data))
     except Exception as e:
         logger.error(f"Failed to save CSV file: {e}")
         raise
+    
+    if writer.rows_written == 0:
+        logger.warning("No creative data to save.")
+        print("⚠️  No creative data to save.")
+        return {}
+    
+    logger.info(f"Saved {writer.rows_written} records to: {output_file}")
+    print(f"✅ Saved {writer.rows_written} records to: {output_file}")
+    
+    # Display a preview of the data
+    print("\nPreview of generated data:")
+    print(pd.DataFrame(writer.preview, columns=fieldnames))
+    
+    # Show breakdown by platform
+    print(f"\nPlatform breakdown:")
+    for platform, platform_count in platform_counts.items():
+        print(f"  {platform}: {platform_count} creatives")
+    
+    return dict(platform_counts)
 
 
 def load_environment_variables() -> Dict[str, str]:
@@ -504,7 +603,14 @@ Examples:
     parser.add_argument(
         "-o", "--output",
         default="platform_creative_hashes_ALL.csv",
-        help="Output CSV filename (default: platform_creative_hashes_ALL.csv)"
+        help="Output CSV filename, or .parquet for Parquet (default: platform_creative_hashes_ALL.csv)"
+    )
+    
+    parser.add_argument(
+        "--hashes",
+        default="phash",
+        help="Comma-separated hashes to compute from each creative image: "
+             "phash, dhash, ahash, whash, colorhash (default: phash)"
     )
     
     parser.add_argument(
@@ -531,7 +637,12 @@ Examples:
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
-    all_platform_data = []
+    try:
+        algorithms = parse_hash_algorithms(args.hashes)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    platform_sources = []
     
     try:
         # Process Meta creatives
@@ -547,8 +658,7 @@ Examples:
             )
             
             print(f"📊 Fetching Meta creatives from ad account: {args.meta_ad_account_id}")
-            meta_data = get_meta_hashes(args.meta_ad_account_id)
-            all_platform_data.extend(meta_data)
+            platform_sources.append(iter_meta_hashes(args.meta_ad_account_id, algorithms))
         
         # Process Google Ads creatives
         if not args.meta_only:
@@ -557,24 +667,20 @@ Examples:
                 print("Please ensure google-ads.yaml exists or set required environment variables.")
             else:
                 print(f"📊 Fetching Google Ads creatives from customer: {args.google_customer_id}")
-                google_data = get_google_hashes(args.google_customer_id)
-                all_platform_data.extend(google_data)
+                platform_sources.append(iter_google_hashes(args.google_customer_id, algorithms))
         
-        # Save combined results to CSV
-        print("💾 Saving results to CSV...")
-        save_to_csv(all_platform_data, args.output)
+        # Stream combined results to CSV as they are produced
+        print("💾 Streaming results to CSV...")
+        platform_counts = save_to_csv(chain.from_iterable(platform_sources), args.output, algorithms)
         
         # Final summary
-        total_creatives = len(all_platform_data)
+        total_creatives = sum(platform_counts.values())
         print(f"\n🎉 Successfully processed and hashed {total_creatives} ad creatives!")
         
-        if all_platform_data:
-            df = pd.DataFrame(all_platform_data)
-            if 'platform' in df.columns:
-                platform_counts = df['platform'].value_counts()
-                print("Platform breakdown:")
-                for platform, count in platform_counts.items():
-                    print(f"  {platform}: {count} creatives")
+        if platform_counts:
+            print("Platform breakdown:")
+            for platform, count in platform_counts.items():
+                print(f"  {platform}: {count} creatives")
         
     except ValueError as e:
         logger.error(f"Configuration error: {e}")
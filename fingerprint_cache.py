@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Persistent Fingerprint Cache
+
+SQLite-backed cache of previously computed perceptual hashes, so repeated scans
+only decode and hash files that are new or have changed since the last run.
+
+Local files are keyed by (file_path, file_size, mtime_ns, algorithm_version);
+a cached entry is only reused when all four still match.
+
+Google Drive files are keyed by (file_id, md5Checksum, algorithm_version),
+with modifiedTime standing in for md5Checksum on files Drive has no checksum
+for. Both come with the folder listing, so unchanged files are never downloaded.
+"""
+
+import json
+import os
+import sqlite3
+from typing import Dict, Optional, Tuple
+
+# Number of writes buffered before committing to disk
+COMMIT_INTERVAL = 500
+
+
+class FingerprintCache:
+    """
+    Base class for the SQLite fingerprint caches.
+
+    Handles the connection, batched commits and hit/miss counters. Subclasses
+    declare their table (TABLE, KEY_COLUMN and the STATE_COLUMNS describing the
+    file when it was hashed) and when a stored entry is still valid (_unchanged).
+    """
+
+    TABLE = ''
+    KEY_COLUMN = ''
+    # (column name, SQL type) pairs
+    STATE_COLUMNS = ()
+
+    def __init__(self, db_path: str, algorithm_version: str):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            db_path: Path to the SQLite database file
+            algorithm_version: Identifier of the hashing pipeline; entries
+                written by a different version are treated as misses
+        """
+        self.db_path = db_path
+        self.algorithm_version = algorithm_version
+        self.hits = 0
+        self.misses = 0
+        self._pending_writes = 0
+
+        columns = ''.join(f"{name} {sql_type}, " for name, sql_type in self.STATE_COLUMNS)
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.TABLE} ({self.KEY_COLUMN} TEXT PRIMARY KEY, {columns}"
+            "algorithm_version TEXT NOT NULL, hashes TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _unchanged(self, stored: Tuple, current: Tuple) -> bool:
+        """
+        Whether a stored entry still describes the file.
+
+        Args:
+            stored: Values of STATE_COLUMNS when the file was hashed
+            current: Current values of STATE_COLUMNS
+
+        Returns:
+            True if the stored hashes can be reused
+        """
+        return stored == current
+
+    def _get(self, key: str, state: Tuple) -> Optional[Dict[str, str]]:
+        columns = ', '.join(name for name, _ in self.STATE_COLUMNS)
+        row = self._conn.execute(
+            f"SELECT {columns}, algorithm_version, hashes FROM {self.TABLE} WHERE {self.KEY_COLUMN} = ?",
+            (key,)
+        ).fetchone()
+
+        if row is None or row[-2] != self.algorithm_version or not self._unchanged(tuple(row[:-2]), state):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[-1])
+
+    def _put(self, key: str, state: Tuple, hashes: Dict[str, str]) -> None:
+        columns = [self.KEY_COLUMN] + [name for name, _ in self.STATE_COLUMNS] + ['algorithm_version', 'hashes']
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {self.TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            (key, *state, self.algorithm_version, json.dumps(hashes))
+        )
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        """Flush buffered writes to disk."""
+        self._conn.commit()
+        self._pending_writes = 0
+
+    def close(self) -> None:
+        """Commit outstanding writes and close the database."""
+        self.commit()
+        self._conn.close()
+
+    def __enter__(self) -> "FingerprintCache":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class LocalFingerprintCache(FingerprintCache):
+    """
+    Cache of local file hashes keyed by path, size, modification time and
+    hash algorithm version.
+    """
+
+    TABLE = 'local_fingerprints'
+    KEY_COLUMN = 'file_path'
+    STATE_COLUMNS = (('file_size', 'INTEGER NOT NULL'), ('mtime_ns', 'INTEGER NOT NULL'))
+
+    def get(self, file_path: str, file_size: int, mtime_ns: int) -> Optional[Dict[str, str]]:
+        """
+        Look up the cached hashes for a file.
+
+        Args:
+            file_path: Path to the file
+            file_size: Current size of the file in bytes
+            mtime_ns: Current modification time in nanoseconds
+
+        Returns:
+            Dictionary of hash columns if the entry is still valid, None otherwise
+        """
+        return self._get(os.path.abspath(file_path), (file_size, mtime_ns))
+
+    def put(self, file_path: str, file_size: int, mtime_ns: int, hashes: Dict[str, str]) -> None:
+        """
+        Store the hashes computed for a file, replacing any previous entry.
+
+        Args:
+            file_path: Path to the file
+            file_size: Size of the file in bytes when it was hashed
+            mtime_ns: Modification time in nanoseconds when it was hashed
+            hashes: Dictionary of hash columns
+        """
+        self._put(os.path.abspath(file_path), (file_size, mtime_ns), hashes)
+
+
+class DriveFingerprintCache(FingerprintCache):
+    """
+    Cache of Google Drive file hashes keyed by file id, content checksum
+    (or modification time) and hash algorithm version.
+    """
+
+    TABLE = 'drive_fingerprints'
+    KEY_COLUMN = 'file_id'
+    STATE_COLUMNS = (('md5_checksum', 'TEXT'), ('modified_time', 'TEXT'))
+
+    def _unchanged(self, stored: Tuple, current: Tuple) -> bool:
+        # Files without a checksum are compared by modifiedTime instead
+        md5_checksum, modified_time = current
+        if md5_checksum:
+            return stored[0] == md5_checksum
+        return modified_time is not None and stored[1] == modified_time
+
+    def get(self, file_id: str, md5_checksum: Optional[str], modified_time: Optional[str]) -> Optional[Dict[str, str]]:
+        """
+        Look up the cached hashes for a Drive file.
+
+        The entry is valid when the file's md5Checksum is unchanged; files
+        without a checksum are compared by modifiedTime instead.
+
+        Args:
+            file_id: Google Drive file ID
+            md5_checksum: Current md5Checksum of the file, if Drive has one
+            modified_time: Current modifiedTime of the file
+
+        Returns:
+            Dictionary of hash columns if the entry is still valid, None otherwise
+        """
+        return self._get(file_id, (md5_checksum, modified_time))
+
+    def put(self, file_id: str, md5_checksum: Optional[str], modified_time: Optional[str],
+            hashes: Dict[str, str]) -> None:
+        """
+        Store the hashes computed for a Drive file, replacing any previous entry.
+
+        Args:
+            file_id: Google Drive file ID
+            md5_checksum: md5Checksum of the file when it was hashed, if any
+            modified_time: modifiedTime of the file when it was hashed
+            hashes: Dictionary of hash columns
+        """
+        self._put(file_id, (md5_checksum, modified_time), hashes)
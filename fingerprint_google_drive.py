@@ -2,7 +2,7 @@
 """
 Script 1: Fingerprint Google Drive Creatives
 
-This script connects to Google Drive API, scans a specified Google Drive folder for images,
+This script connects to Google Drive API, scans a specified Google Drive folder and its subfolders for images,
 and generates perceptual hashes for each one, saving the results to a CSV file for later
 matching with ad platform data.
 
@@ -18,11 +18,15 @@ import sys
 import argparse
 import io
 import logging
-from typing import List, Dict, Optional
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Sequence, Tuple
 
-import imagehash
 import pandas as pd
-from PIL import Image, UnidentifiedImageError
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
@@ -30,6 +34,12 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 
+from drive_state import STATE_FILE_FIELDS, DriveSyncState
+from fingerprint_cache import DriveFingerprintCache
+from fingerprint_local_folder import chunked, hash_image_chunk, map_chunks
+from hash_writer import StreamingHashWriter
+from image_hashing import DEFAULT_HASHES, hash_pipeline_version, parse_hash_algorithms
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -44,13 +54,46 @@ logger = logging.getLogger(__name__)
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 
+# Files requested per files.list call (the API maximum)
+DRIVE_PAGE_SIZE = 1000
+
+# File fields requested from files.list
+DRIVE_FILE_FIELDS = ("nextPageToken, files(id, name, mimeType, size, md5Checksum, modifiedTime, webViewLink, "
+                     "shortcutDetails(targetId, targetMimeType))")
+
+# File fields requested for the target of a shortcut
+DRIVE_TARGET_FIELDS = "id, name, mimeType, size, md5Checksum, modifiedTime, webViewLink, trashed"
+
+# Fields requested from changes.list; parents place a changed file in (or out of) the tracked tree
+DRIVE_CHANGE_FIELDS = ("nextPageToken, newStartPageToken, changes(fileId, removed, changeType, "
+                       "file(id, name, mimeType, size, md5Checksum, modifiedTime, webViewLink, parents, trashed, "
+                       "shortcutDetails(targetId, targetMimeType)))")
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SHORTCUT_MIME_TYPE = 'application/vnd.google-apps.shortcut'
+
+# Folders listed concurrently when walking a folder tree
+DEFAULT_LIST_WORKERS = 16
+
+# Retries (with exponential backoff) of API calls failing with rate limit or server errors
+DRIVE_API_RETRIES = 5
+
+# Files downloaded concurrently
+DEFAULT_DOWNLOAD_WORKERS = 8
+
+# Downloads queued per download thread before waiting for results
+DOWNLOADS_IN_FLIGHT_PER_WORKER = 2
+
+# Downloaded images handed to a hashing worker process per task
+DEFAULT_DRIVE_CHUNK_SIZE = 16
+
 
-def authenticate_google_drive() -> Optional[object]:
+def load_drive_credentials() -> Optional[Credentials]:
     """
-    Authenticate with Google Drive API using OAuth2.
+    Load (refreshing or authorizing as needed) the OAuth2 credentials for Google Drive.
     
     Returns:
-        Google Drive service object if successful, None if failed
+        Credentials if successful, None if failed
     """
     creds = None
     
@@ -87,16 +130,231 @@ def authenticate_google_drive() -> Optional[object]:
         except Exception as e:
             logger.warning(f"Failed to save token: {e}")
     
+    return creds
+
+
+def build_drive_service(creds: Credentials) -> Optional[object]:
+    """
+    Build a Google Drive service object.
+    
+    Each service object has its own HTTP connection, which is not thread-safe,
+    so every thread that calls the API needs its own service.
+    
+    Args:
+        creds: Credentials from load_drive_credentials
+        
+    Returns:
+        Google Drive service object if successful, None if failed
+    """
     try:
-        # Build the service object
-        service = build('drive', 'v3', credentials=creds)
-        logger.info("Successfully authenticated with Google Drive API")
-        return service
+        return build('drive', 'v3', credentials=creds)
     except Exception as e:
         logger.error(f"Failed to build service: {e}")
         return None
 
 
+def iter_drive_pages(service: object, query: str, fields: str = DRIVE_FILE_FIELDS,
+                     page_size: int = DRIVE_PAGE_SIZE) -> Iterator[List[Dict]]:
+    """
+    Run a files.list query, following nextPageToken until the last page.
+    
+    Args:
+        service: Google Drive service object
+        query: Drive search query, e.g. "'<folder id>' in parents and trashed=false"
+        fields: Fields to request; must include nextPageToken
+        page_size: Files requested per call
+        
+    Yields:
+        The files of each page, as soon as the page arrives
+    """
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=query,
+            fields=fields,
+            pageSize=page_size,
+            pageToken=page_token
+        ).execute(num_retries=DRIVE_API_RETRIES)
+        
+        yield results.get('files', [])
+        
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+
+class DriveServicePool:
+    """
+    One Google Drive service object per thread, all sharing the same credentials.
+    
+    A service object's HTTP connection (httplib2) is not thread-safe, so
+    threads calling the API concurrently each need their own.
+    """
+    
+    def __init__(self, creds: Credentials, build_service: Optional[Callable[[Credentials], Optional[object]]] = None):
+        """
+        Args:
+            creds: Credentials from load_drive_credentials
+            build_service: Builds a service object from the credentials
+                (default: build_drive_service; e.g. drive_stand_in.DriveStandIn.build_service)
+        """
+        self.creds = creds
+        self.build_service = build_service
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+    
+    def get(self) -> object:
+        """
+        The calling thread's service object, built on first use.
+        
+        Expired credentials are refreshed here, by one thread at a time, so the
+        threads do not all refresh the shared token at once when it runs out.
+        
+        Raises:
+            Exception: If the service cannot be built
+        """
+        if self.creds is not None and not self.creds.valid:
+            with self._refresh_lock:
+                if not self.creds.valid and self.creds.refresh_token:
+                    self.creds.refresh(Request())
+        
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = (self.build_service or build_drive_service)(self.creds)
+            if service is None:
+                raise Exception("Failed to build Google Drive service")
+            self._local.service = service
+        return service
+
+
+def iter_folder_tree(services: DriveServicePool, folder_id: str, workers: int = DEFAULT_LIST_WORKERS,
+                     max_depth: Optional[int] = None, page_size: int = DRIVE_PAGE_SIZE,
+                     folders: Optional[Dict[str, Dict]] = None,
+                     shortcuts: Optional[Dict[str, Dict]] = None) -> Iterator[Dict]:
+    """
+    List every file in a Google Drive folder and its subfolders.
+    
+    Folders are listed concurrently by a pool of worker threads, each with its
+    own service object. A worker lists its folder page by page, hands each page
+    to the caller as it arrives and submits the subfolders it finds straight
+    away, so walking a deep tree takes about as long as its longest chain of
+    nested listings (given enough workers) rather than the sum of all listings.
+    
+    Folders reachable through several parents or through shortcuts are listed
+    once, and each file (including shortcut targets) is yielded once.
+    
+    Args:
+        services: Service objects for the worker threads
+        folder_id: Google Drive folder ID of the root
+        workers: Folders listed at the same time
+        max_depth: Maximum subfolder depth to descend into (None = unlimited, 0 = root only)
+        page_size: Files requested per call
+        folders: Optional dictionary filled with the subfolders walked, as
+            {folder id: {'parent': parent folder id, 'name': name, 'source_id':
+            id of the listed item (the shortcut for folders reached through one)}}
+        shortcuts: Optional dictionary filled with every shortcut to a file, as
+            {shortcut id: {'folder_id': folder it is in, 'target_id': file id}},
+            including those to files already reached another way
+        
+    Yields:
+        File resources (id, name, mimeType, size, webViewLink) of everything
+        that is not a folder, with folder_path set to the path of their folder
+        relative to the root (e.g. 'brand/campaign/300x250'), folder_id to the
+        folder's id and source_id to the id of the listed item (the shortcut
+        for files reached through one), in the order their pages arrive
+        
+    Raises:
+        HttpError: If a folder cannot be listed
+    """
+    pages = queue.Queue()
+    finished = object()
+    stopped = threading.Event()
+    lock = threading.Lock()
+    seen_folders = {folder_id}
+    seen_files = set()
+    pending_folders = 1
+    
+    def resolve_shortcut(service: object, item: Dict) -> Optional[Dict]:
+        target_id = item['shortcutDetails']['targetId']
+        try:
+            target = service.files().get(fileId=target_id, fields=DRIVE_TARGET_FIELDS).execute(
+                num_retries=DRIVE_API_RETRIES)
+        except HttpError as e:
+            logger.warning(f"Cannot resolve shortcut {item['name']} to {target_id}: {e}")
+            return None
+        return None if target.get('trashed') else target
+    
+    def list_folder(current_id: str, path: str, depth: int) -> None:
+        nonlocal pending_folders
+        try:
+            service = services.get()
+            query = f"'{current_id}' in parents and trashed=false"
+            for page in iter_drive_pages(service, query, DRIVE_FILE_FIELDS, page_size):
+                files = []
+                for item in page:
+                    details = item.get('shortcutDetails') if item['mimeType'] == SHORTCUT_MIME_TYPE else None
+                    target_id = details['targetId'] if details else item['id']
+                    target_type = details['targetMimeType'] if details else item['mimeType']
+                    
+                    if target_type == FOLDER_MIME_TYPE:
+                        if max_depth is not None and depth >= max_depth:
+                            continue
+                        with lock:
+                            if target_id in seen_folders:
+                                continue
+                            seen_folders.add(target_id)
+                            pending_folders += 1
+                            if folders is not None:
+                                folders[target_id] = {'parent': current_id, 'name': item['name'],
+                                                      'source_id': item['id']}
+                        subfolder_path = f"{path}/{item['name']}" if path else item['name']
+                        executor.submit(list_folder, target_id, subfolder_path, depth + 1)
+                        continue
+                    
+                    with lock:
+                        if details and shortcuts is not None:
+                            shortcuts[item['id']] = {'folder_id': current_id, 'target_id': target_id}
+                        if target_id in seen_files:
+                            continue
+                        seen_files.add(target_id)
+                    source_id = item['id']
+                    if details:
+                        item = resolve_shortcut(service, item)
+                        if item is None:
+                            continue
+                    files.append({**item, 'folder_path': path, 'folder_id': current_id, 'source_id': source_id})
+                
+                pages.put(files)
+                if stopped.is_set():
+                    return
+        except BaseException as e:
+            pages.put(e)
+        finally:
+            with lock:
+                pending_folders -= 1
+                done = pending_folders == 0
+            if done:
+                pages.put(finished)
+    
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-list")
+    try:
+        executor.submit(list_folder, folder_id, '', 0)
+        listed = 0
+        while True:
+            page = pages.get()
+            if page is finished:
+                break
+            if isinstance(page, BaseException):
+                raise page
+            listed += len(page)
+            yield from page
+        logger.info(f"Listed {listed} files in {len(seen_folders)} folders")
+    finally:
+        # Lets the workers stop after their current page if the caller stops early
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def is_image_mime_type(mime_type: str) -> bool:
     """
     Check if a file is an image based on its MIME type.
@@ -114,188 +372,859 @@ def is_image_mime_type(mime_type: str) -> bool:
     return mime_type.lower() in image_mime_types
 
 
-def download_image_from_drive(service: object, file_id: str) -> Optional[Image.Image]:
+def download_file_from_drive(service: object, file_id: str) -> bytes:
     """
-    Download an image from Google Drive and return it as a PIL Image object.
+    Download a file's content from Google Drive.
     
     Args:
         service: Google Drive service object
         file_id: ID of the file to download
         
     Returns:
-        PIL Image object if successful, None if failed
-    """
-    try:
-        # Create a BytesIO object to store the downloaded file
-        file_io = io.BytesIO()
+        The file's bytes
         
-        # Download the file
-        request = service.files().get_media(fileId=file_id)
-        downloader = MediaIoBaseDownload(file_io, request)
+    Raises:
+        HttpError: If the download fails after DRIVE_API_RETRIES retries
+    """
+    # Create a BytesIO object to store the downloaded file
+    file_io = io.BytesIO()
+    
+    # Download the file
+    request = service.files().get_media(fileId=file_id)
+    downloader = MediaIoBaseDownload(file_io, request)
+    
+    done = False
+    while not done:
+        status, done = downloader.next_chunk(num_retries=DRIVE_API_RETRIES)
+        if status:
+            logger.debug(f"Download {int(status.progress() * 100)}%")
+    
+    logger.debug(f"Successfully downloaded file: {file_id}")
+    return file_io.getvalue()
+
+
+def iter_drive_downloads(services: DriveServicePool, files: Iterable[Dict],
+                         workers: int = DEFAULT_DOWNLOAD_WORKERS,
+                         skip: Optional[Callable[[Dict], bool]] = None) -> Iterator[Tuple[Dict, Optional[bytes], Optional[str]]]:
+    """
+    Download files on a pool of threads, each with its own service object.
+    
+    Downloads are bound by request latency rather than bandwidth, so running
+    several at once raises throughput until Drive's rate limits are reached
+    (rate-limited requests are retried with backoff). Only a bounded number
+    of downloads is queued at a time, so files is consumed lazily.
+    
+    Args:
+        services: Service objects for the download threads
+        files: File resources to download
+        workers: Downloads running at the same time
+        skip: Optional predicate for files that need no download (e.g. cache
+            hits); those are yielded as soon as they are read from files
         
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            if status:
-                logger.debug(f"Download {int(status.progress() * 100)}%")
+    Yields:
+        (file, content or None, error message or None), in completion order;
+        skipped files come with neither content nor error
+    """
+    def fetch(file: Dict) -> Tuple[Dict, Optional[bytes], Optional[str]]:
+        try:
+            return file, download_file_from_drive(services.get(), file['id']), None
+        except HttpError as e:
+            logger.warning(f"HTTP error downloading file {file['id']}: {e}")
+            return file, None, f"HTTP error {e.resp.status}"
+        except Exception as e:
+            logger.warning(f"Unexpected error downloading file {file['id']}: {e}")
+            return file, None, str(e)
+    
+    max_in_flight = workers * DOWNLOADS_IN_FLIGHT_PER_WORKER
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-download")
+    try:
+        pending = set()
+        for file in files:
+            if skip is not None and skip(file):
+                yield file, None, None
+                continue
+            pending.add(executor.submit(fetch, file))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
         
-        # Reset the file pointer to the beginning
-        file_io.seek(0)
+        for future in as_completed(pending):
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def hash_drive_files(services: DriveServicePool, files: Iterable[Dict], fast_decode: bool = False,
+                     algorithms: Sequence[str] = DEFAULT_HASHES,
+                     download_workers: int = DEFAULT_DOWNLOAD_WORKERS, workers: int = 1,
+                     chunk_size: int = DEFAULT_DRIVE_CHUNK_SIZE,
+                     cache: Optional[DriveFingerprintCache] = None) -> Iterator[Tuple[Dict, Dict[str, str]]]:
+    """
+    Download and hash Drive files, yielding each file's hashes as soon as they are available.
+    
+    Files are downloaded by a thread pool as they arrive from files (e.g. while
+    the folder tree is still being listed), and the downloaded images are
+    decoded and hashed in chunks, on worker processes when workers > 1. Files
+    found in the cache with an unchanged md5Checksum are not downloaded at all.
+    Non-image files are skipped; files that fail are reported and left out.
+    
+    Args:
+        services: Service objects for the download threads
+        files: File resources, as listed by iter_folder_tree
+        fast_decode: Decode images at reduced resolution straight to grayscale
+        algorithms: Hash algorithms to compute per image; each becomes a column
+        download_workers: Files downloaded concurrently
+        workers: Number of hashing processes (1 hashes in-process)
+        chunk_size: Downloaded images handed to a hashing process per task
+        cache: Optional fingerprint cache; unchanged files reuse their stored hashes
         
-        # Open the image from the BytesIO object
-        image = Image.open(file_io)
+    Yields:
+        (file resource, dictionary of hash columns), in completion order
+    """
+    listed_count = 0
+    processed_count = 0
+    skipped_count = 0
+    cached_count = 0
+    error_count = 0
+    
+    # Hashes of the listed files found in the cache, until their chunk is emitted
+    cached_hashes = {}
+    
+    if cache is not None:
+        print(f"Using fingerprint cache: {cache.db_path}")
+    
+    def image_files(files: Iterable[Dict]) -> Iterator[Dict]:
+        nonlocal listed_count, skipped_count
+        for file in files:
+            listed_count += 1
+            # Check if the file is an image
+            if not is_image_mime_type(file['mimeType']):
+                logger.info(f"Skipping non-image file: {file['name']} ({file['mimeType']})")
+                print(f"⏭️  Skipped: {file['name']} (not an image)")
+                skipped_count += 1
+                continue
+            
+            # Resolve cache hits from the listing; only misses are downloaded
+            cached = cache.get(file['id'], file.get('md5Checksum'), file.get('modifiedTime')) if cache else None
+            if cached is not None:
+                cached_hashes[file['id']] = cached
+            yield file
+    
+    def hash_tasks(downloads: Iterable[Tuple[Dict, Optional[bytes], Optional[str]]]) -> Iterator[Tuple[List[Tuple[Dict, Optional[Dict[str, str]]]], List[Tuple[str, bytes]]]]:
+        nonlocal error_count
+        for chunk in chunked(downloads, chunk_size):
+            entries, payload = [], []
+            for file, content, error in chunk:
+                cached = cached_hashes.pop(file['id'], None)
+                if cached is None and content is None:
+                    print(f"❌ Failed: {file['name']} (download failed: {error})")
+                    error_count += 1
+                    continue
+                entries.append((file, cached))
+                if cached is None:
+                    payload.append((file['name'], content))
+            yield entries, payload
+    
+    downloads = iter_drive_downloads(services, image_files(files), download_workers,
+                                     skip=lambda file: file['id'] in cached_hashes)
+    
+    # Each chunk of downloaded images is decoded and hashed in one vectorized
+    # batch; chunks made only of cache hits pass straight through
+    hash_chunk = partial(hash_image_chunk, fast_decode=fast_decode, algorithms=tuple(algorithms))
+    for entries, results in map_chunks(hash_chunk, hash_tasks(downloads), workers, ordered=False):
+        miss_results = iter(results)
+        for file, cached in entries:
+            if cached is not None:
+                cached_count += 1
+                print(f"✅ Processed (cached): {file['name']}")
+                yield file, cached
+                continue
+            
+            hashes, error = next(miss_results)
+            if hashes is None:
+                logger.warning(f"Failed to hash image {file['name']}: {error}")
+                print(f"❌ Error: {file['name']} (processing error)")
+                error_count += 1
+                continue
+            if cache is not None:
+                cache.put(file['id'], file.get('md5Checksum'), file.get('modifiedTime'), hashes)
+            processed_count += 1
+            print(f"✅ Processed: {file['name']}")
+            yield file, hashes
+    
+    if cache is not None:
+        cache.commit()
+    
+    if not listed_count:
+        print("No files found in the specified folder.")
+        return
+    
+    print("=" * 60)
+    print(f"Processing complete!")
+    print(f"📄 Listed: {listed_count} files")
+    print(f"✅ Successfully processed: {processed_count + cached_count} images")
+    if cache is not None:
+        print(f"♻ Reused from cache: {cached_count} images")
+    print(f"⏭️  Skipped (not images): {skipped_count} files")
+    print(f"❌ Errors: {error_count} files")
+    print("=" * 60)
+
+
+def iter_hashes_from_drive(folder_id: str, fast_decode: bool = False,
+                           algorithms: Sequence[str] = DEFAULT_HASHES, max_depth: Optional[int] = None,
+                           list_workers: int = DEFAULT_LIST_WORKERS,
+                           download_workers: int = DEFAULT_DOWNLOAD_WORKERS, workers: int = 1,
+                           chunk_size: int = DEFAULT_DRIVE_CHUNK_SIZE,
+                           cache: Optional[DriveFingerprintCache] = None) -> Iterator[Dict[str, str]]:
+    """
+    Generate perceptual hashes for all images in the specified Google Drive folder
+    and its subfolders, yielding each row as soon as it is available.
+    
+    Listing, downloading and hashing overlap: the folder tree is listed by one
+    thread pool while hash_drive_files downloads and hashes the files as they
+    are listed. Rows are yielded in completion order.
+    
+    Args:
+        folder_id: Google Drive folder ID
+        fast_decode: Decode images at reduced resolution straight to grayscale
+        algorithms: Hash algorithms to compute per image; each becomes a column
+        max_depth: Maximum subfolder depth to scan (None = unlimited, 0 = the folder only)
+        list_workers: Folders listed concurrently
+        download_workers: Files downloaded concurrently
+        workers: Number of hashing processes (1 hashes in-process)
+        chunk_size: Downloaded images handed to a hashing process per task
+        cache: Optional fingerprint cache; unchanged files reuse their stored hashes
         
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+    Yields:
+        Dictionaries containing filename and perceptual hash pairs
         
-        logger.debug(f"Successfully downloaded image: {file_id}")
-        return image
+    Raises:
+        ValueError: If folder_id is invalid
+        Exception: If authentication or API calls fail
+    """
+    # Authenticate with Google Drive; listing and downloads run in worker threads,
+    # which get service objects of their own since HTTP connections are not thread-safe
+    creds = load_drive_credentials()
+    if not creds:
+        raise Exception("Failed to authenticate with Google Drive API")
+    services = DriveServicePool(creds)
+    services.get()
+    logger.info("Successfully authenticated with Google Drive API")
+    
+    print(f"Scanning Google Drive folder: {folder_id}")
+    print("=" * 60)
+    
+    try:
+        # The folder tree is listed in the background; downloads start with the first page
+        files = iter_folder_tree(services, folder_id, list_workers, max_depth)
+        for file, hashes in hash_drive_files(services, files, fast_decode, algorithms, download_workers,
+                                             workers, chunk_size, cache):
+            yield build_drive_row(file, hashes)
         
     except HttpError as e:
-        logger.warning(f"HTTP error downloading file {file_id}: {e}")
-        return None
-    except UnidentifiedImageError as e:
-        logger.warning(f"Invalid image format for file {file_id}: {e}")
-        return None
+        logger.error(f"Google Drive API error: {e}")
+        raise Exception(f"Google Drive API error: {e}")
     except Exception as e:
-        logger.warning(f"Unexpected error downloading file {file_id}: {e}")
-        return None
+        logger.error(f"Unexpected error: {e}")
+        raise
+
+
+def build_drive_row(file: Dict, hashes: Dict[str, str]) -> Dict[str, str]:
+    """
+    Build an output row from Drive file metadata and its computed hashes.
+    
+    Args:
+        file: File resource returned by files.list
+        hashes: Dictionary of hash columns
+        
+    Returns:
+        Output row dictionary
+    """
+    return {
+        'filename': file['name'],
+        **hashes,
+        'file_id': file['id'],
+        'file_size': int(file.get('size', 0)),
+        'web_link': file.get('webViewLink', ''),
+        'folder_path': file.get('folder_path', '')
+    }
 
 
-def generate_hashes_from_drive(folder_id: str) -> List[Dict[str, str]]:
+def generate_hashes_from_drive(folder_id: str, fast_decode: bool = False,
+                               algorithms: Sequence[str] = DEFAULT_HASHES, max_depth: Optional[int] = None,
+                               list_workers: int = DEFAULT_LIST_WORKERS,
+                               download_workers: int = DEFAULT_DOWNLOAD_WORKERS, workers: int = 1,
+                               chunk_size: int = DEFAULT_DRIVE_CHUNK_SIZE,
+                               cache: Optional[DriveFingerprintCache] = None) -> List[Dict[str, str]]:
     """
     Generate perceptual hashes for all images in the specified Google Drive folder.
     
     Args:
         folder_id: Google Drive folder ID
+        fast_decode: Decode images at reduced resolution straight to grayscale
+        algorithms: Hash algorithms to compute per image; each becomes a column
+        max_depth: Maximum subfolder depth to scan (None = unlimited, 0 = the folder only)
+        list_workers: Folders listed concurrently
+        download_workers: Files downloaded concurrently
+        workers: Number of hashing processes (1 hashes in-process)
+        chunk_size: Downloaded images handed to a hashing process per task
+        cache: Optional fingerprint cache; unchanged files reuse their stored hashes
         
     Returns:
         List of dictionaries containing filename and perceptual hash pairs
+    """
+    return list(iter_hashes_from_drive(folder_id, fast_decode, algorithms, max_depth, list_workers,
+                                       download_workers, workers, chunk_size, cache))
+
+
+def get_start_page_token(service: object) -> str:
+    """
+    The current position in the Drive change log.
+    
+    Args:
+        service: Google Drive service object
         
-    Raises:
-        ValueError: If folder_id is invalid
-        Exception: If authentication or API calls fail
+    Returns:
+        Page token from which changes.list reports every later change
     """
-    # Authenticate with Google Drive
-    service = authenticate_google_drive()
-    if not service:
-        raise Exception("Failed to authenticate with Google Drive API")
+    return service.changes().getStartPageToken().execute(num_retries=DRIVE_API_RETRIES)['startPageToken']
+
+
+def list_drive_changes(service: object, page_token: str,
+                       page_size: int = DRIVE_PAGE_SIZE) -> Tuple[List[Dict], str]:
+    """
+    Fetch every change since a page token, following nextPageToken until the last page.
     
-    image_data = []
-    processed_count = 0
-    skipped_count = 0
-    error_count = 0
+    Args:
+        service: Google Drive service object
+        page_token: Token saved from the previous sync (or from get_start_page_token)
+        page_size: Changes requested per call
+        
+    Returns:
+        (changes in log order, token to resume from next time)
+    """
+    changes = []
+    while True:
+        results = service.changes().list(
+            pageToken=page_token,
+            fields=DRIVE_CHANGE_FIELDS,
+            pageSize=page_size,
+            includeRemoved=True,
+            spaces='drive'
+        ).execute(num_retries=DRIVE_API_RETRIES)
+        
+        changes.extend(results.get('changes', []))
+        
+        if 'newStartPageToken' in results:
+            return changes, results['newStartPageToken']
+        page_token = results['nextPageToken']
+
+
+def drive_folder_paths(folders: Dict[str, Dict], root_id: str,
+                       max_depth: Optional[int] = None) -> Dict[str, Tuple[str, int]]:
+    """
+    Path and depth of every tracked folder that is still part of the tree.
     
-    print(f"Scanning Google Drive folder: {folder_id}")
-    print("=" * 60)
+    Folders whose parent chain no longer leads to the root (because they, or a
+    folder above them, were trashed or moved elsewhere) are left out, as are
+    folders deeper than max_depth.
+    
+    Args:
+        folders: Tracked folders, as kept by DriveSyncState
+        root_id: Google Drive folder ID of the root
+        max_depth: Maximum subfolder depth (None = unlimited)
+        
+    Returns:
+        Dictionary of (path relative to the root, depth) keyed by folder id
+    """
+    if root_id not in folders:
+        return {}
+    
+    children = {}
+    for folder_id, folder in folders.items():
+        if folder_id != root_id:
+            children.setdefault(folder['parent'], []).append(folder_id)
+    
+    paths = {root_id: ('', 0)}
+    stack = [root_id]
+    while stack:
+        path, depth = paths[stack[-1]]
+        for child_id in children.get(stack.pop(), []):
+            if child_id in paths or (max_depth is not None and depth >= max_depth):
+                continue
+            name = folders[child_id]['name']
+            paths[child_id] = (f"{path}/{name}" if path else name, depth + 1)
+            stack.append(child_id)
+    return paths
+
+
+def track_drive_file(files: Dict[str, Dict], file: Dict, folder_id: str, source_id: str) -> bool:
+    """
+    Record where a file was found, keeping its hashes if its content is unchanged.
     
+    Args:
+        files: Tracked files, as kept by DriveSyncState
+        file: Current file resource
+        folder_id: Tracked folder the file was found in
+        source_id: Id of the listed item (the shortcut for files reached through one)
+        
+    Returns:
+        True if the file has to be (re)hashed
+    """
+    file = {field: file[field] for field in STATE_FILE_FIELDS if field in file}
+    entry = files.get(file['id'])
+    unchanged = entry is not None and entry['hashes'] is not None and (
+        entry['file'].get('md5Checksum') == file['md5Checksum'] if file.get('md5Checksum')
+        else entry['file'].get('modifiedTime') == file.get('modifiedTime')
+    )
+    files[file['id']] = {'source_id': source_id, 'folder_id': folder_id, 'file': file,
+                         'hashes': entry['hashes'] if unchanged else None}
+    return not unchanged
+
+
+def fetch_drive_file(service: object, file_id: str) -> Optional[Dict]:
+    """
+    Look up a file's current metadata and parents.
+    
+    Args:
+        service: Google Drive API service object
+        file_id: Google Drive file ID
+        
+    Returns:
+        File resource, or None if it cannot be looked up
+    """
     try:
-        # List all files in the folder
-        query = f"'{folder_id}' in parents and trashed=false"
-        results = service.files().list(
-            q=query,
-            fields="nextPageToken, files(id, name, mimeType, size, webViewLink)",
-            pageSize=1000
-        ).execute()
+        return service.files().get(fileId=file_id, fields=f"{DRIVE_TARGET_FIELDS}, parents").execute(
+            num_retries=DRIVE_API_RETRIES)
+    except HttpError as e:
+        logger.warning(f"Cannot look up file {file_id}: {e}")
+        return None
+
+
+def rehome_drive_file(entry: Dict, file_id: str, shortcuts: Dict[str, Dict], folders: Dict[str, Dict]) -> bool:
+    """
+    Move a tracked file over to another shortcut to it in the tracked folders.
+    
+    Args:
+        entry: The file's entry, updated in place
+        file_id: Google Drive file ID
+        shortcuts: Tracked file shortcuts, as kept by DriveSyncState
+        folders: Folders still in the tree
         
-        files = results.get('files', [])
+    Returns:
+        True if a shortcut other than the entry's source was found
+    """
+    for shortcut_id, shortcut in shortcuts.items():
+        if shortcut['target_id'] == file_id and shortcut['folder_id'] in folders and shortcut_id != entry['source_id']:
+            entry.update(source_id=shortcut_id, folder_id=shortcut['folder_id'])
+            return True
+    return False
+
+
+def apply_drive_changes(services: DriveServicePool, changes: List[Dict], folders: Dict[str, Dict],
+                        shortcuts: Dict[str, Dict], files: Dict[str, Dict], root_id: str,
+                        max_depth: Optional[int] = None) -> List[str]:
+    """
+    Apply changes.list entries to a tracked folder tree, in place.
+    
+    Folders are updated first, so files can be placed in folders added by the
+    same batch. A folder moved or renamed within the tree keeps its contents
+    (their paths follow from the folder tree); a folder moved in from outside
+    has to be listed, since Drive only reports a change for the folder itself.
+    Files changed in content are marked for hashing; moves and renames only
+    update the tracked metadata. A file that leaves the tree the way it was
+    tracked stays if it is still reachable another way.
+    
+    Args:
+        services: Service objects (used to resolve shortcuts)
+        changes: Changes from list_drive_changes
+        folders: Tracked folders, as kept by DriveSyncState
+        shortcuts: Tracked file shortcuts, as kept by DriveSyncState
+        files: Tracked files, as kept by DriveSyncState
+        root_id: Google Drive folder ID of the root
+        max_depth: Maximum subfolder depth (None = unlimited)
         
-        if not files:
-            print("No files found in the specified folder.")
-            return image_data
+    Returns:
+        Ids of the folders to list because they are new to the tree (or now
+        shallower, so more of their subfolders fit under max_depth)
+    """
+    # Only the latest change per file matters: it carries the file's current state
+    latest = {}
+    for change in changes:
+        if change.get('changeType', 'file') == 'file':
+            latest.pop(change['fileId'], None)
+            latest[change['fileId']] = change
+    
+    def gone(change: Dict) -> bool:
+        return bool(change.get('removed') or not change.get('file') or change['file'].get('trashed'))
+    
+    def tracked_parent(file: Dict) -> Optional[str]:
+        return next((parent for parent in file.get('parents', []) if parent in folders), None)
+    
+    def target_type(file: Dict) -> str:
+        details = file.get('shortcutDetails') if file.get('mimeType') == SHORTCUT_MIME_TYPE else None
+        return details['targetMimeType'] if details else file.get('mimeType')
+    
+    old_paths = drive_folder_paths(folders, root_id, max_depth)
+    folder_by_source = {folder['source_id']: folder_id for folder_id, folder in folders.items() if folder_id != root_id}
+    new_folders = []
+    file_changes = []
+    
+    for item_id, change in latest.items():
+        file = change.get('file') or {}
+        if item_id == root_id:
+            if gone(change):
+                logger.warning(f"Tracked folder {root_id} was removed from Drive")
+                print(f"⚠️  The tracked folder was removed from Drive; all its files are dropped")
+                folders.clear()
+            continue
         
-        print(f"Found {len(files)} files in the folder")
+        tracked_id = folder_by_source.get(item_id)
+        if tracked_id is not None:
+            # A tracked folder (or the shortcut it was reached through) was trashed, moved or renamed
+            parent = None if gone(change) else tracked_parent(file)
+            if parent is not None and tracked_id in folders:
+                folders[tracked_id].update(parent=parent, name=file['name'])
+            else:
+                folders.pop(tracked_id, None)
+                if not gone(change):
+                    new_folders.append((item_id, file))
+        elif item_id in folders:
+            # The target of a folder shortcut; its place in the tree is the shortcut's
+            if gone(change):
+                folders.pop(item_id)
+        elif target_type(file) == FOLDER_MIME_TYPE:
+            if not gone(change):
+                new_folders.append((item_id, file))
+        else:
+            file_changes.append((item_id, change))
+    
+    # Add folders moved or created under tracked folders; a new folder may be
+    # the parent of another, so repeat until no more can be placed
+    relist = []
+    placed = True
+    while placed:
+        placed = False
+        for item_id, file in list(new_folders):
+            parent = tracked_parent(file)
+            if parent is None:
+                continue
+            new_folders.remove((item_id, file))
+            placed = True
+            details = file.get('shortcutDetails') if file['mimeType'] == SHORTCUT_MIME_TYPE else None
+            folder_id = details['targetId'] if details else item_id
+            if folder_id not in folders:
+                folders[folder_id] = {'parent': parent, 'name': file['name'], 'source_id': item_id}
+                if folder_id not in old_paths:
+                    relist.append(folder_id)
+    
+    paths = drive_folder_paths(folders, root_id, max_depth)
+    for folder_id in [folder_id for folder_id in folders if folder_id not in paths]:
+        del folders[folder_id]
+    if max_depth is not None:
+        relist += [folder_id for folder_id, (_, depth) in paths.items()
+                   if folder_id in old_paths and depth < old_paths[folder_id][1] and folder_id not in relist]
+    
+    service = services.get()
+    
+    def fetch(file_id: str) -> Optional[Dict]:
+        return fetch_drive_file(service, file_id)
+    
+    def drop(file_id: str, current: Optional[Dict]) -> None:
+        # The way a file was reached left the tree: fall back on its own folder
+        # or another shortcut to it, if the file itself still exists
+        entry = files[file_id]
+        parent = tracked_parent(current) if current is not None and not current.get('trashed') else None
+        if parent is not None:
+            track_drive_file(files, current, parent, file_id)
+            return
+        if current is not None and not current.get('trashed'):
+            if rehome_drive_file(entry, file_id, shortcuts, folders):
+                track_drive_file(files, current, entry['folder_id'], entry['source_id'])
+                return
+        del files[file_id]
+    
+    file_by_source = {entry['source_id']: file_id for file_id, entry in files.items()}
+    for item_id, change in file_changes:
+        file = change.get('file') or {}
+        parent = None if gone(change) else tracked_parent(file)
+        tracked_id = file_by_source.get(item_id)
         
-        # Process each file
-        for file in files:
-            file_id = file['id']
-            file_name = file['name']
-            mime_type = file['mimeType']
-            file_size = int(file.get('size', 0))
-            web_link = file.get('webViewLink', '')
-            
-            try:
-                # Check if the file is an image
-                if not is_image_mime_type(mime_type):
-                    logger.info(f"Skipping non-image file: {file_name} ({mime_type})")
-                    print(f"⏭️  Skipped: {file_name} (not an image)")
-                    skipped_count += 1
-                    continue
-                
-                # Download and process the image
-                image = download_image_from_drive(service, file_id)
-                if image is None:
-                    logger.warning(f"Failed to download image: {file_name}")
-                    print(f"❌ Failed: {file_name} (download failed)")
-                    error_count += 1
-                    continue
-                
-                # Calculate perceptual hash
-                image_hash = imagehash.phash(image)
-                
-                # Store the result
-                image_data.append({
-                    'filename': file_name,
-                    'phash': str(image_hash),
-                    'file_id': file_id,
-                    'file_size': file_size,
-                    'web_link': web_link
-                })
-                
-                processed_count += 1
-                print(f"✅ Processed: {file_name}")
-                
-            except Exception as e:
-                logger.error(f"Error processing file {file_name}: {e}")
-                print(f"❌ Error: {file_name} (processing error)")
-                error_count += 1
+        if file.get('mimeType') == SHORTCUT_MIME_TYPE or item_id in shortcuts:
+            # A shortcut to a file; the target is what gets hashed
+            shortcuts.pop(item_id, None)
+            target_id = file['shortcutDetails']['targetId'] if parent is not None else None
+            if parent is not None:
+                shortcuts[item_id] = {'folder_id': parent, 'target_id': target_id}
+            if tracked_id is not None and tracked_id == target_id:
+                files[tracked_id]['folder_id'] = parent
+            elif tracked_id is not None:
+                drop(tracked_id, fetch(tracked_id))
+            if parent is not None and target_id not in files:
+                target = fetch(target_id)
+                if target is not None and not target.get('trashed') and is_image_mime_type(target['mimeType']):
+                    track_drive_file(files, target, parent, item_id)
+        elif parent is not None:
+            if is_image_mime_type(file['mimeType']):
+                track_drive_file(files, file, parent, item_id)
+            elif tracked_id is not None:
+                del files[tracked_id]
+        elif tracked_id is not None:
+            # Trashed, deleted or moved out of the tree
+            drop(tracked_id, None if gone(change) else file)
+        elif item_id in files:
+            # The target of a file shortcut, which can live anywhere
+            if gone(change):
+                del files[item_id]
+            else:
+                entry = files[item_id]
+                track_drive_file(files, file, entry['folder_id'], entry['source_id'])
+    
+    return relist
+
+
+def drive_state_rows(folders: Dict[str, Dict], files: Dict[str, Dict], root_id: str,
+                     max_depth: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    Output rows of the hashed files in a tracked folder tree.
+    
+    Args:
+        folders: Tracked folders, as kept by DriveSyncState
+        files: Tracked files, as kept by DriveSyncState
+        root_id: Google Drive folder ID of the root
+        max_depth: Maximum subfolder depth (None = unlimited)
         
-        print("=" * 60)
-        print(f"Processing complete!")
-        print(f"✅ Successfully processed: {processed_count} images")
-        print(f"⏭️  Skipped (not images): {skipped_count} files")
-        print(f"❌ Errors: {error_count} files")
-        print("=" * 60)
+    Returns:
+        List of output row dictionaries
+    """
+    paths = drive_folder_paths(folders, root_id, max_depth)
+    return [build_drive_row({**entry['file'], 'folder_path': paths[entry['folder_id']][0]}, entry['hashes'])
+            for entry in files.values() if entry['hashes'] is not None and entry['folder_id'] in paths]
+
+
+def drive_row_changes(old_rows: List[Dict[str, str]], new_rows: List[Dict[str, str]],
+                      columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Change feed between two versions of the output, matched by file_id.
+    
+    Args:
+        old_rows: Rows of the previous sync
+        new_rows: Rows of this sync
+        columns: Output columns to report
         
+    Returns:
+        DataFrame with a 'change' column ('added', 'replaced' or 'removed')
+        followed by columns; removed rows carry their last values
+    """
+    old = {row['file_id']: row for row in old_rows}
+    new = {row['file_id']: row for row in new_rows}
+    records = [{'change': 'added', **row} for file_id, row in new.items() if file_id not in old]
+    records += [{'change': 'replaced', **row} for file_id, row in new.items() if file_id in old and old[file_id] != row]
+    records += [{'change': 'removed', **row} for file_id, row in old.items() if file_id not in new]
+    return pd.DataFrame(records, columns=['change'] + list(columns))
+
+
+def sync_drive_folder(services: DriveServicePool, state: DriveSyncState, folder_id: str, fast_decode: bool = False,
+                      algorithms: Sequence[str] = DEFAULT_HASHES, max_depth: Optional[int] = None,
+                      list_workers: int = DEFAULT_LIST_WORKERS,
+                      download_workers: int = DEFAULT_DOWNLOAD_WORKERS, workers: int = 1,
+                      chunk_size: int = DEFAULT_DRIVE_CHUNK_SIZE,
+                      cache: Optional[DriveFingerprintCache] = None) -> Tuple[List[Dict[str, str]], pd.DataFrame]:
+    """
+    Bring a Drive folder's hashes up to date through the Changes API.
+    
+    The first sync (or one with different options) takes a start page token
+    and then scans the whole folder tree. Later syncs only fetch the changes
+    logged since the saved token: new and modified images are downloaded and
+    hashed, moved and renamed files and folders only get their metadata
+    updated, and trashed, deleted or moved-out files are dropped. Files that
+    fail to download or hash are retried on the next sync.
+    
+    Args:
+        services: Service objects for the listing and download threads
+        state: Sync state of the folder
+        folder_id: Google Drive folder ID
+        fast_decode: Decode images at reduced resolution straight to grayscale
+        algorithms: Hash algorithms to compute per image; each becomes a column
+        max_depth: Maximum subfolder depth to scan (None = unlimited, 0 = the folder only)
+        list_workers: Folders listed concurrently
+        download_workers: Files downloaded concurrently
+        workers: Number of hashing processes (1 hashes in-process)
+        chunk_size: Downloaded images handed to a hashing process per task
+        cache: Optional fingerprint cache; unchanged files reuse their stored hashes
+        
+    Returns:
+        (every current output row, change feed from drive_row_changes)
+    """
+    options = {'folder_id': folder_id, 'max_depth': max_depth,
+               'algorithm_version': hash_pipeline_version(fast_decode, algorithms)}
+    service = services.get()
+    
+    previous = state.options()
+    page_token = state.page_token()
+    old_folders, old_shortcuts, old_files = state.folders(), state.shortcuts(), state.files()
+    old_rows = drive_state_rows(old_folders, old_files, previous['folder_id'], previous['max_depth']) if previous else []
+    reset = page_token is None or previous != options
+    
+    if reset:
+        if previous is not None:
+            print("⚠️  Scan options changed since the last sync; rescanning the whole folder")
+        # Taken before listing, so changes made during the scan are picked up by the next sync
+        new_token = get_start_page_token(service)
+        folders = {folder_id: {'parent': None, 'name': '', 'source_id': folder_id}}
+        shortcuts = {}
+        files = {}
+        relist = [folder_id]
+        print(f"Scanning Google Drive folder: {folder_id}")
+    else:
+        changes, new_token = list_drive_changes(service, page_token)
+        folders = {key: dict(folder) for key, folder in old_folders.items()}
+        shortcuts = dict(old_shortcuts)
+        files = {key: dict(entry) for key, entry in old_files.items()}
+        relist = apply_drive_changes(services, changes, folders, shortcuts, files, folder_id, max_depth)
+        print(f"🔄 {len(changes)} changes since the last sync, {len(relist)} new folders to list")
+    print("=" * 60)
+    
+    def pending_files() -> Iterator[Dict]:
+        queued = set()
+        # Changed files, and files that failed last time
+        for entry in list(files.values()):
+            if entry['hashes'] is None:
+                queued.add(entry['file']['id'])
+                yield entry['file']
+        
+        # Folders new to the tree are listed while those download
+        paths = drive_folder_paths(folders, folder_id, max_depth)
+        for relist_id in relist:
+            if relist_id not in paths:
+                continue
+            remaining_depth = None if max_depth is None else max_depth - paths[relist_id][1]
+            walked, walked_shortcuts = {}, {}
+            for item in iter_folder_tree(services, relist_id, list_workers, remaining_depth,
+                                         folders=walked, shortcuts=walked_shortcuts):
+                if (is_image_mime_type(item['mimeType']) and item['id'] not in queued
+                        and track_drive_file(files, item, item['folder_id'], item['source_id'])):
+                    queued.add(item['id'])
+                    yield files[item['id']]['file']
+            for subfolder_id, subfolder in walked.items():
+                folders.setdefault(subfolder_id, subfolder)
+            shortcuts.update(walked_shortcuts)
+    
+    try:
+        for file, hashes in hash_drive_files(services, pending_files(), fast_decode, algorithms, download_workers,
+                                             workers, chunk_size, cache):
+            files[file['id']]['hashes'] = hashes
     except HttpError as e:
         logger.error(f"Google Drive API error: {e}")
         raise Exception(f"Google Drive API error: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        raise
     
-    return image_data
+    # Drop whatever is no longer reachable from the root, unless another shortcut
+    # to it, or the file's own folder for one tracked through a shortcut, still is
+    paths = drive_folder_paths(folders, folder_id, max_depth)
+    folders = {key: folder for key, folder in folders.items() if key in paths}
+    shortcuts = {key: shortcut for key, shortcut in shortcuts.items() if shortcut['folder_id'] in paths}
+    for key, entry in list(files.items()):
+        if entry['folder_id'] in paths or rehome_drive_file(entry, key, shortcuts, folders):
+            continue
+        current = fetch_drive_file(service, key) if entry['source_id'] != key else None
+        parent = next((parent for parent in current.get('parents', []) if parent in folders), None) \
+            if current is not None and not current.get('trashed') else None
+        if parent is not None:
+            entry.update(source_id=key, folder_id=parent)
+        else:
+            del files[key]
+    
+    rows = drive_state_rows(folders, files, folder_id, max_depth)
+    columns = list(build_drive_row({'id': '', 'name': ''}, dict.fromkeys(algorithms, '')))
+    changes = drive_row_changes(old_rows, rows, columns)
+    
+    upserted = {key: entry for key, entry in files.items() if reset or entry != old_files.get(key)}
+    removed = [key for key in old_files if key not in files]
+    state.apply(options, new_token, folders, shortcuts, upserted, removed, reset)
+    
+    counts = changes['change'].value_counts()
+    print(f"🔄 Sync complete: {counts.get('added', 0)} added, {counts.get('replaced', 0)} replaced, "
+          f"{counts.get('removed', 0)} removed, {len(rows)} rows in total")
+    return rows, changes
 
 
-def save_to_csv(image_data: List[Dict[str, str]], output_file: str = "google_drive_creative_hashes.csv") -> None:
+def save_to_csv(image_data: Iterable[Dict[str, str]], output_file: str = "google_drive_creative_hashes.csv") -> int:
     """
-    Save the image data to a CSV file.
+    Stream the image data to a CSV file.
+    
+    Rows are appended in batches as they arrive and the file is moved into
+    place atomically once all rows have been written.
     
     Args:
-        image_data: List of dictionaries containing image information
+        image_data: Iterable of dictionaries containing image information
         output_file: Name of the output CSV file
+        
+    Returns:
+        Number of records saved
     """
-    if not image_data:
-        print("No image data to save.")
-        return
-    
     try:
-        # Convert the list to a pandas DataFrame
-        df = pd.DataFrame(image_data)
-        
-        # Save to CSV
-        df.to_csv(output_file, index=False)
-        logger.info(f"Saved {len(image_data)} records to: {output_file}")
-        print(f"✅ Saved {len(image_data)} records to: {output_file}")
-        
-        # Display a preview of the data
-        print("\nPreview of generated data:")
-        print(df.head())
-        
+        with StreamingHashWriter(output_file) as writer:
+            writer.write_many(image_data)
     except Exception as e:
         logger.error(f"Failed to save CSV file: {e}")
         raise
+    
+    if writer.rows_written == 0:
+        print("No image data to save.")
+        return 0
+    
+    logger.info(f"Saved {writer.rows_written} records to: {output_file}")
+    print(f"✅ Saved {writer.rows_written} records to: {output_file}")
+    
+    # Display a preview of the data
+    print("\nPreview of generated data:")
+    print(pd.DataFrame(writer.preview))
+    
+    return writer.rows_written
+
+
+def run_incremental_sync(args: argparse.Namespace, algorithms: Sequence[str], workers: int,
+                         cache: Optional[DriveFingerprintCache]) -> None:
+    """
+    Run --incremental: sync the folder once, or every --watch seconds, rewriting
+    the output (and the --changes feed) after each sync.
+    
+    Args:
+        args: Parsed command line arguments
+        algorithms: Hash algorithms to compute per image
+        workers: Number of hashing processes
+        cache: Optional fingerprint cache
+    """
+    creds = load_drive_credentials()
+    if not creds:
+        raise Exception("Failed to authenticate with Google Drive API")
+    services = DriveServicePool(creds)
+    
+    with DriveSyncState(args.incremental) as state:
+        print(f"Using sync state: {args.incremental}")
+        first = True
+        while True:
+            rows, changes = sync_drive_folder(services, state, args.folder_id, fast_decode=args.fast_decode,
+                                              algorithms=algorithms, max_depth=args.max_depth,
+                                              list_workers=args.list_workers,
+                                              download_workers=args.download_workers, workers=workers,
+                                              chunk_size=args.chunk_size, cache=cache)
+            
+            # The output always holds every current row; an emptied folder leaves no stale file behind
+            print("💾 Writing results...")
+            if save_to_csv(rows, args.output) == 0 and os.path.exists(args.output):
+                os.remove(args.output)
+            
+            if args.changes and (first or len(changes)):
+                changes.to_csv(args.changes, index=False, mode='w' if first else 'a', header=first)
+                print(f"💾 Saved {len(changes)} row changes to: {args.changes}")
+            
+            if args.watch is None:
+                return
+            first = False
+            print(f"⏳ Next sync in {args.watch:g}s (Ctrl+C to stop)")
+            time.sleep(args.watch)
 
 
 def main():
@@ -312,6 +1241,10 @@ Prerequisites:
 Examples:
   python fingerprint_google_drive.py 1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms
   python fingerprint_google_drive.py 1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms -o my_hashes.csv
+  python fingerprint_google_drive.py 1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms --max-depth 0
+  python fingerprint_google_drive.py 1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms --download-workers 32 -w 0
+  python fingerprint_google_drive.py 1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms --incremental drive_sync.db --changes drive_changes.csv
+  python fingerprint_google_drive.py 1BxiMVs0XRA5nFMdKvBdBZjgmUUqptlbs74OgvE2upms --incremental drive_sync.db --watch 3600
         """
     )
     
@@ -323,7 +1256,89 @@ Examples:
     parser.add_argument(
         "-o", "--output",
         default="google_drive_creative_hashes.csv",
-        help="Output CSV filename (default: google_drive_creative_hashes.csv)"
+        help="Output CSV filename, or .parquet for Parquet (default: google_drive_creative_hashes.csv)"
+    )
+    
+    parser.add_argument(
+        "--hashes",
+        default="phash",
+        help="Comma-separated hashes to compute from each downloaded image: "
+             "phash, dhash, ahash, whash, colorhash (default: phash)"
+    )
+    
+    parser.add_argument(
+        "--fast-decode",
+        action="store_true",
+        help="Decode images at reduced resolution straight to grayscale (much faster on large JPEGs)"
+    )
+    
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        metavar="N",
+        help="Maximum subfolder depth to scan (default: unlimited, 0 = the folder only)"
+    )
+    
+    parser.add_argument(
+        "--list-workers",
+        type=int,
+        default=DEFAULT_LIST_WORKERS,
+        metavar="N",
+        help=f"Folders listed concurrently while walking the folder tree (default: {DEFAULT_LIST_WORKERS})"
+    )
+    
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=DEFAULT_DOWNLOAD_WORKERS,
+        metavar="N",
+        help=f"Files downloaded concurrently (default: {DEFAULT_DOWNLOAD_WORKERS})"
+    )
+    
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes for decoding and hashing (default: 1, 0 = all cores)"
+    )
+    
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_DRIVE_CHUNK_SIZE,
+        help=f"Number of downloaded images submitted to a worker per task (default: {DEFAULT_DRIVE_CHUNK_SIZE})"
+    )
+    
+    parser.add_argument(
+        "--cache-file",
+        help="Fingerprint cache database (default: <output>.cache.sqlite next to the output CSV)"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Download and re-hash every file instead of reusing cached fingerprints"
+    )
+    
+    parser.add_argument(
+        "--incremental",
+        metavar="STATE",
+        help="Sync through the Drive Changes API, keeping the page token, folder tree and hashes in this "
+             "SQLite file; the first run scans the whole folder, later runs only process what changed"
+    )
+    
+    parser.add_argument(
+        "--changes",
+        metavar="FILE",
+        help="With --incremental, also write the rows added, replaced and removed by the sync to this CSV"
+    )
+    
+    parser.add_argument(
+        "--watch",
+        type=float,
+        metavar="SECONDS",
+        help="With --incremental, sync again every SECONDS until interrupted "
+             "(--changes then collects the changes of every sync)"
     )
     
     parser.add_argument(
@@ -334,6 +1349,25 @@ Examples:
     
     args = parser.parse_args()
     
+    if args.max_depth is not None and args.max_depth < 0:
+        parser.error("--max-depth must be at least 0")
+    if args.list_workers < 1:
+        parser.error("--list-workers must be at least 1")
+    if args.download_workers < 1:
+        parser.error("--download-workers must be at least 1")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if args.changes and not args.incremental:
+        parser.error("--changes needs --incremental")
+    if args.watch is not None and not args.incremental:
+        parser.error("--watch needs --incremental")
+    if args.watch is not None and args.watch <= 0:
+        parser.error("--watch must be positive")
+    
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    cache_file = args.cache_file or str(Path(args.output).with_suffix('.cache.sqlite'))
+    cache = None
+    
     # Set logging level
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -351,21 +1385,42 @@ Examples:
         
         # Generate hashes for all images in the Google Drive folder
         print("🔐 Authenticating with Google Drive...")
-        image_data = generate_hashes_from_drive(args.folder_id)
+        algorithms = parse_hash_algorithms(args.hashes)
+        if not args.no_cache:
+            cache = DriveFingerprintCache(cache_file, hash_pipeline_version(args.fast_decode, algorithms))
+        
+        if args.incremental:
+            run_incremental_sync(args, algorithms, workers, cache)
+            return
+        
+        image_data = iter_hashes_from_drive(args.folder_id, fast_decode=args.fast_decode, algorithms=algorithms,
+                                            max_depth=args.max_depth, list_workers=args.list_workers,
+                                            download_workers=args.download_workers, workers=workers,
+                                            chunk_size=args.chunk_size, cache=cache)
+        
+        # Track summary statistics while rows stream through to the CSV
+        summary = {'min_size': None, 'max_size': None, 'hash_length': None}
+        
+        def track(rows: Iterator[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+            for row in rows:
+                size = row['file_size']
+                summary['min_size'] = size if summary['min_size'] is None else min(summary['min_size'], size)
+                summary['max_size'] = size if summary['max_size'] is None else max(summary['max_size'], size)
+                summary['hash_length'] = len(row['phash'])
+                yield row
         
-        # Save results to CSV
-        print("💾 Saving results to CSV...")
-        save_to_csv(image_data, args.output)
+        # Save results to CSV as they are produced
+        print("💾 Streaming results to CSV...")
+        saved_count = save_to_csv(track(image_data), args.output)
         
         # Final summary
-        print(f"\n🎉 Successfully processed and hashed {len(image_data)} Google Drive images!")
+        print(f"\n🎉 Successfully processed and hashed {saved_count} Google Drive images!")
         
-        if args.verbose and image_data:
-            df = pd.DataFrame(image_data)
+        if args.verbose and saved_count:
             print(f"\nDetailed summary:")
-            print(f"Total files processed: {len(image_data)}")
-            print(f"File size range: {df['file_size'].min()} - {df['file_size'].max()} bytes")
-            print(f"Hash length: {len(image_data[0]['phash'])} characters")
+            print(f"Total files processed: {saved_count}")
+            print(f"File size range: {summary['min_size']} - {summary['max_size']} bytes")
+            print(f"Hash length: {summary['hash_length']} characters")
         
     except ValueError as e:
         logger.error(f"Invalid input: {e}")
@@ -378,6 +1433,9 @@ Examples:
     except KeyboardInterrupt:
         print("\n⏹️  Operation cancelled by user.")
         sys.exit(1)
+    finally:
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@
 """
 Script 1: Fingerprint Local Creatives
 
-This script scans a local folder of images and generates a perceptual hash for each one,
+This script scans a local folder (and its subfolders) of images and generates a perceptual hash for each one,
 saving the results to a CSV file for later matching with ad platform data.
 
 Usage:
@@ -12,15 +12,32 @@ Example:
     python fingerprint_local_folder.py /path/to/creative/folder
 """
 
+import io
 import os
 import sys
 import argparse
+from collections import deque
+from fnmatch import fnmatch
+from functools import partial
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Sequence, Tuple, Union
 
-import imagehash
 import pandas as pd
-from PIL import Image, UnidentifiedImageError
+from PIL import UnidentifiedImageError
+
+from fingerprint_cache import LocalFingerprintCache
+from hash_writer import StreamingHashWriter
+from image_hashing import (
+    DEFAULT_HASHES, FAST_DECODE_TOLERANCE, BatchHasher, hash_pipeline_version,
+    load_image_for_hashing, parse_hash_algorithms, verify_fast_decode
+)
+
+# Number of files handed to a worker process per task
+DEFAULT_CHUNK_SIZE = 64
+
+# Chunks allowed in flight per worker before we wait for results
+MAX_CHUNKS_IN_FLIGHT_PER_WORKER = 4
 
 
 def is_image_file(filename: str) -> bool:
@@ -37,15 +54,211 @@ def is_image_file(filename: str) -> bool:
     return Path(filename).suffix.lower() in image_extensions
 
 
-def generate_hashes(folder_path: str) -> List[Dict[str, str]]:
+def iter_image_files(root: Path, include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                     max_depth: Optional[int] = None, include_hidden: bool = False) -> Iterator[os.DirEntry]:
     """
-    Generate perceptual hashes for all images in the specified folder.
+    Lazily walk a folder tree and yield the image files it contains.
+    
+    Built on os.scandir so file type checks and stat results come from the
+    directory entry itself. Only the stack of not-yet-visited directories is
+    kept in memory, so huge trees are streamed with constant memory.
+    
+    Patterns are shell-style globs matched against both the entry name and its
+    path relative to root (e.g. "*.png", "archive", "2023/*/drafts").
     
     Args:
-        folder_path: Path to the folder containing images
+        root: Folder to walk
+        include: Only yield files matching one of these patterns (default: all images)
+        exclude: Skip files and prune directories matching any of these patterns
+        max_depth: Maximum directory depth to descend into (0 = top level only)
+        include_hidden: Also descend into directories whose name starts with '.'
+        
+    Yields:
+        os.DirEntry objects for image files, directory by directory
+    """
+    def matches(entry: os.DirEntry, rel_path: str, patterns: List[str]) -> bool:
+        return any(fnmatch(entry.name, p) or fnmatch(rel_path, p) for p in patterns)
+    
+    stack = [(str(root), '', 0)]
+    
+    while stack:
+        dir_path, rel_dir, depth = stack.pop()
+        subdirs = []
+        
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    rel_path = f"{rel_dir}{entry.name}"
+                    
+                    if exclude and matches(entry, rel_path, exclude):
+                        continue
+                    
+                    if entry.is_dir(follow_symlinks=False):
+                        if max_depth is not None and depth >= max_depth:
+                            continue
+                        if not include_hidden and entry.name.startswith('.'):
+                            continue
+                        subdirs.append((entry.path, f"{rel_path}/", depth + 1))
+                    elif entry.is_file() and is_image_file(entry.name):
+                        if include and not matches(entry, rel_path, include):
+                            continue
+                        yield entry
+        except PermissionError as e:
+            if depth == 0:
+                raise
+            print(f"✗ Skipped folder (permission denied): {e.filename}")
+        
+        # Visit subdirectories in directory order
+        stack.extend(reversed(subdirs))
+
+
+def hash_image_chunk(chunk: List[Union[Path, Tuple[str, bytes]]], fast_decode: bool = False,
+                     algorithms: Sequence[str] = DEFAULT_HASHES) -> List[Tuple[Optional[Dict[str, str]], Optional[str]]]:
+    """
+    Decode a chunk of images and calculate their hashes, preserving their order.
+    
+    phash is computed for the whole chunk in one vectorized batch. This runs
+    inside worker processes, so it never prints and never raises; failures
+    are reported back to the caller instead.
+    
+    Args:
+        chunk: List of image file paths, or of (name, image bytes) pairs for
+            images already in memory (e.g. downloaded files)
+        fast_decode: Decode at reduced resolution straight to grayscale
+        algorithms: Hash algorithms to compute from each decoded image
         
     Returns:
-        List of dictionaries containing filename and perceptual hash pairs
+        List of (dictionary of hash columns or None, error message or None),
+        one per input image
+    """
+    results = [None] * len(chunk)
+    batcher = BatchHasher(algorithms, batch_size=max(1, len(chunk)))
+    keep_color = 'colorhash' in algorithms
+    
+    for index, item in enumerate(chunk):
+        name, source = (item[0], io.BytesIO(item[1])) if isinstance(item, tuple) else (item.name, item)
+        try:
+            # Open the image once; every requested hash is computed from it
+            image = load_image_for_hashing(source, fast_decode, keep_color)
+            completed = batcher.add(index, image)
+        except UnidentifiedImageError:
+            results[index] = (None, f"Skipped (not a valid image): {name}")
+            continue
+        except Exception as e:
+            results[index] = (None, f"Error processing {name}: {str(e)}")
+            continue
+        for done_index, hashes in completed:
+            results[done_index] = (hashes, None)
+    
+    for done_index, hashes in batcher.flush():
+        results[done_index] = (hashes, None)
+    
+    return results
+
+
+def chunked(items: Iterable, chunk_size: int) -> Iterator[List]:
+    """
+    Group an iterable into lists of at most chunk_size items.
+    
+    Args:
+        items: Items to group
+        chunk_size: Maximum number of items per chunk
+        
+    Yields:
+        Lists of consecutive items
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_chunks(func: Callable[[List], List], tasks: Iterable[Tuple[object, List]], workers: int = 1,
+               ordered: bool = True) -> Iterator[Tuple[object, List]]:
+    """
+    Apply func to the payload of every task, either in-process or on a process pool.
+    
+    Each task is a (context, payload) pair; the context stays in this process and
+    is yielded back alongside func(payload). Empty payloads never reach the pool.
+    Only a bounded number of tasks is submitted at a time, so the input iterable
+    is consumed lazily and memory stays flat on huge folders.
+    
+    Args:
+        func: Picklable function taking a payload list and returning a result list
+        tasks: Iterable of (context, payload) pairs
+        workers: Number of worker processes (1 runs in-process)
+        ordered: Yield results in submission order instead of completion order
+        
+    Yields:
+        (context, results) pairs, one per task
+    """
+    if workers <= 1:
+        for context, payload in tasks:
+            yield context, func(payload) if payload else []
+        return
+    
+    max_in_flight = workers * MAX_CHUNKS_IN_FLIGHT_PER_WORKER
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        
+        def drain(limit: int) -> Iterator[Tuple[object, List]]:
+            while len(pending) > limit:
+                if ordered:
+                    context, future = pending.popleft()
+                    yield context, future.result()
+                else:
+                    done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+                    for item in [item for item in pending if item[1] in done]:
+                        pending.remove(item)
+                        yield item[0], item[1].result()
+            
+            # Out of order, whatever has already finished can go without waiting
+            if not ordered:
+                for item in [item for item in pending if item[1].done()]:
+                    pending.remove(item)
+                    yield item[0], item[1].result()
+        
+        for context, payload in tasks:
+            if payload:
+                future = executor.submit(func, payload)
+            else:
+                future = Future()
+                future.set_result([])
+            pending.append((context, future))
+            yield from drain(max_in_flight - 1)
+        
+        yield from drain(0)
+
+
+def iter_hashes(folder_path: str, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                ordered: bool = True, cache: Optional[LocalFingerprintCache] = None,
+                fast_decode: bool = False, include: Optional[List[str]] = None,
+                exclude: Optional[List[str]] = None, max_depth: Optional[int] = None,
+                include_hidden: bool = False, algorithms: Sequence[str] = DEFAULT_HASHES) -> Iterator[Dict[str, str]]:
+    """
+    Generate perceptual hashes for all images in the specified folder and its subfolders,
+    yielding each row as soon as it is available.
+    
+    Args:
+        folder_path: Path to the folder containing images
+        workers: Number of worker processes used to decode and hash images
+        chunk_size: Number of files handed to a worker per task
+        ordered: Keep results in directory order (otherwise completion order)
+        cache: Optional fingerprint cache; unchanged files reuse their stored hashes
+        fast_decode: Decode images at reduced resolution straight to grayscale
+        include: Only hash files matching one of these glob patterns
+        exclude: Skip files and prune folders matching any of these glob patterns
+        max_depth: Maximum folder depth to descend into (0 = top level only)
+        include_hidden: Also descend into hidden folders
+        algorithms: Hash algorithms to compute per image; each becomes a column
+        
+    Yields:
+        Dictionaries containing filename and perceptual hash pairs
         
     Raises:
         FileNotFoundError: If the folder path doesn't exist
@@ -59,74 +272,159 @@ def generate_hashes(folder_path: str) -> List[Dict[str, str]]:
     if not folder_path.is_dir():
         raise ValueError(f"Path is not a directory: {folder_path}")
     
-    image_data = []
     processed_count = 0
+    cached_count = 0
     error_count = 0
     
     print(f"Scanning folder: {folder_path}")
+    if workers > 1:
+        print(f"Using {workers} worker processes (chunk size: {chunk_size})")
+    if cache is not None:
+        print(f"Using fingerprint cache: {cache.db_path}")
     print("=" * 50)
     
-    # Loop through every file in the given folder_path
-    for file_path in folder_path.iterdir():
-        if file_path.is_file() and is_image_file(file_path.name):
-            try:
-                # Open the image and calculate its perceptual hash
-                with Image.open(file_path) as img:
-                    # Convert to RGB if necessary (handles RGBA, grayscale, etc.)
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Generate perceptual hash using imagehash
-                    image_hash = imagehash.phash(img)
-                    
-                    # Append data to our list
-                    image_data.append({
-                        'filename': file_path.name,
-                        'phash': str(image_hash),
-                        'file_path': str(file_path),
-                        'file_size': file_path.stat().st_size
-                    })
-                    
-                    processed_count += 1
-                    print(f"✓ Processed: {file_path.name}")
-                    
-            except UnidentifiedImageError:
-                print(f"✗ Skipped (not a valid image): {file_path.name}")
-                error_count += 1
-            except Exception as e:
-                print(f"✗ Error processing {file_path.name}: {str(e)}")
+    # Stream every image file under folder_path
+    image_files = iter_image_files(folder_path, include, exclude, max_depth, include_hidden)
+    
+    def build_tasks() -> Iterator[Tuple[List, List[Path]]]:
+        # Resolve cache hits here; only misses are sent to the workers
+        for chunk in chunked(image_files, chunk_size):
+            entries = []
+            misses = []
+            for entry in chunk:
+                file_path = Path(entry.path)
+                stat = entry.stat()
+                cached = cache.get(str(file_path), stat.st_size, stat.st_mtime_ns) if cache else None
+                entries.append((file_path, stat, cached))
+                if cached is None:
+                    misses.append(file_path)
+            yield entries, misses
+    
+    hash_chunk = partial(hash_image_chunk, fast_decode=fast_decode, algorithms=tuple(algorithms))
+    
+    for entries, results in map_chunks(hash_chunk, build_tasks(), workers, ordered):
+        miss_results = iter(results)
+        for file_path, stat, cached in entries:
+            if cached is not None:
+                hashes, error = cached, None
+                cached_count += 1
+            else:
+                hashes, error = next(miss_results)
+                if hashes is not None and cache is not None:
+                    cache.put(str(file_path), stat.st_size, stat.st_mtime_ns, hashes)
+            
+            if hashes is None:
+                print(f"✗ {error}")
                 error_count += 1
+                continue
+            
+            processed_count += 1
+            print(f"✓ Processed{' (cached)' if cached is not None else ''}: {file_path.name}")
+            yield {
+                'filename': file_path.name,
+                **hashes,
+                'relative_path': file_path.relative_to(folder_path).as_posix(),
+                'file_path': str(file_path),
+                'file_size': stat.st_size
+            }
+    
+    if cache is not None:
+        cache.commit()
     
     print("=" * 50)
     print(f"Processing complete!")
     print(f"✓ Successfully processed: {processed_count} images")
+    if cache is not None:
+        print(f"♻ Reused from cache: {cached_count} images")
     print(f"✗ Errors/Skipped: {error_count} files")
+
+
+def generate_hashes(folder_path: str, **options) -> List[Dict[str, str]]:
+    """
+    Generate perceptual hashes for all images in the specified folder and its subfolders.
+    
+    Args:
+        folder_path: Path to the folder containing images
+        **options: Scan and hashing options, see iter_hashes
+        
+    Returns:
+        List of dictionaries containing filename and perceptual hash pairs
+    """
+    return list(iter_hashes(folder_path, **options))
+
+
+def verify_fast_decode_for_folder(folder_path: str) -> bool:
+    """
+    Compare fast and full decode hashes for every image in a folder.
+    
+    Args:
+        folder_path: Path to the folder containing images
+        
+    Returns:
+        True if every image hashed within FAST_DECODE_TOLERANCE bits
+    """
+    folder_path = Path(folder_path)
+    
+    if not folder_path.is_dir():
+        raise FileNotFoundError(f"Folder not found: {folder_path}")
+    
+    image_files = [entry.path for entry in iter_image_files(folder_path)]
+    
+    print(f"Verifying fast decode path on {len(image_files)} images in: {folder_path}")
+    print("=" * 50)
+    
+    distances = []
+    for result in verify_fast_decode(image_files):
+        if 'error' in result:
+            print(f"✗ Error processing {result['file_path']}: {result['error']}")
+            continue
+        distances.append(result['hamming_distance'])
+        marker = "✓" if result['hamming_distance'] <= FAST_DECODE_TOLERANCE else "✗"
+        print(f"{marker} {result['file_path']}: {result['phash']} vs {result['fast_phash']} "
+              f"(distance {result['hamming_distance']})")
+    
+    print("=" * 50)
+    if not distances:
+        print("No images could be verified.")
+        return False
+    
+    identical = sum(1 for d in distances if d == 0)
+    within = sum(1 for d in distances if d <= FAST_DECODE_TOLERANCE)
+    print(f"Identical hashes: {identical}/{len(distances)}")
+    print(f"Within tolerance ({FAST_DECODE_TOLERANCE} bits): {within}/{len(distances)}")
+    print(f"Max distance: {max(distances)} bits, mean: {sum(distances) / len(distances):.2f} bits")
     
-    return image_data
+    return within == len(distances)
 
 
-def save_to_csv(image_data: List[Dict[str, str]], output_file: str = "local_creative_hashes.csv") -> None:
+def save_to_csv(image_data: Iterable[Dict[str, str]], output_file: str = "local_creative_hashes.csv") -> int:
     """
-    Save the image data to a CSV file.
+    Stream the image data to a CSV file.
+    
+    Rows are appended in batches as they arrive and the file is moved into
+    place atomically once all rows have been written.
     
     Args:
-        image_data: List of dictionaries containing image information
+        image_data: Iterable of dictionaries containing image information
         output_file: Name of the output CSV file
+        
+    Returns:
+        Number of records saved
     """
-    if not image_data:
-        print("No image data to save.")
-        return
+    with StreamingHashWriter(output_file) as writer:
+        writer.write_many(image_data)
     
-    # Convert the list to a pandas DataFrame
-    df = pd.DataFrame(image_data)
+    if writer.rows_written == 0:
+        print("No image data to save.")
+        return 0
     
-    # Save to CSV
-    df.to_csv(output_file, index=False)
-    print(f"✓ Saved {len(image_data)} records to: {output_file}")
+    print(f"✓ Saved {writer.rows_written} records to: {output_file}")
     
     # Display a preview of the data
     print("\nPreview of generated data:")
-    print(df.head())
+    print(pd.DataFrame(writer.preview))
+    
+    return writer.rows_written
 
 
 def main():
@@ -138,6 +436,8 @@ def main():
 Examples:
   python fingerprint_local_folder.py /path/to/creatives
   python fingerprint_local_folder.py ./my_ads_folder
+  python fingerprint_local_folder.py ./my_ads_folder --workers 8
+  python fingerprint_local_folder.py ./my_ads_folder --exclude archive --max-depth 2
         """
     )
     
@@ -149,7 +449,83 @@ Examples:
     parser.add_argument(
         "-o", "--output",
         default="local_creative_hashes.csv",
-        help="Output CSV filename (default: local_creative_hashes.csv)"
+        help="Output CSV filename, or .parquet for Parquet (default: local_creative_hashes.csv)"
+    )
+    
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="PATTERN",
+        help="Only hash files matching this glob (name or relative path); repeatable"
+    )
+    
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help="Skip files and folders matching this glob (name or relative path); repeatable"
+    )
+    
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        help="Maximum subfolder depth to scan (default: unlimited, 0 = top level only)"
+    )
+    
+    parser.add_argument(
+        "--include-hidden",
+        action="store_true",
+        help="Also scan hidden folders (names starting with '.')"
+    )
+    
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes for decoding and hashing (default: 1, 0 = all cores)"
+    )
+    
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Number of files submitted to a worker per task (default: {DEFAULT_CHUNK_SIZE})"
+    )
+    
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="Collect results as workers finish instead of in directory order"
+    )
+    
+    parser.add_argument(
+        "--hashes",
+        default="phash",
+        help="Comma-separated hashes to compute from each decoded image: "
+             "phash, dhash, ahash, whash, colorhash (default: phash)"
+    )
+    
+    parser.add_argument(
+        "--fast-decode",
+        action="store_true",
+        help="Decode images at reduced resolution straight to grayscale (much faster on large JPEGs)"
+    )
+    
+    parser.add_argument(
+        "--verify-fast-decode",
+        action="store_true",
+        help="Compare fast and full decode hashes for the folder and exit"
+    )
+    
+    parser.add_argument(
+        "--cache-file",
+        help="Fingerprint cache database (default: <output>.cache.sqlite next to the output CSV)"
+    )
+    
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-hash every file instead of reusing cached fingerprints"
     )
     
     parser.add_argument(
@@ -160,20 +536,54 @@ Examples:
     
     args = parser.parse_args()
     
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    cache_file = args.cache_file or str(Path(args.output).with_suffix('.cache.sqlite'))
+    cache = None
+    
     try:
+        if args.verify_fast_decode:
+            sys.exit(0 if verify_fast_decode_for_folder(args.folder_path) else 1)
+        
+        algorithms = parse_hash_algorithms(args.hashes)
+        
+        if not args.no_cache:
+            cache = LocalFingerprintCache(cache_file, hash_pipeline_version(args.fast_decode, algorithms))
+        
         # Generate hashes for all images in the folder
-        image_data = generate_hashes(args.folder_path)
+        image_data = iter_hashes(
+            args.folder_path,
+            workers=workers,
+            chunk_size=max(1, args.chunk_size),
+            ordered=not args.unordered,
+            cache=cache,
+            fast_decode=args.fast_decode,
+            include=args.include,
+            exclude=args.exclude,
+            max_depth=args.max_depth,
+            include_hidden=args.include_hidden,
+            algorithms=algorithms
+        )
+        
+        # Track summary statistics while rows stream through to the CSV
+        summary = {'min_size': None, 'max_size': None, 'hash_length': None}
+        
+        def track(rows: Iterator[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+            for row in rows:
+                size = row['file_size']
+                summary['min_size'] = size if summary['min_size'] is None else min(summary['min_size'], size)
+                summary['max_size'] = size if summary['max_size'] is None else max(summary['max_size'], size)
+                summary['hash_length'] = len(row['phash'])
+                yield row
         
         # Save results to CSV
-        save_to_csv(image_data, args.output)
+        saved_count = save_to_csv(track(image_data), args.output)
         
         if args.verbose:
             print(f"\nDetailed summary:")
-            print(f"Total files processed: {len(image_data)}")
-            if image_data:
-                df = pd.DataFrame(image_data)
-                print(f"File size range: {df['file_size'].min()} - {df['file_size'].max()} bytes")
-                print(f"Hash length: {len(image_data[0]['phash'])} characters")
+            print(f"Total files processed: {saved_count}")
+            if saved_count:
+                print(f"File size range: {summary['min_size']} - {summary['max_size']} bytes")
+                print(f"Hash length: {summary['hash_length']} characters")
         
     except (FileNotFoundError, PermissionError, ValueError) as e:
         print(f"Error: {e}")
@@ -184,6 +594,9 @@ Examples:
     except Exception as e:
         print(f"Unexpected error: {e}")
         sys.exit(1)
+    finally:
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Compact Hash Representation
+
+The CSV files store hashes as hexadecimal strings. Internally the matcher
+works on a canonical binary form instead, converted once per column:
+
+- 64-bit hashes (16 hex characters, the phash default) become `uint64`
+- larger hashes become fixed-width `bytes` values (e.g. 32 bytes for a
+  256-bit hash), which join as-is and view as an (N, width) uint8 array
+
+Joins, Hamming distances and outputs all use this form; hex strings are only
+produced again when results are written out.
+"""
+
+from typing import List, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# Hex characters in a 64-bit hash
+HEX_WIDTH_64 = 16
+
+# 8-bit popcount lookup table, used when np.bitwise_count is unavailable (NumPy < 2.0)
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hex_to_hashes(values: Union[pd.Series, Sequence[str]]) -> np.ndarray:
+    """
+    Convert hexadecimal hash strings to their canonical binary form.
+
+    The conversion is vectorized: all strings are left-padded to a common
+    width, joined and decoded with a single bytes.fromhex call.
+
+    Args:
+        values: Hexadecimal hash strings (case-insensitive)
+
+    Returns:
+        uint64 array if every hash fits in 64 bits, otherwise an object
+        array of equal-length bytes values
+
+    Raises:
+        ValueError: If a value is missing or not valid hexadecimal
+    """
+    series = pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values
+    if series.isna().any():
+        raise ValueError("Hash column contains missing values")
+
+    strings = series.astype(str).str.strip().str.lower()
+    if len(strings) == 0:
+        return np.empty(0, dtype=np.uint64)
+
+    max_length = int(strings.str.len().max())
+    hex_width = max(HEX_WIDTH_64, max_length + (max_length % 2))
+    padded = strings.str.zfill(hex_width)
+
+    try:
+        raw = bytes.fromhex(''.join(padded))
+    except ValueError:
+        invalid = padded[~padded.str.fullmatch(r'[0-9a-f]*')]
+        raise ValueError(f"Invalid hexadecimal hash values: {list(invalid.head(5))}")
+
+    if hex_width == HEX_WIDTH_64:
+        return np.frombuffer(raw, dtype='>u8').astype(np.uint64)
+
+    width = hex_width // 2
+    hashes = np.empty(len(padded), dtype=object)
+    hashes[:] = [raw[start:start + width] for start in range(0, len(raw), width)]
+    return hashes
+
+
+def hashes_to_hex(hashes: np.ndarray) -> List[str]:
+    """
+    Convert canonical hashes back to the zero-padded hex strings used in the CSV files.
+
+    Args:
+        hashes: uint64 array or bytes array from hex_to_hashes
+
+    Returns:
+        List of lowercase hexadecimal strings
+    """
+    hashes = np.asarray(hashes)
+    if hashes.dtype == np.uint64:
+        return [f"{int(value):016x}" for value in hashes]
+    return [bytes(value).hex() for value in hashes]
+
+
+def as_byte_matrix(hashes: np.ndarray) -> np.ndarray:
+    """
+    View canonical hashes as an (N, width) uint8 array.
+
+    Args:
+        hashes: uint64 array or bytes array from hex_to_hashes
+
+    Returns:
+        (N, width) uint8 array in big-endian byte order
+    """
+    hashes = np.asarray(hashes)
+    if hashes.dtype == np.uint64:
+        return hashes.astype('>u8').view(np.uint8).reshape(len(hashes), 8)
+    if len(hashes) == 0:
+        return np.empty((0, 0), dtype=np.uint8)
+    return np.frombuffer(b''.join(hashes), dtype=np.uint8).reshape(len(hashes), -1)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """
+    Count set bits element-wise.
+
+    Args:
+        values: Unsigned integer array
+
+    Returns:
+        uint8 array of bit counts with the same shape
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+
+    values = np.ascontiguousarray(values)
+    byte_counts = _POPCOUNT_TABLE[values.view(np.uint8)]
+    return byte_counts.reshape(values.shape + (values.dtype.itemsize,)).sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Element-wise Hamming distance between two arrays of canonical hashes.
+
+    Args:
+        a: uint64 array or bytes array from hex_to_hashes
+        b: Array of the same kind and length as a (uint64 also broadcasts)
+
+    Returns:
+        Array of bit distances
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.dtype == np.uint64 and b.dtype == np.uint64:
+        return popcount(np.bitwise_xor(a, b))
+    a_bytes, b_bytes = as_byte_matrix(a), as_byte_matrix(b)
+    if a_bytes.shape[1] != b_bytes.shape[1]:
+        raise ValueError(f"Cannot compare hashes of different widths: {a_bytes.shape[1]} vs {b_bytes.shape[1]} bytes")
+    return popcount(np.bitwise_xor(a_bytes, b_bytes)).sum(axis=-1, dtype=np.uint16)
@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Hash Search
+
+Indexes used by the matcher to find every local/platform hash pair within a
+given Hamming distance, rather than only exact matches. A re-encode, resize
+or platform thumbnail recompression typically flips a few bits of the phash,
+which an exact join misses.
+
+Hashes are the uint64 values produced by hash_codec.hex_to_hashes. Each index
+is built over the distinct platform hashes and queried with the distinct
+local hashes; the resulting hash pairs are then expanded back to row pairs.
+
+Three search methods are available:
+
+- `brute`: a blocked all-pairs scan, XOR + popcount over cache-sized tiles.
+  No index to build, so it is the fastest choice for tens of thousands of
+  hashes on each side, and the only one that supports pure top-k search.
+  With workers > 1 the scan is split across processes that share the hash
+  arrays through multiprocessing.shared_memory
+- `bktree`: a metric tree, cheap for very small radii but it degrades towards
+  a full scan on dense 64-bit hash spaces as the radius grows
+- `mih`: multi-index hashing. Each hash is split into m disjoint substrings;
+  if two hashes are within r bits, at least one substring pair is within
+  floor(r / m) bits (pigeonhole), so only hashes sharing a nearby substring
+  are candidates, and those are verified with a full popcount
+"""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from hash_codec import popcount
+
+try:
+    _bit_count = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _bit_count(value: int) -> int:
+        return bin(value).count('1')
+
+# Near-duplicate search methods accepted by find_near_duplicates
+SEARCH_METHODS = ('mih', 'bktree', 'brute')
+
+HASH_BITS = 64
+
+# Upper bound on substring-lookup keys generated per query batch in the
+# multi-index search, to keep its temporary arrays small
+MIH_LOOKUP_BATCH = 1 << 21
+
+# L2 cache size assumed when it cannot be read from sysfs
+DEFAULT_L2_CACHE_BYTES = 1 << 20
+
+# Local hashes per brute-force tile; the platform side of the tile is sized
+# from the L2 cache
+BRUTE_FORCE_LOCAL_TILE = 16
+
+# Local-hash slices handed out per worker in a parallel scan, for load balancing
+PARALLEL_SLICES_PER_WORKER = 4
+
+# Bytes of working memory per compared pair in a brute-force tile (uint64
+# XOR, uint8 popcount, bool mask and slack for the selection step)
+_BYTES_PER_PAIR = 20
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes under Hamming distance.
+
+    Every child edge is labelled with its distance to the parent, so by the
+    triangle inequality a radius-r query only descends into children whose
+    label lies within r of the query's distance to the node. For small radii
+    that prunes most of the tree.
+    """
+
+    def __init__(self, hashes: Sequence[int] = ()):
+        """
+        Args:
+            hashes: Distinct hashes to insert; node ids are their positions
+        """
+        self._values: List[int] = []
+        self._children: List[Dict[int, int]] = []
+        for value in hashes:
+            self.add(int(value))
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, value: int) -> int:
+        """
+        Insert a hash.
+
+        Args:
+            value: Hash to insert (duplicates are inserted again)
+
+        Returns:
+            Node id of the inserted hash
+        """
+        node_id = len(self._values)
+        self._values.append(value)
+        self._children.append({})
+        if node_id == 0:
+            return node_id
+
+        node = 0
+        while True:
+            distance = _bit_count(self._values[node] ^ value)
+            children = self._children[node]
+            child = children.get(distance)
+            if child is None:
+                children[distance] = node_id
+                return node_id
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """
+        Find every stored hash within max_distance bits of value.
+
+        Args:
+            value: Query hash
+            max_distance: Maximum Hamming distance (inclusive)
+
+        Returns:
+            List of (node_id, distance) pairs, in no particular order
+        """
+        if not self._values:
+            return []
+
+        matches = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            distance = _bit_count(self._values[node] ^ value)
+            if distance <= max_distance:
+                matches.append((node, distance))
+            low, high = distance - max_distance, distance + max_distance
+            for edge, child in self._children[node].items():
+                if low <= edge <= high:
+                    stack.append(child)
+        return matches
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over 64-bit hashes for radius search.
+
+    For each of the m substrings, the substring values of all stored hashes
+    are kept sorted alongside their positions, which serves as an exact
+    lookup table (a binary search replaces the dict, and the arrays can be
+    stored or memory-mapped as-is).
+    """
+
+    def __init__(self, hashes: np.ndarray, substrings: Optional[int] = None,
+                 tables: Optional[Sequence[Tuple[np.ndarray, np.ndarray]]] = None):
+        """
+        Build the substring tables.
+
+        Args:
+            hashes: uint64 array of hashes to index (positions are the ids returned by searches)
+            substrings: Number of substrings m; by default chosen so each
+                substring has about log2(len(hashes)) bits, which keeps the
+                expected bucket size near one
+            tables: Previously built (keys, positions) pairs, one per
+                substring (e.g. memory-mapped from disk); built from hashes if omitted
+        """
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.substrings = substrings or default_substring_count(len(self.hashes))
+        self.bounds = substring_bounds(self.substrings)
+        self.keys: List[np.ndarray] = []
+        self.positions: List[np.ndarray] = []
+
+        if tables is not None:
+            if len(tables) != self.substrings:
+                raise ValueError(f"Expected {self.substrings} substring tables, got {len(tables)}")
+            for keys, positions in tables:
+                self.keys.append(keys)
+                self.positions.append(positions)
+            return
+
+        # Store keys and positions in the smallest dtype that fits
+        position_dtype = np.uint32 if len(self.hashes) < 2 ** 32 else np.int64
+        for shift, bits in self.bounds:
+            keys = substring_keys(self.hashes, shift, bits)
+            order = np.argsort(keys, kind='stable')
+            self.keys.append(keys[order].astype(np.uint32 if bits <= 32 else np.uint64))
+            self.positions.append(order.astype(position_dtype))
+
+    def search(self, queries: np.ndarray, max_distance: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find every stored hash within max_distance bits of each query.
+
+        Args:
+            queries: uint64 array of query hashes
+            max_distance: Maximum Hamming distance (inclusive)
+
+        Returns:
+            (query_ids, positions, distances) arrays, in no particular order
+        """
+        queries = np.asarray(queries, dtype=np.uint64)
+        substring_radius = max_distance // self.substrings
+
+        results = []
+        masks = [_flip_masks(bits, substring_radius) for _, bits in self.bounds]
+        batch = max(1, MIH_LOOKUP_BATCH // max(len(m) for m in masks))
+
+        for start in range(0, len(queries), batch):
+            chunk = queries[start:start + batch]
+            candidate_ids, candidate_positions = [], []
+
+            for (shift, bits), keys, positions, flips in zip(self.bounds, self.keys, self.positions, masks):
+                # Look up every substring value within substring_radius of the query's substring
+                lookup = (substring_keys(chunk, shift, bits)[:, None] ^ flips[None, :]).ravel()
+                # Match the table dtype so searchsorted never converts (and copies) the table
+                lookup = lookup.astype(keys.dtype, copy=False)
+                low = np.searchsorted(keys, lookup, side='left')
+                high = np.searchsorted(keys, lookup, side='right')
+                counts = high - low
+                if not counts.any():
+                    continue
+                query_ids = np.repeat(np.arange(len(lookup)) // len(flips), counts)
+                offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+                candidate_ids.append(query_ids)
+                candidate_positions.append(positions[np.repeat(low, counts) + offsets].astype(np.int64))
+
+            if not candidate_ids:
+                continue
+
+            # A hash can be a candidate through several substrings; verify each pair once
+            # (sort and drop repeats: np.unique can pick a much slower hash-based path on NumPy >= 2.3)
+            pair_keys = np.sort(np.concatenate(candidate_ids) * len(self.hashes) + np.concatenate(candidate_positions))
+            pair_keys = pair_keys[np.r_[True, pair_keys[1:] != pair_keys[:-1]]]
+            query_ids, hash_positions = np.divmod(pair_keys, len(self.hashes))
+            distances = popcount(chunk[query_ids] ^ self.hashes[hash_positions])
+            keep = distances <= max_distance
+            results.append((query_ids[keep] + start, hash_positions[keep], distances[keep]))
+
+        if not results:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+def default_substring_count(count: int) -> int:
+    """Substring count giving roughly log2(count)-bit substrings (at least 8 bits, at most 16 substrings)."""
+    bits_per_substring = max(math.log2(max(count, 2)), 8)
+    return int(min(16, max(1, round(HASH_BITS / bits_per_substring))))
+
+
+def substring_bounds(substrings: int) -> List[Tuple[int, int]]:
+    """(shift, bits) of each of the m disjoint substrings, most significant first."""
+    bounds = []
+    remaining = HASH_BITS
+    for index in range(substrings):
+        bits = HASH_BITS // substrings + (1 if index < HASH_BITS % substrings else 0)
+        remaining -= bits
+        bounds.append((remaining, bits))
+    return bounds
+
+
+def substring_keys(hashes: np.ndarray, shift: int, bits: int) -> np.ndarray:
+    """Extract one substring from every hash."""
+    return (hashes >> np.uint64(shift)) & np.uint64((1 << bits) - 1)
+
+
+def _flip_masks(bits: int, radius: int) -> np.ndarray:
+    """All bit masks over `bits` bits with at most `radius` bits set."""
+    masks = [0]
+    for flipped in range(1, min(radius, bits) + 1):
+        for positions in combinations(range(bits), flipped):
+            masks.append(sum(1 << position for position in positions))
+    return np.array(masks, dtype=np.uint64)
+
+
+def l2_cache_size() -> int:
+    """L2 cache size in bytes (from Linux sysfs, else DEFAULT_L2_CACHE_BYTES)."""
+    cache_dir = '/sys/devices/system/cpu/cpu0/cache'
+    try:
+        for entry in sorted(os.listdir(cache_dir)):
+            with open(os.path.join(cache_dir, entry, 'level')) as f:
+                if f.read().strip() != '2':
+                    continue
+            with open(os.path.join(cache_dir, entry, 'size')) as f:
+                size = f.read().strip().upper()
+            multiplier = {'K': 1 << 10, 'M': 1 << 20}.get(size[-1:], 1)
+            return int(size.rstrip('KM')) * multiplier
+    except (OSError, ValueError):
+        pass
+    return DEFAULT_L2_CACHE_BYTES
+
+
+def brute_force_tile(l2_bytes: Optional[int] = None) -> Tuple[int, int]:
+    """(local, platform) tile shape whose temporaries fit in half the L2 cache."""
+    l2_bytes = l2_bytes or l2_cache_size()
+    platform_tile = max(256, l2_bytes // 2 // (_BYTES_PER_PAIR * BRUTE_FORCE_LOCAL_TILE))
+    return BRUTE_FORCE_LOCAL_TILE, platform_tile
+
+
+def blocked_search(local_hashes: np.ndarray, platform_hashes: np.ndarray, max_distance: Optional[int] = None,
+                   top_k: Optional[int] = None,
+                   tile: Optional[Tuple[int, int]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compare every local hash with every platform hash, one cache-sized tile at a time.
+
+    Only pairs within max_distance, or the top_k closest platform rows per
+    local row, are kept, so memory is bounded by the number of results
+    rather than by the size of the cross product.
+
+    Args:
+        local_hashes: uint64 array of local hashes
+        platform_hashes: uint64 array of platform hashes
+        max_distance: Maximum Hamming distance (inclusive); None for no limit
+        top_k: Keep at most this many closest platform rows per local row
+            (ties go to the lower platform row); None keeps every pair within max_distance
+        tile: (local, platform) tile shape; defaults to brute_force_tile()
+
+    Returns:
+        (local_rows, platform_rows, distances) arrays, sorted by local row,
+        then distance, then platform row
+    """
+    if max_distance is None and top_k is None:
+        raise ValueError("blocked_search needs max_distance, top_k or both")
+
+    local_hashes = np.asarray(local_hashes, dtype=np.uint64)
+    platform_hashes = np.asarray(platform_hashes, dtype=np.uint64)
+    local_tile, platform_tile = tile or brute_force_tile()
+    limit = HASH_BITS if max_distance is None else max_distance
+
+    results = []
+    for local_start in range(0, len(local_hashes), local_tile):
+        local_block = local_hashes[local_start:local_start + local_tile, None]
+
+        if top_k is None:
+            for platform_start in range(0, len(platform_hashes), platform_tile):
+                platform_block = platform_hashes[None, platform_start:platform_start + platform_tile]
+                distances = popcount(local_block ^ platform_block)
+                hits = distances <= limit
+                # Most tiles hold no matches; skip the (comparatively slow) nonzero for those
+                if not hits.any():
+                    continue
+                local_ids, platform_ids = np.nonzero(hits)
+                results.append((local_ids + local_start, platform_ids + platform_start,
+                                    distances[local_ids, platform_ids]))
+            continue
+
+        # Running top-k per local row, ranked by (distance, platform row)
+        # packed into one integer so ties break deterministically
+        best = np.full((len(local_block), top_k), np.iinfo(np.int64).max, dtype=np.int64)
+        for platform_start in range(0, len(platform_hashes), platform_tile):
+            platform_block = platform_hashes[None, platform_start:platform_start + platform_tile]
+            distances = popcount(local_block ^ platform_block)
+
+            # Only pairs at least as close as a row's current k-th best can enter it
+            worst = np.minimum(best.max(axis=1) >> 40, limit)
+            hits = distances <= worst[:, None]
+            if not hits.any():
+                continue
+
+            rows = np.flatnonzero(hits.any(axis=1))
+            platform_rows = np.arange(platform_start, platform_start + platform_block.shape[1], dtype=np.int64)
+            ranks = np.where(hits[rows], (distances[rows].astype(np.int64) << 40) | platform_rows,
+                             np.iinfo(np.int64).max)
+            candidates = np.concatenate([best[rows], ranks], axis=1)
+            best[rows] = np.partition(candidates, top_k - 1, axis=1)[:, :top_k]
+
+        local_ids, slots = np.nonzero(best != np.iinfo(np.int64).max)
+        ranks = best[local_ids, slots]
+        results.append((local_ids + local_start, ranks & ((1 << 40) - 1), (ranks >> 40).astype(np.uint8)))
+
+    if not results:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+
+    local_rows, platform_rows, distances = (np.concatenate(parts) for parts in zip(*results))
+    local_rows = local_rows.astype(np.int64)
+    platform_rows = platform_rows.astype(np.int64)
+    order = np.lexsort((platform_rows, distances, local_rows))
+    return local_rows[order], platform_rows[order], distances[order]
+
+
+# Shared arrays attached by each parallel-scan worker process
+_worker_arrays: Dict[str, np.ndarray] = {}
+_worker_segments: List[shared_memory.SharedMemory] = []
+
+
+def _share_array(array: np.ndarray) -> shared_memory.SharedMemory:
+    """Copy an array into a new shared memory segment."""
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[:] = array
+    return segment
+
+
+def _attach_shared_arrays(specs: Dict[str, Tuple[str, int]]) -> None:
+    """Worker initializer: map the shared hash arrays without copying them."""
+    for key, (name, length) in specs.items():
+        # Workers share the parent's resource tracker, so the parent's unlink
+        # is the only cleanup needed
+        segment = shared_memory.SharedMemory(name=name)
+        _worker_segments.append(segment)
+        _worker_arrays[key] = np.ndarray((length,), dtype=np.uint64, buffer=segment.buf)
+
+
+def _search_shared_slice(start: int, end: int, max_distance: Optional[int],
+                         top_k: Optional[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    local_rows, platform_rows, distances = blocked_search(
+        _worker_arrays['local'][start:end], _worker_arrays['platform'], max_distance, top_k
+    )
+    return local_rows + start, platform_rows, distances
+
+
+def parallel_blocked_search(local_hashes: np.ndarray, platform_hashes: np.ndarray,
+                            max_distance: Optional[int] = None, top_k: Optional[int] = None,
+                            workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Run blocked_search across worker processes.
+
+    Both hash arrays are copied once into shared memory; every worker maps
+    them directly and scans a slice of the local hashes against all platform
+    hashes. The per-worker candidate lists are merged into one result.
+
+    Args:
+        local_hashes: uint64 array of local hashes
+        platform_hashes: uint64 array of platform hashes
+        max_distance: Maximum Hamming distance (inclusive); None for no limit
+        top_k: Keep at most this many closest platform rows per local row
+        workers: Number of worker processes (default: all cores)
+
+    Returns:
+        (local_rows, platform_rows, distances) arrays, sorted like blocked_search
+    """
+    local_hashes = np.ascontiguousarray(local_hashes, dtype=np.uint64)
+    platform_hashes = np.ascontiguousarray(platform_hashes, dtype=np.uint64)
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(local_hashes) < 2:
+        return blocked_search(local_hashes, platform_hashes, max_distance, top_k)
+
+    slices = min(len(local_hashes), workers * PARALLEL_SLICES_PER_WORKER)
+    bounds = np.linspace(0, len(local_hashes), slices + 1).astype(int)
+
+    segments = []
+    try:
+        specs = {}
+        for key, array in (('local', local_hashes), ('platform', platform_hashes)):
+            segment = _share_array(array)
+            segments.append(segment)
+            specs[key] = (segment.name, len(array))
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared_arrays,
+                                 initargs=(specs,)) as executor:
+            futures = [executor.submit(_search_shared_slice, int(start), int(end), max_distance, top_k)
+                       for start, end in zip(bounds[:-1], bounds[1:])]
+            results = [future.result() for future in futures]
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    # Slices are contiguous and each result is sorted, so concatenating keeps the order
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+def limit_per_local_row(local_rows: np.ndarray, platform_rows: np.ndarray, distances: np.ndarray,
+                        top_k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keep the first top_k pairs of each local row from results sorted by local row and distance."""
+    if len(local_rows) == 0:
+        return local_rows, platform_rows, distances
+    starts = np.flatnonzero(np.r_[True, local_rows[1:] != local_rows[:-1]])
+    rank = np.arange(len(local_rows)) - np.repeat(starts, np.diff(np.r_[starts, len(local_rows)]))
+    keep = rank < top_k
+    return local_rows[keep], platform_rows[keep], distances[keep]
+
+
+def _group_rows(hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Distinct hashes plus, for each, the rows holding it (as order[starts:starts+counts])."""
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    counts = np.bincount(inverse, minlength=len(unique))
+    starts = np.cumsum(counts) - counts
+    return unique, order, starts, counts
+
+
+def _expand_pairs(local_ids: np.ndarray, platform_ids: np.ndarray, distances: np.ndarray,
+                  local_groups, platform_groups) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Expand distinct-hash pairs to every combination of rows holding those hashes."""
+    _, local_order, local_starts, local_counts = local_groups
+    _, platform_order, platform_starts, platform_counts = platform_groups
+
+    local_n = local_counts[local_ids]
+    platform_n = platform_counts[platform_ids]
+    pair_sizes = local_n * platform_n
+    total = int(pair_sizes.sum())
+
+    pair = np.repeat(np.arange(len(local_ids)), pair_sizes)
+    offset = np.arange(total) - np.repeat(np.cumsum(pair_sizes) - pair_sizes, pair_sizes)
+    width = platform_n[pair]
+
+    local_rows = local_order[local_starts[local_ids[pair]] + offset // width]
+    platform_rows = platform_order[platform_starts[platform_ids[pair]] + offset % width]
+    return local_rows, platform_rows, distances[pair]
+
+
+def find_exact_matches(local_hashes: np.ndarray, platform_hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find every (local row, platform row) pair with identical hashes.
+
+    Works for any hash width: the distinct platform hashes are sorted once
+    and each local hash is looked up with a binary search.
+
+    Args:
+        local_hashes: Local hashes (uint64 or bytes array from hash_codec)
+        platform_hashes: Platform hashes of the same kind
+
+    Returns:
+        (local_rows, platform_rows) arrays, sorted by local row, then platform row
+    """
+    local_groups = _group_rows(np.asarray(local_hashes))
+    platform_groups = _group_rows(np.asarray(platform_hashes))
+    local_unique, platform_unique = local_groups[0], platform_groups[0]
+
+    positions = np.searchsorted(platform_unique, local_unique)
+    positions[positions == len(platform_unique)] = 0
+    found = np.flatnonzero(platform_unique[positions] == local_unique) if len(platform_unique) else np.empty(0, int)
+
+    local_rows, platform_rows, _ = _expand_pairs(found, positions[found], np.zeros(len(found), dtype=np.uint8),
+                                                 local_groups, platform_groups)
+    order = np.lexsort((platform_rows, local_rows))
+    return local_rows[order], platform_rows[order]
+
+
+def _search_bktree(local_unique: np.ndarray, platform_unique: np.ndarray,
+                   max_distance: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    tree = BKTree(platform_unique.tolist())
+    local_ids, platform_ids, distances = [], [], []
+    for local_id, value in enumerate(local_unique.tolist()):
+        for platform_id, distance in tree.search(value, max_distance):
+            local_ids.append(local_id)
+            platform_ids.append(platform_id)
+            distances.append(distance)
+    return (np.array(local_ids, dtype=np.int64), np.array(platform_ids, dtype=np.int64),
+            np.array(distances, dtype=np.uint8))
+
+
+def _search_mih(local_unique: np.ndarray, platform_unique: np.ndarray,
+                max_distance: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return MultiIndexHash(platform_unique).search(local_unique, max_distance)
+
+
+_SEARCHERS = {
+    'mih': _search_mih,
+    'bktree': _search_bktree,
+}
+
+
+def find_near_duplicates(local_hashes: np.ndarray, platform_hashes: np.ndarray, max_distance: Optional[int],
+                         method: str = 'mih', top_k: Optional[int] = None,
+                         workers: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find every (local row, platform row) pair whose hashes are within max_distance bits.
+
+    Args:
+        local_hashes: uint64 array of local hashes
+        platform_hashes: uint64 array of platform hashes
+        max_distance: Maximum Hamming distance (inclusive); None means no
+            limit, which only the brute method supports (together with top_k)
+        method: Search method, one of SEARCH_METHODS
+        top_k: Keep only the top_k closest platform rows per local row
+        workers: Worker processes for the brute method (see parallel_blocked_search)
+
+    Returns:
+        (local_rows, platform_rows, distances) arrays, sorted by local row,
+        then distance, then platform row
+
+    Raises:
+        ValueError: If the hashes are not 64-bit or the options are invalid
+    """
+    local_hashes = np.asarray(local_hashes)
+    platform_hashes = np.asarray(platform_hashes)
+    if local_hashes.dtype != np.uint64 or platform_hashes.dtype != np.uint64:
+        raise ValueError("Near-duplicate matching requires 64-bit hashes")
+    if max_distance is not None and max_distance < 0:
+        raise ValueError(f"max_distance must be non-negative, got {max_distance}")
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"top_k must be at least 1, got {top_k}")
+    if method not in SEARCH_METHODS:
+        raise ValueError(f"Unknown search method: {method} (choose from {', '.join(SEARCH_METHODS)})")
+
+    if method == 'brute':
+        # Works on rows directly, so top-k never materializes the full cross product
+        if workers > 1:
+            return parallel_blocked_search(local_hashes, platform_hashes, max_distance, top_k, workers)
+        return blocked_search(local_hashes, platform_hashes, max_distance, top_k)
+
+    if max_distance is None:
+        raise ValueError(f"The {method} index needs a max_distance; use the brute method for pure top-k search")
+
+    local_groups = _group_rows(local_hashes)
+    platform_groups = _group_rows(platform_hashes)
+
+    local_ids, platform_ids, distances = _SEARCHERS[method](local_groups[0], platform_groups[0], max_distance)
+
+    local_rows, platform_rows, distances = _expand_pairs(local_ids, platform_ids, distances,
+                                                         local_groups, platform_groups)
+    order = np.lexsort((platform_rows, distances, local_rows))
+    local_rows, platform_rows, distances = local_rows[order], platform_rows[order], distances[order]
+
+    if top_k is not None:
+        return limit_per_local_row(local_rows, platform_rows, distances, top_k)
+    return local_rows, platform_rows, distances
+
+
+class LocalHashLookup:
+    """
+    The local hashes, indexed once and matched against many batches of
+    platform hashes (e.g. a platform file streamed in chunks).
+
+    Only the distinct local hashes are indexed: sorted for exact lookups and,
+    with a max_distance, in multi-index hashing tables. Memory use depends on
+    the local side only, however many platform rows are matched against it.
+    """
+
+    def __init__(self, local_hashes: np.ndarray, max_distance: int = 0):
+        """
+        Index the local hashes.
+
+        Args:
+            local_hashes: Local hashes (uint64 or bytes array from hash_codec)
+            max_distance: Maximum Hamming distance (inclusive) matched by match();
+                0 matches identical hashes only
+
+        Raises:
+            ValueError: If max_distance > 0 and the hashes are not 64-bit
+        """
+        local_hashes = np.asarray(local_hashes)
+        if max_distance > 0 and local_hashes.dtype != np.uint64:
+            raise ValueError("Near-duplicate matching requires 64-bit hashes")
+
+        self.max_distance = max_distance
+        self.local_groups = _group_rows(local_hashes)
+        self.mih = MultiIndexHash(self.local_groups[0]) if max_distance > 0 else None
+
+    def match(self, platform_hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find every (local row, platform row) pair within max_distance bits.
+
+        Args:
+            platform_hashes: Platform hashes of the same kind as the local ones
+
+        Returns:
+            (local_rows, platform_rows, distances) arrays, sorted by platform
+            row, then distance, then local row
+        """
+        platform_groups = _group_rows(np.asarray(platform_hashes))
+        local_unique, platform_unique = self.local_groups[0], platform_groups[0]
+
+        if self.mih is not None:
+            platform_ids, local_ids, distances = self.mih.search(platform_unique, self.max_distance)
+        else:
+            positions = np.searchsorted(local_unique, platform_unique)
+            positions[positions == len(local_unique)] = 0
+            platform_ids = (np.flatnonzero(local_unique[positions] == platform_unique)
+                            if len(local_unique) else np.empty(0, int))
+            local_ids = positions[platform_ids]
+            distances = np.zeros(len(platform_ids), dtype=np.uint8)
+
+        local_rows, platform_rows, distances = _expand_pairs(local_ids, platform_ids, distances,
+                                                             self.local_groups, platform_groups)
+        order = np.lexsort((local_rows, distances, platform_rows))
+        return local_rows[order], platform_rows[order], distances[order]
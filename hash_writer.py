@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Streaming Hash Output Writer
+
+Shared writer used by the fingerprinting scripts to append rows to CSV (or
+Parquet) as they are produced, instead of collecting every row in memory and
+writing a DataFrame at the very end.
+
+Rows are buffered in small batches and written to a `<output>.partial` file
+that is flushed periodically. Only when the writer is closed successfully is
+the partial file atomically renamed over the final output, so readers never
+see a half-written file and a crash mid-run leaves the rows written so far in
+the `.partial` file instead of losing them.
+"""
+
+import csv
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+# Rows buffered in memory before they are written out
+DEFAULT_BATCH_SIZE = 500
+
+# Seconds between forced flushes to disk, even if a batch is not full
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# Number of leading rows kept for the end-of-run preview
+PREVIEW_ROWS = 5
+
+# Parquet columns written as 64-bit integers; every other column is text
+PARQUET_INTEGER_COLUMNS = ('file_size', 'hamming_distance')
+
+
+class StreamingHashWriter:
+    """
+    Append-only CSV/Parquet writer with periodic flushes and atomic finalize.
+
+    The format is chosen from the output extension: `.parquet` writes Parquet
+    (requires pyarrow), anything else writes CSV.
+    """
+
+    def __init__(self, output_file: str, fieldnames: Optional[List[str]] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        """
+        Prepare a writer for output_file. Nothing is created until the first row arrives.
+
+        Args:
+            output_file: Final output path
+            fieldnames: Column order; defaults to the keys of the first row.
+                Missing values are written as empty cells, unknown keys are an error
+            batch_size: Rows buffered before each write
+            flush_interval: Maximum seconds between flushes to disk
+        """
+        self.output_file = output_file
+        self.partial_file = f"{output_file}.partial"
+        self.fieldnames = list(fieldnames) if fieldnames else None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.is_parquet = output_file.lower().endswith('.parquet')
+
+        self.rows_written = 0
+        self.preview: List[Dict] = []
+
+        self._buffer: List[Dict] = []
+        self._file = None
+        self._csv_writer = None
+        self._parquet_writer = None
+        self._parquet_schema = None
+        self._last_flush = time.monotonic()
+        self._closed = False
+
+    def write(self, row: Dict) -> None:
+        """
+        Queue a single row for writing.
+
+        Args:
+            row: Dictionary of column values
+        """
+        if self.fieldnames is None:
+            self.fieldnames = list(row.keys())
+
+        if len(self.preview) < PREVIEW_ROWS:
+            self.preview.append(row)
+
+        self._buffer.append(row)
+        if len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_many(self, rows: Iterable[Dict]) -> None:
+        """
+        Queue several rows for writing.
+
+        Args:
+            rows: Iterable of row dictionaries
+        """
+        for row in rows:
+            self.write(row)
+
+    def flush(self) -> None:
+        """Write buffered rows to the partial file and flush it to disk."""
+        if self._buffer:
+            if self.is_parquet:
+                self._write_parquet_batch(self._buffer)
+            else:
+                self._write_csv_batch(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+
+        if self._file is not None:
+            self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self) -> int:
+        """
+        Flush remaining rows and atomically move the partial file into place.
+
+        If no rows were written, no output file is created.
+
+        Returns:
+            Total number of rows written
+        """
+        if self._closed:
+            return self.rows_written
+
+        self.flush()
+        self._closed = True
+
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._file is not None:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+            os.replace(self.partial_file, self.output_file)
+
+        return self.rows_written
+
+    def abort(self) -> None:
+        """
+        Stop writing without replacing the output file.
+
+        Rows written so far stay in the partial file so they can be recovered.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+            if self._file is not None and not self._file.closed:
+                self._file.close()
+
+    def __enter__(self) -> "StreamingHashWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write_csv_batch(self, rows: List[Dict]) -> None:
+        if self._csv_writer is None:
+            self._file = open(self.partial_file, 'w', newline='', encoding='utf-8')
+            self._csv_writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, restval='', lineterminator='\n')
+            self._csv_writer.writeheader()
+        self._csv_writer.writerows(rows)
+
+    def _write_parquet_batch(self, rows: List[Dict]) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet output requires pyarrow: pip install pyarrow")
+
+        # The schema comes from the columns rather than the first batch, which
+        # may have no values at all for a column (e.g. Meta rows before Google ones)
+        if self._parquet_schema is None:
+            self._parquet_schema = pa.schema([
+                (name, pa.int64() if name in PARQUET_INTEGER_COLUMNS else pa.string()) for name in self.fieldnames
+            ])
+
+        columns = {}
+        for name in self.fieldnames:
+            values = [row.get(name) for row in rows]
+            if name in PARQUET_INTEGER_COLUMNS:
+                columns[name] = [None if value is None or value == '' else int(value) for value in values]
+            else:
+                columns[name] = [None if value is None else str(value) for value in values]
+
+        batch = pa.Table.from_pydict(columns, schema=self._parquet_schema)
+        if self._parquet_writer is None:
+            self._file = open(self.partial_file, 'wb')
+            self._parquet_writer = pq.ParquetWriter(self._file, self._parquet_schema)
+        self._parquet_writer.write_table(batch)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Shared Image Decoding for Perceptual Hashing
+
+Helpers used by the fingerprinting scripts to open an image, prepare it for
+`imagehash` and compute one or more hashes from a single decode.
+
+phash only looks at a 32x32 grayscale thumbnail, so fully decoding a
+multi-megapixel JPEG in RGB is wasted work. The fast decode path asks libjpeg
+to decode directly at 1/2, 1/4 or 1/8 scale in grayscale (`Image.draft`) and
+box-reduces other large formats (`Image.reduce`) before hashing. This is not
+bit-identical to the full decode: on high-resolution photographs the hashes
+typically differ by 0-2 bits, and `verify_fast_decode` reports the exact
+distances for a given set of files.
+"""
+
+import io
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Sequence, Tuple, Union
+
+import imagehash
+import numpy as np
+from PIL import Image
+
+from phash_batch import format_hashes, phash_batch, prepare_phash_pixels
+
+# Smallest edge (in pixels) we want after a reduced-resolution JPEG decode.
+# phash resizes to 32x32, so this leaves plenty of detail for the final resample.
+FAST_DECODE_MIN_SIZE = 128
+
+# Smallest edge kept when box-reducing other formats. Box filtering is cruder
+# than libjpeg's DCT scaling, so we keep more pixels for the Lanczos resample.
+FAST_REDUCE_MIN_SIZE = 256
+
+# Maximum Hamming distance between fast and full decode hashes that we accept
+# as equivalent when verifying the fast path
+FAST_DECODE_TOLERANCE = 4
+
+# Bump whenever the decode pipeline changes in a way that can alter hashes
+PIPELINE_VERSION = 1
+
+# Hash algorithms that can be computed in one pass; each becomes an output
+# column of the same name. Only colorhash needs the colour image, the others
+# all work from the shared grayscale copy.
+HASH_FUNCTIONS = {
+    'phash': imagehash.phash,
+    'dhash': imagehash.dhash,
+    'ahash': imagehash.average_hash,
+    'whash': imagehash.whash,
+    'colorhash': imagehash.colorhash,
+}
+
+DEFAULT_HASHES = ('phash',)
+
+# Images collected before phash is computed for the whole batch at once
+DEFAULT_HASH_BATCH_SIZE = 64
+
+
+def parse_hash_algorithms(spec: str) -> Tuple[str, ...]:
+    """
+    Parse a comma-separated list of hash algorithms.
+
+    phash is always included and always comes first, since it is the key the
+    matcher joins on.
+
+    Args:
+        spec: Comma-separated algorithm names, e.g. "phash,dhash,colorhash"
+
+    Returns:
+        Tuple of algorithm names in output column order
+
+    Raises:
+        ValueError: If an unknown algorithm is requested
+    """
+    algorithms = ['phash']
+    for name in (part.strip().lower() for part in spec.split(',')):
+        if not name:
+            continue
+        if name not in HASH_FUNCTIONS:
+            raise ValueError(f"Unknown hash algorithm: {name} (choose from {', '.join(HASH_FUNCTIONS)})")
+        if name not in algorithms:
+            algorithms.append(name)
+    return tuple(algorithms)
+
+
+def hash_pipeline_version(fast_decode: bool = False, algorithms: Sequence[str] = DEFAULT_HASHES) -> str:
+    """
+    Describe the decode and hashing pipeline, for use as a cache key.
+
+    Args:
+        fast_decode: Whether the reduced-resolution decode path is used
+        algorithms: Hash algorithms computed per image
+
+    Returns:
+        Version string identifying the pipeline
+    """
+    decode = "fast" if fast_decode else "full-rgb"
+    return f"{'+'.join(algorithms)}-{decode}/imagehash-{imagehash.__version__}/v{PIPELINE_VERSION}"
+
+
+def load_image_for_hashing(source: Union[str, Path, BinaryIO], fast_decode: bool = False,
+                           keep_color: bool = False) -> Image.Image:
+    """
+    Open an image and prepare it for perceptual hashing.
+
+    Args:
+        source: File path or binary file object containing the image
+        fast_decode: Decode at reduced resolution straight to grayscale
+        keep_color: Keep the fast path in RGB (needed for colorhash)
+
+    Returns:
+        Loaded PIL Image (RGB for the full path, grayscale for the fast path
+        unless keep_color is set)
+
+    Raises:
+        PIL.UnidentifiedImageError: If the data is not a valid image
+    """
+    with Image.open(source) as img:
+        if not fast_decode:
+            # Convert to RGB if necessary (handles RGBA, grayscale, etc.)
+            if img.mode != 'RGB':
+                return img.convert('RGB')
+            img.load()
+            return img.copy()
+
+        mode = 'RGB' if keep_color else 'L'
+
+        # JPEG: let the decoder scale down by up to 8x and skip colour conversion
+        if img.format == 'JPEG':
+            img.draft(mode, (FAST_DECODE_MIN_SIZE, FAST_DECODE_MIN_SIZE))
+            return img.convert(mode)
+
+        # Other formats are fully decoded, but shrinking before the grayscale
+        # conversion and Lanczos resize still saves most of the work
+        factor = min(img.size) // FAST_REDUCE_MIN_SIZE
+        if factor >= 2:
+            return img.reduce(factor).convert(mode)
+
+        return img.convert(mode)
+
+
+def compute_hashes(image: Image.Image, algorithms: Sequence[str] = DEFAULT_HASHES) -> Dict[str, str]:
+    """
+    Compute several hashes from one decoded image.
+
+    The grayscale conversion is done once and shared by every grayscale hash;
+    colorhash uses the colour image as given.
+
+    Args:
+        image: Decoded PIL Image
+        algorithms: Hash algorithm names (see HASH_FUNCTIONS)
+
+    Returns:
+        Dictionary mapping algorithm name to hexadecimal hash string
+    """
+    gray = image if image.mode == 'L' else image.convert('L')
+    return _compute_hashes(image, gray, algorithms)
+
+
+def _compute_hashes(image: Image.Image, gray: Image.Image, algorithms: Sequence[str]) -> Dict[str, str]:
+    hashes = {}
+    for name in algorithms:
+        source = image if name == 'colorhash' else gray
+        hashes[name] = str(HASH_FUNCTIONS[name](source))
+    return hashes
+
+
+def hash_image(source: Union[str, Path, BinaryIO], fast_decode: bool = False,
+               algorithms: Sequence[str] = DEFAULT_HASHES) -> Dict[str, str]:
+    """
+    Decode an image file or file object once and compute the requested hashes.
+
+    Args:
+        source: File path or binary file object containing the image
+        fast_decode: Use the reduced-resolution decode path
+        algorithms: Hash algorithm names (see HASH_FUNCTIONS)
+
+    Returns:
+        Dictionary mapping algorithm name to hexadecimal hash string
+    """
+    image = load_image_for_hashing(source, fast_decode, keep_color='colorhash' in algorithms)
+    return compute_hashes(image, algorithms)
+
+
+class BatchHasher:
+    """
+    Collects decoded images and computes their phash in vectorized batches.
+
+    Each image is reduced to its 32x32 phash input (and any other requested
+    hashes are computed) as soon as it is added, so only the small pixel
+    arrays are held until the batch is hashed with phash_batch. Callers pass
+    an arbitrary item with every image and get it back with its hashes.
+    """
+
+    def __init__(self, algorithms: Sequence[str] = DEFAULT_HASHES, batch_size: int = DEFAULT_HASH_BATCH_SIZE):
+        """
+        Args:
+            algorithms: Hash algorithm names (see HASH_FUNCTIONS)
+            batch_size: Number of images per phash batch
+        """
+        self.algorithms = tuple(algorithms)
+        self.batch_size = batch_size
+        self._other_algorithms = tuple(name for name in self.algorithms if name != 'phash')
+        self._items: List[Any] = []
+        self._pixels: List[np.ndarray] = []
+        self._other_hashes: List[Dict[str, str]] = []
+
+    def add(self, item: Any, image: Image.Image) -> List[Tuple[Any, Dict[str, str]]]:
+        """
+        Queue an image for hashing.
+
+        Args:
+            item: Caller data returned alongside the hashes
+            image: Decoded PIL Image
+
+        Returns:
+            Completed (item, hashes) pairs if this filled a batch, else an empty list
+        """
+        gray = image if image.mode == 'L' else image.convert('L')
+        other_hashes = _compute_hashes(image, gray, self._other_algorithms)
+        pixels = prepare_phash_pixels(gray)
+
+        self._items.append(item)
+        self._pixels.append(pixels)
+        self._other_hashes.append(other_hashes)
+
+        if len(self._items) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Tuple[Any, Dict[str, str]]]:
+        """
+        Hash every queued image.
+
+        Returns:
+            (item, hashes) pairs in the order the images were added
+        """
+        if not self._items:
+            return []
+
+        phashes = format_hashes(phash_batch(np.stack(self._pixels)))
+        results = []
+        for item, phash, other in zip(self._items, phashes, self._other_hashes):
+            hashes = {name: phash if name == 'phash' else other[name] for name in self.algorithms}
+            results.append((item, hashes))
+
+        self._items, self._pixels, self._other_hashes = [], [], []
+        return results
+
+
+def verify_fast_decode(paths: Iterable[Union[str, Path]]) -> List[Dict[str, object]]:
+    """
+    Hash files with both decode paths and report how far apart the results are.
+
+    Args:
+        paths: Image files to check
+
+    Returns:
+        List of dictionaries with file_path, phash (full decode), fast_phash
+        and hamming_distance; files that cannot be decoded are reported with
+        an error message instead
+    """
+    report = []
+
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            full_hash = imagehash.phash(load_image_for_hashing(io.BytesIO(data)))
+            fast_hash = imagehash.phash(load_image_for_hashing(io.BytesIO(data), fast_decode=True))
+            report.append({
+                'file_path': str(path),
+                'phash': str(full_hash),
+                'fast_phash': str(fast_hash),
+                'hamming_distance': full_hash - fast_hash
+            })
+        except Exception as e:
+            report.append({'file_path': str(path), 'error': str(e)})
+
+    return report
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Match Assignment
+
+With near-duplicate matching, one local file can be within range of several
+platform creatives and one platform creative within range of several local
+files, so the raw candidate pairs form a bipartite graph rather than a
+mapping. This module picks which candidate pairs to keep:
+
+- `all`: every candidate pair (the matcher's default)
+- `one-to-one`: each local file and each platform creative is used at most
+  once; among the assignments pairing up as many creatives as possible, the
+  one with the smallest total Hamming distance is chosen
+- `many-to-one`: each platform creative gets its single closest local file,
+  but one local file may serve many ads
+
+One-to-one assignment is solved per connected component of the candidate
+graph, so it scales with the size of the largest component rather than the
+whole graph: components with a single local file or a single platform
+creative are resolved directly, and the rest are solved as sparse minimum
+weight matchings (scipy's LAPJVsp), batched into block-diagonal problems.
+"""
+
+from typing import Tuple
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components, min_weight_full_bipartite_matching
+
+ASSIGNMENT_MODES = ('all', 'one-to-one', 'many-to-one')
+
+# Candidate pairs solved together in one block-diagonal matching problem.
+# LAPJVsp slows down faster than linearly with problem size, even when the
+# problem is block-diagonal, so batches stay small
+ASSIGNMENT_BATCH_EDGES = 500
+
+
+def candidate_components(local_rows: np.ndarray, platform_rows: np.ndarray) -> Tuple[int, np.ndarray]:
+    """
+    Split the candidate graph into connected components.
+
+    Args:
+        local_rows: Local row of each candidate pair
+        platform_rows: Platform row of each candidate pair
+
+    Returns:
+        (number of components, component label of each candidate pair)
+    """
+    _, local_ids = np.unique(local_rows, return_inverse=True)
+    platform_keys, platform_ids = np.unique(platform_rows, return_inverse=True)
+    local_count = int(local_ids.max()) + 1 if len(local_ids) else 0
+    nodes = local_count + len(platform_keys)
+
+    graph = coo_matrix((np.ones(len(local_ids), dtype=np.int8), (local_ids, local_count + platform_ids)),
+                       shape=(nodes, nodes))
+    count, labels = connected_components(graph, directed=False)
+    return count, labels[local_ids]
+
+
+def _first_per_group(groups: np.ndarray, distances: np.ndarray, tiebreak: np.ndarray) -> np.ndarray:
+    """Index of the closest pair in each group (ties go to the lowest tiebreak row)."""
+    order = np.lexsort((tiebreak, distances, groups))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = groups[order][1:] != groups[order][:-1]
+    return order[first]
+
+
+def _solve_matching(local_rows: np.ndarray, platform_rows: np.ndarray, distances: np.ndarray) -> np.ndarray:
+    """
+    Maximum-cardinality, minimum-distance matching of a set of candidate pairs.
+
+    Every local row also gets a private dummy column whose cost exceeds any
+    possible total distance, so a full matching of the local side always
+    exists and a real pair is only left out if it cannot be used without
+    unmatching something else.
+
+    Returns:
+        Indices of the chosen pairs
+    """
+    local_keys, local_ids = np.unique(local_rows, return_inverse=True)
+    platform_keys, platform_ids = np.unique(platform_rows, return_inverse=True)
+    local_count, platform_count = len(local_keys), len(platform_keys)
+
+    # Weights must be non-zero, so real pairs cost distance + 1
+    weights = distances.astype(np.float64) + 1
+    dummy_cost = (weights.max() + 1) * local_count + 1
+
+    rows = np.concatenate([local_ids, np.arange(local_count)])
+    cols = np.concatenate([platform_ids, platform_count + np.arange(local_count)])
+    values = np.concatenate([weights, np.full(local_count, dummy_cost)])
+    graph = csr_matrix((values, (rows, cols)), shape=(local_count, platform_count + local_count))
+
+    matched_rows, matched_cols = min_weight_full_bipartite_matching(graph)
+    real = matched_cols < platform_count
+    matched_keys = matched_rows[real].astype(np.int64) * platform_count + matched_cols[real]
+
+    pair_keys = local_ids.astype(np.int64) * platform_count + platform_ids
+    order = np.argsort(pair_keys)
+    return order[np.searchsorted(pair_keys, matched_keys, sorter=order)]
+
+
+def assign_matches(local_rows: np.ndarray, platform_rows: np.ndarray, distances: np.ndarray,
+                   mode: str = 'one-to-one') -> np.ndarray:
+    """
+    Choose which candidate pairs to keep.
+
+    Args:
+        local_rows: Local row of each candidate pair
+        platform_rows: Platform row of each candidate pair (each pair at most once)
+        distances: Hamming distance of each pair
+        mode: One of ASSIGNMENT_MODES
+
+    Returns:
+        Sorted indices of the kept pairs
+    """
+    if mode not in ASSIGNMENT_MODES:
+        raise ValueError(f"Unknown assignment mode: {mode} (choose from {', '.join(ASSIGNMENT_MODES)})")
+
+    local_rows = np.asarray(local_rows, dtype=np.int64)
+    platform_rows = np.asarray(platform_rows, dtype=np.int64)
+    distances = np.asarray(distances, dtype=np.int64)
+    if mode == 'all' or len(local_rows) == 0:
+        return np.arange(len(local_rows))
+
+    if mode == 'many-to-one':
+        return np.sort(_first_per_group(platform_rows, distances, local_rows))
+
+    count, labels = candidate_components(local_rows, platform_rows)
+    locals_per_component = np.bincount(labels[_first_per_group(local_rows, distances, platform_rows)],
+                                       minlength=count)
+    platforms_per_component = np.bincount(labels[_first_per_group(platform_rows, distances, local_rows)],
+                                          minlength=count)
+
+    # A component with one local file or one platform creative keeps exactly its closest pair
+    trivial = (locals_per_component == 1) | (platforms_per_component == 1)
+    in_trivial = trivial[labels]
+    trivial_pairs = np.flatnonzero(in_trivial)
+    kept = [trivial_pairs[_first_per_group(labels[trivial_pairs], distances[trivial_pairs],
+                                           local_rows[trivial_pairs] * (platform_rows.max() + 1)
+                                           + platform_rows[trivial_pairs])]]
+
+    # The rest are solved in batches of whole components; the batch's
+    # matching problem is block-diagonal, so each component is solved independently
+    pairs = np.flatnonzero(~in_trivial)
+    pairs = pairs[np.argsort(labels[pairs], kind='stable')]
+    component_ends = np.append(np.flatnonzero(np.diff(labels[pairs])) + 1, len(pairs))
+
+    batch_start = 0
+    for end in component_ends:
+        if end - batch_start >= ASSIGNMENT_BATCH_EDGES or end == len(pairs):
+            batch = pairs[batch_start:end]
+            if len(batch):
+                kept.append(batch[_solve_matching(local_rows[batch], platform_rows[batch], distances[batch])])
+            batch_start = end
+
+    return np.sort(np.concatenate(kept))
@@ -3,20 +3,79 @@
 Script 3: Match the Hashes
 
 This script loads the CSV files generated by the previous scripts and creates a final mapping
-between local creative files and Meta ad platform creatives using perceptual hashes.
+between local creative files and ad platform creatives (Meta, Google) using perceptual hashes.
+All platforms are matched in a single pass; a combined mapping and one mapping per platform
+are written.
 
 Usage:
-    python3 match_hashes.py
+    python3 match_hashes.py [--max-distance K]
     
 Example:
     python3 match_hashes.py
+    python3 match_hashes.py --max-distance 4
 """
 
+import io
 import os
+import re
 import sys
+import time
 import argparse
-from typing import Tuple, Optional
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
 import pandas as pd
+import requests
+from PIL import Image
+
+from hash_codec import hashes_to_hex, hex_to_hashes
+from hash_index import SEARCH_METHODS, LocalHashLookup, find_exact_matches, find_near_duplicates
+from hash_writer import StreamingHashWriter
+from image_hashing import load_image_for_hashing
+from match_assignment import ASSIGNMENT_MODES, assign_matches
+from match_state import STATE_MAPPING_COLUMNS, STATE_VERSION, MatchState, keys_isin, mapping_changes, row_keys
+from platform_index import PlatformHashIndex, build_platform_index, count_platforms
+
+# Thumbnail edge (pixels) both images are reduced to for pixel verification
+PIXEL_VERIFY_SIZE = 64
+
+# Minimum correlation between the two thumbnails accepted by pixel verification.
+# Correlation ignores brightness/contrast shifts from re-encoding, but drops to
+# around zero for unrelated images
+DEFAULT_PIXEL_THRESHOLD = 0.9
+
+# Largest mean gray-level difference for two flat (single-colour) images to verify
+FLAT_IMAGE_TOLERANCE = 8.0
+
+# Order in which match tiers are reported
+MATCH_TIERS = ('exact', 'near', 'pixel')
+
+# Platform hash files tried, in order, when -p is not given
+DEFAULT_PLATFORM_FILES = ('platform_creative_hashes_ALL.csv', 'platform_creative_hashes_META.csv')
+
+# Combined mapping; the per-platform mappings replace the _ALL suffix with the platform name
+DEFAULT_OUTPUT_FILE = 'final_creative_mapping_ALL.csv'
+
+# Platform rows read per chunk by --stream
+DEFAULT_STREAM_CHUNK_ROWS = 100_000
+
+# Platform columns read by --stream (everything else, e.g. thumbnail_url, is skipped)
+STREAM_PLATFORM_COLUMNS = ('ad_id', 'platform', 'phash')
+
+
+def encode_hash_column(df: pd.DataFrame, column: str = 'phash') -> pd.DataFrame:
+    """
+    Convert a hex hash column to the compact binary form used for matching.
+    
+    Args:
+        df: DataFrame loaded from a hashes CSV
+        column: Name of the hash column
+        
+    Returns:
+        The same DataFrame, with the column converted in place (uint64 for
+        64-bit hashes, fixed-width bytes for larger ones)
+    """
+    df[column] = hex_to_hashes(df[column])
+    return df
 
 
 def load_local_hashes(file_path: str = "local_creative_hashes.csv") -> pd.DataFrame:
@@ -27,7 +86,7 @@ def load_local_hashes(file_path: str = "local_creative_hashes.csv") -> pd.DataFr
         file_path: Path to the local hashes CSV file
         
     Returns:
-        DataFrame containing local creative hashes
+        DataFrame containing local creative hashes, with phash as uint64
         
     Raises:
         FileNotFoundError: If the CSV file doesn't exist
@@ -37,7 +96,7 @@ def load_local_hashes(file_path: str = "local_creative_hashes.csv") -> pd.DataFr
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Local hashes file not found: {file_path}")
         
-        local_df = pd.read_csv(file_path)
+        local_df = pd.read_csv(file_path, dtype={'phash': str})
         
         # Validate required columns
         required_columns = ['filename', 'phash']
@@ -45,7 +104,17 @@ def load_local_hashes(file_path: str = "local_creative_hashes.csv") -> pd.DataFr
         if missing_columns:
             raise ValueError(f"Missing required columns in {file_path}: {missing_columns}")
         
+        encode_hash_column(local_df)
+        
         print(f"✅ Loaded {len(local_df)} local creatives from: {file_path}")
+        
+        name_column = local_name_column(local_df)
+        duplicates = local_df[name_column][local_df[name_column].duplicated()].unique()
+        if len(duplicates):
+            print(f"⚠️  {len(duplicates)} local {name_column} values appear more than once (e.g. {duplicates[0]}); "
+                  f"their matches cannot be told apart in the mapping")
+            if name_column == 'filename':
+                print("   Regenerate the local hashes with fingerprint_local_folder.py to name files by relative path")
         return local_df
         
     except pd.errors.EmptyDataError:
@@ -54,25 +123,40 @@ def load_local_hashes(file_path: str = "local_creative_hashes.csv") -> pd.DataFr
         raise Exception(f"Error loading local hashes from {file_path}: {e}")
 
 
-def load_platform_hashes(file_path: str = "platform_creative_hashes_META.csv") -> pd.DataFrame:
+def load_platform_hashes(file_paths: Union[str, Sequence[str]] = DEFAULT_PLATFORM_FILES[0]) -> pd.DataFrame:
     """
-    Load platform creative hashes from CSV file.
+    Load platform creative hashes from one or more CSV files.
+    
+    Several files (e.g. one export per platform) are combined into one
+    DataFrame; rows repeated across files are kept once.
     
     Args:
-        file_path: Path to the platform hashes CSV file
+        file_paths: Path to the platform hashes CSV file, or a list of paths
         
     Returns:
-        DataFrame containing platform creative hashes
+        DataFrame containing platform creative hashes, with phash as uint64
         
     Raises:
-        FileNotFoundError: If the CSV file doesn't exist
-        pd.errors.EmptyDataError: If the CSV file is empty
+        FileNotFoundError: If a CSV file doesn't exist
+        pd.errors.EmptyDataError: If a CSV file is empty
     """
+    if not isinstance(file_paths, str):
+        if len(file_paths) == 1:
+            return load_platform_hashes(file_paths[0])
+        
+        frames = [load_platform_hashes(file_path) for file_path in file_paths]
+        platform_df = pd.concat(frames, ignore_index=True)
+        platform_df = platform_df.drop_duplicates(subset=['platform', 'ad_id', 'phash'], ignore_index=True)
+        platforms = ', '.join(count_platforms(platform_df))
+        print(f"✅ Combined {len(platform_df)} platform creatives from {len(frames)} files ({platforms})")
+        return platform_df
+    
+    file_path = file_paths
     try:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Platform hashes file not found: {file_path}")
         
-        platform_df = pd.read_csv(file_path)
+        platform_df = pd.read_csv(file_path, dtype={'phash': str})
         
         # Validate required columns
         required_columns = ['ad_id', 'platform', 'phash']
@@ -80,6 +164,8 @@ def load_platform_hashes(file_path: str = "platform_creative_hashes_META.csv") -
         if missing_columns:
             raise ValueError(f"Missing required columns in {file_path}: {missing_columns}")
         
+        encode_hash_column(platform_df)
+        
         print(f"✅ Loaded {len(platform_df)} platform creatives from: {file_path}")
         return platform_df
         
@@ -89,31 +175,603 @@ def load_platform_hashes(file_path: str = "platform_creative_hashes_META.csv") -
         raise Exception(f"Error loading platform hashes from {file_path}: {e}")
 
 
-def perform_hash_matching(local_df: pd.DataFrame, platform_df: pd.DataFrame) -> pd.DataFrame:
+def default_platform_files() -> List[str]:
+    """
+    Platform hashes file used when none is given on the command line.
+    
+    Returns:
+        The combined file written by fingerprint_ad_platforms.py if it exists,
+        otherwise the Meta-only file
+    """
+    for file_path in DEFAULT_PLATFORM_FILES:
+        if os.path.exists(file_path):
+            return [file_path]
+    return [DEFAULT_PLATFORM_FILES[0]]
+
+
+def load_platform_index(index_dir: str) -> PlatformHashIndex:
+    """
+    Open a platform index written by --build-index.
+    
+    Args:
+        index_dir: Index directory
+        
+    Returns:
+        Memory-mapped platform index
+    """
+    platform_index = PlatformHashIndex(index_dir)
+    print(f"✅ Loaded {len(platform_index)} platform creatives from index: {index_dir}")
+    
+    if platform_index.is_stale():
+        source = platform_index.manifest['source']['path']
+        print(f"⚠️  {source} has changed since the index was built; rebuild it with --build-index")
+    
+    return platform_index
+
+
+def combine_matched_rows(local_df: pd.DataFrame, platform_df: pd.DataFrame, local_rows: np.ndarray,
+                         platform_rows: np.ndarray, distances: np.ndarray) -> pd.DataFrame:
+    """
+    Build the merged DataFrame for a set of (local row, platform row) pairs.
+    
+    Columns present on both sides get the '_local'/'_platform' suffixes used by
+    the exact merge, except phash: the local hash stays in 'phash' and the
+    platform hash goes to 'platform_phash'.
+    
+    Args:
+        local_df: DataFrame containing local creative hashes
+        platform_df: DataFrame or PlatformHashIndex containing platform creative hashes
+        local_rows: Positional indices into local_df
+        platform_rows: Positional indices (or index row ids) into platform_df
+        distances: Hamming distance of each pair
+        
+    Returns:
+        DataFrame with one row per pair and a hamming_distance column
+    """
+    local_part = local_df.iloc[local_rows].reset_index(drop=True)
+    if isinstance(platform_df, PlatformHashIndex):
+        platform_part = platform_df.take(platform_rows)
+    else:
+        platform_part = platform_df.iloc[platform_rows].reset_index(drop=True)
+    platform_part = platform_part.rename(columns={'phash': 'platform_phash'})
+    
+    shared = set(local_part.columns) & set(platform_part.columns)
+    local_part = local_part.rename(columns={col: f"{col}_local" for col in shared})
+    platform_part = platform_part.rename(columns={col: f"{col}_platform" for col in shared})
+    
+    merged_df = pd.concat([local_part, platform_part], axis=1)
+    merged_df['hamming_distance'] = np.asarray(distances, dtype=np.int64)
+    return merged_df
+
+
+def verify_pixel_matches(merged_df: pd.DataFrame, threshold: float = DEFAULT_PIXEL_THRESHOLD) -> pd.Series:
+    """
+    Confirm hash matches by comparing the images themselves.
+    
+    Both images are reduced to small grayscale thumbnails and compared by
+    correlation (see pixel_similarity). Local images are read from file_path,
+    platform images from thumbnail_url; each source is loaded once.
+    
+    Args:
+        merged_df: Matched rows (from combine_matched_rows)
+        threshold: Minimum similarity for a match to be verified
+        
+    Returns:
+        Series aligned with merged_df: True (verified), False (rejected) or
+        None (an image could not be loaded)
+    """
+    local_column = next((c for c in ('file_path', 'file_path_local') if c in merged_df.columns), None)
+    platform_column = next((c for c in ('thumbnail_url', 'thumbnail_url_platform') if c in merged_df.columns), None)
+    if local_column is None or platform_column is None:
+        print("⚠️  Pixel verification needs file_path (local) and thumbnail_url (platform) columns")
+        return pd.Series([None] * len(merged_df), index=merged_df.index, dtype=object)
+    
+    loaded = {}
+    
+    def pixels(source):
+        if source not in loaded:
+            try:
+                loaded[source] = load_verification_pixels(source)
+            except Exception as e:
+                print(f"⚠️  Could not load {source} for pixel verification: {e}")
+                loaded[source] = None
+        return loaded[source]
+    
+    results = []
+    for local_source, platform_source in zip(merged_df[local_column], merged_df[platform_column]):
+        if pd.isna(local_source) or pd.isna(platform_source):
+            results.append(None)
+            continue
+        local_pixels, platform_pixels = pixels(str(local_source)), pixels(str(platform_source))
+        if local_pixels is None or platform_pixels is None:
+            results.append(None)
+        else:
+            results.append(bool(pixel_similarity(local_pixels, platform_pixels) >= threshold))
+    
+    return pd.Series(results, index=merged_df.index, dtype=object)
+
+
+def load_verification_pixels(source: str) -> np.ndarray:
+    """
+    Load an image from a local path or URL as a small grayscale array.
+    
+    Args:
+        source: File path or http(s) URL
+        
+    Returns:
+        (PIXEL_VERIFY_SIZE, PIXEL_VERIFY_SIZE) float32 array
+    """
+    if source.startswith(('http://', 'https://')):
+        response = requests.get(source, timeout=30)
+        response.raise_for_status()
+        source = io.BytesIO(response.content)
+    
+    image = load_image_for_hashing(source).convert('L')
+    resample = getattr(Image, 'Resampling', Image).LANCZOS
+    return np.asarray(image.resize((PIXEL_VERIFY_SIZE, PIXEL_VERIFY_SIZE), resample), dtype=np.float32)
+
+
+def pixel_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Pearson correlation between two equally sized grayscale arrays.
+    
+    Args:
+        a: Grayscale pixels
+        b: Grayscale pixels of the same shape
+        
+    Returns:
+        Correlation in [-1, 1]; two flat images count as 1.0 if their gray
+        levels are within FLAT_IMAGE_TOLERANCE, otherwise 0.0
+    """
+    a_centered = a - a.mean()
+    b_centered = b - b.mean()
+    denominator = np.sqrt((a_centered ** 2).sum() * (b_centered ** 2).sum())
+    if denominator == 0:
+        both_flat = not a_centered.any() and not b_centered.any()
+        return 1.0 if both_flat and abs(float(a.mean() - b.mean())) <= FLAT_IMAGE_TOLERANCE else 0.0
+    return float((a_centered * b_centered).sum() / denominator)
+
+
+def _record_tier(tier_stats: Optional[Dict], tier: str, tier_df: pd.DataFrame, started: float, **extra) -> None:
+    """Add a tier's match counts and elapsed time to tier_stats."""
+    if tier_stats is None:
+        return
+    tier_stats[tier] = {
+        'matches': len(tier_df),
+        'local_creatives': int(tier_df['_local_row'].nunique()) if len(tier_df) else 0,
+        'seconds': time.perf_counter() - started,
+        **extra
+    }
+
+
+def perform_hash_matching(local_df: pd.DataFrame, platform_df: pd.DataFrame,
+                          max_distance: int = 0, index: str = 'mih',
+                          top_k: Optional[int] = None, workers: int = 1,
+                          verify_pixels: bool = False, pixel_threshold: float = DEFAULT_PIXEL_THRESHOLD,
+                          tier_stats: Optional[Dict] = None, assignment: str = 'all') -> pd.DataFrame:
     """
     Perform hash matching between local and platform creatives.
     
+    Matching runs in tiers, each only seeing what the previous one left over:
+    
+    1. exact: identical hashes, found with a sorted hash lookup
+    2. near: local creatives without an exact match go through the
+       near-duplicate engine (only if max_distance > 0 or top_k is set)
+    3. pixel: near matches are optionally confirmed by comparing the images;
+       confirmed rows are relabelled 'pixel', rejected ones are dropped
+    
+    The surviving candidate pairs of all tiers then go through the assignment
+    stage (see match_assignment.py), which can restrict them to a one-to-one
+    or many-to-one mapping.
+    
     Args:
         local_df: DataFrame containing local creative hashes
-        platform_df: DataFrame containing platform creative hashes
+        platform_df: DataFrame containing platform creative hashes, or a
+            PlatformHashIndex whose lookup tables are used directly
+        max_distance: Maximum Hamming distance for a near match; 0 matches exact hashes only
+        index: Near-duplicate search index (see hash_index.SEARCH_METHODS)
+        top_k: Keep only the top_k closest platform matches per unmatched local creative.
+            Without max_distance this searches all distances with the brute-force engine
+        workers: Worker processes for the brute-force engine, which then shares
+            the hash arrays with them through shared memory
+        verify_pixels: Confirm near matches by comparing the images
+        pixel_threshold: Minimum thumbnail correlation accepted by pixel verification
+        tier_stats: Optional dictionary filled with per-tier counts and timings
+        assignment: Which candidate pairs to keep (see match_assignment.ASSIGNMENT_MODES)
         
     Returns:
-        DataFrame containing successful matches
+        DataFrame containing successful matches. When the near tier is
+        enabled it also has platform_phash, hamming_distance and match_tier columns
     """
     print("\n🔍 Performing hash matching...")
     
-    # Perform inner join on phash column
-    merged_df = pd.merge(
-        local_df,
-        platform_df,
-        on='phash',
-        how='inner',
-        suffixes=('_local', '_platform')
-    )
+    use_index = isinstance(platform_df, PlatformHashIndex)
+    platform_dtype = np.dtype(np.uint64) if use_index else platform_df['phash'].dtype
+    if local_df['phash'].dtype != platform_dtype:
+        raise ValueError("Local and platform hashes have different sizes; regenerate them with the same hash size")
     
-    print(f"✅ Found {len(merged_df)} exact hash matches")
+    local_hashes = local_df['phash'].to_numpy()
+    platform_hashes = platform_df.hashes if use_index else platform_df['phash'].to_numpy()
+    near_enabled = max_distance > 0 or bool(top_k)
     
-    return merged_df
+    # Tier 1: exact hash lookup
+    started = time.perf_counter()
+    if use_index:
+        local_rows, platform_rows = platform_df.find_exact(local_hashes)
+    else:
+        local_rows, platform_rows = find_exact_matches(local_hashes, platform_hashes)
+    exact_df = combine_matched_rows(local_df, platform_df, local_rows, platform_rows,
+                                    np.zeros(len(local_rows), dtype=np.int64))
+    exact_df['_local_row'] = local_rows
+    exact_df['_platform_row'] = platform_rows
+    exact_df['match_tier'] = 'exact'
+    _record_tier(tier_stats, 'exact', exact_df, started)
+    print(f"✅ Found {len(exact_df)} exact hash matches")
+    
+    if not near_enabled:
+        exact_df = apply_assignment(exact_df, assignment)
+        return exact_df.drop(columns=['_local_row', '_platform_row', 'platform_phash', 'hamming_distance', 'match_tier'])
+    
+    # Tier 2: near-duplicate search for the local creatives left unmatched
+    started = time.perf_counter()
+    residual = np.setdiff1d(np.arange(len(local_df)), local_rows)
+    limit = max_distance if max_distance > 0 else None
+    if limit is None and index != 'brute':
+        print(f"ℹ️  --top-k without --max-distance uses the brute-force engine instead of {index}")
+        index = 'brute'
+    if workers > 1:
+        if index == 'brute':
+            print(f"Using {workers} worker processes for the brute-force scan")
+        else:
+            print(f"ℹ️  --workers only applies to the brute-force engine; the {index} index runs in-process")
+    
+    if use_index and index != 'brute':
+        # The index carries its own multi-index hashing tables
+        if index != 'mih':
+            print(f"ℹ️  --index-dir uses the index's stored mih tables instead of {index}")
+        residual_rows, platform_rows, distances = platform_df.find_near(local_hashes[residual], limit, top_k)
+    else:
+        residual_rows, platform_rows, distances = find_near_duplicates(
+            local_hashes[residual], platform_hashes, limit, method=index, top_k=top_k, workers=workers
+        )
+    local_rows = residual[residual_rows]
+    near_df = combine_matched_rows(local_df, platform_df, local_rows, platform_rows, distances)
+    near_df['_local_row'] = local_rows
+    near_df['_platform_row'] = platform_rows
+    near_df['match_tier'] = 'near'
+    _record_tier(tier_stats, 'near', near_df, started, searched=len(residual))
+    
+    scope = f"within {max_distance} bits" if limit is not None else f"(top {top_k} per creative)"
+    print(f"✅ Found {len(near_df)} near-duplicate matches {scope} for {len(residual)} unmatched local creatives")
+    
+    # Tier 3: pixel verification of the near matches
+    if verify_pixels and len(near_df):
+        started = time.perf_counter()
+        print("🖼️  Verifying near-duplicate matches pixel by pixel...")
+        verified = verify_pixel_matches(near_df, pixel_threshold)
+        rejected = verified.eq(False)
+        near_df.loc[verified.eq(True), 'match_tier'] = 'pixel'
+        near_df = near_df[~rejected]
+        
+        pixel_df = near_df[near_df['match_tier'] == 'pixel']
+        _record_tier(tier_stats, 'pixel', pixel_df, started,
+                     rejected=int(rejected.sum()), unverified=int(verified.isna().sum()))
+        print(f"✅ Pixel-verified {len(pixel_df)} matches, rejected {int(rejected.sum())}, "
+              f"{int(verified.isna().sum())} could not be checked")
+    
+    merged_df = pd.concat([exact_df, near_df], ignore_index=True)
+    merged_df = apply_assignment(merged_df, assignment)
+    return merged_df.drop(columns=['_local_row', '_platform_row'])
+
+
+def apply_assignment(merged_df: pd.DataFrame, assignment: str) -> pd.DataFrame:
+    """
+    Reduce the candidate pairs to the requested assignment.
+    
+    Args:
+        merged_df: Candidate pairs with _local_row, _platform_row and hamming_distance columns
+        assignment: One of match_assignment.ASSIGNMENT_MODES
+        
+    Returns:
+        The kept rows of merged_df
+    """
+    if assignment == 'all' or len(merged_df) == 0:
+        return merged_df
+    
+    started = time.perf_counter()
+    kept = assign_matches(merged_df['_local_row'].to_numpy(), merged_df['_platform_row'].to_numpy(),
+                          merged_df['hamming_distance'].to_numpy(), assignment)
+    print(f"🔗 {assignment} assignment kept {len(kept)} of {len(merged_df)} candidate matches "
+          f"in {time.perf_counter() - started:.2f}s")
+    return merged_df.iloc[kept].reset_index(drop=True)
+
+
+def stream_hash_matching(local_df: pd.DataFrame, platform_files: Union[str, Sequence[str]], output_file: str,
+                         max_distance: int = 0, chunk_size: int = DEFAULT_STREAM_CHUNK_ROWS,
+                         tier_stats: Optional[Dict] = None) -> Dict[str, object]:
+    """
+    Match platform CSVs too large for memory by streaming them in chunks.
+    
+    The lookup is built once from the local hashes; each platform file is then
+    read chunk_size rows at a time, with only the ad_id, platform and phash
+    columns, and each chunk's matches are appended to the combined and
+    per-platform outputs as soon as they are found. Peak memory depends on
+    the local set and the chunk size, not on the size of the platform export.
+    
+    Unlike perform_hash_matching, rows are written in platform file order,
+    and with max_distance every local creative is searched (not just the
+    ones without an exact match, which are only known once the whole file
+    has been read); exact matches are still labelled 'exact'.
+    
+    Args:
+        local_df: DataFrame containing local creative hashes
+        platform_files: Platform hashes CSV, or a list of them
+        output_file: Combined mapping CSV; per-platform paths are derived from it
+        max_distance: Maximum Hamming distance for a near match; 0 matches exact hashes only
+        chunk_size: Platform rows read per chunk
+        tier_stats: Optional dictionary filled with per-tier counts and timings
+        
+    Returns:
+        Dictionary with platform_counts and match_counts (per platform),
+        matched_local (local creatives with a match) and output_files
+    """
+    if isinstance(platform_files, str):
+        platform_files = [platform_files]
+    
+    for platform_file in platform_files:
+        header = pd.read_csv(platform_file, nrows=0).columns
+        missing_columns = [col for col in STREAM_PLATFORM_COLUMNS if col not in header]
+        if missing_columns:
+            raise ValueError(f"Missing required columns in {platform_file}: {missing_columns}")
+    
+    started = time.perf_counter()
+    lookup = LocalHashLookup(local_df['phash'].to_numpy(), max_distance)
+    
+    platform_counts: Dict[str, int] = {}
+    match_counts: Dict[str, int] = {}
+    matched_local_rows = {tier: set() for tier in ('exact', 'near')}
+    tier_counts = {'exact': 0, 'near': 0}
+    
+    fieldnames = ['gdrive_filename', 'platform', 'ad_id', 'phash']
+    if max_distance > 0:
+        fieldnames += ['platform_phash', 'hamming_distance', 'match_tier']
+    
+    writers = {'ALL': StreamingHashWriter(output_file, fieldnames)}
+    try:
+        for platform_file in platform_files:
+            print(f"\n🔍 Streaming {platform_file} in chunks of {chunk_size} rows...")
+            chunks = pd.read_csv(platform_file, usecols=list(STREAM_PLATFORM_COLUMNS), chunksize=chunk_size,
+                                 dtype={'phash': str, 'ad_id': str})
+            rows_read = 0
+            for chunk in chunks:
+                chunk = encode_hash_column(chunk.reset_index(drop=True))
+                if chunk['phash'].dtype != local_df['phash'].dtype:
+                    raise ValueError("Local and platform hashes have different sizes; "
+                                     "regenerate them with the same hash size")
+                
+                rows_read += len(chunk)
+                for platform, count in count_platforms(chunk).items():
+                    platform_counts[platform] = platform_counts.get(platform, 0) + count
+                
+                local_rows, platform_rows, distances = lookup.match(chunk['phash'].to_numpy())
+                if len(local_rows) == 0:
+                    continue
+                
+                merged_df = combine_matched_rows(local_df, chunk, local_rows, platform_rows, distances)
+                if max_distance > 0:
+                    merged_df['match_tier'] = np.where(distances == 0, 'exact', 'near')
+                mapping = mapping_columns(merged_df)
+                
+                writers['ALL'].write_many(mapping.to_dict('records'))
+                for platform, platform_mapping in mapping.groupby(mapping['platform'].fillna(''), sort=False):
+                    if platform not in writers:
+                        writers[platform] = StreamingHashWriter(platform_output_file(output_file, platform), fieldnames)
+                    writers[platform].write_many(platform_mapping.to_dict('records'))
+                    match_counts[platform] = match_counts.get(platform, 0) + len(platform_mapping)
+                
+                exact = distances == 0
+                for tier, selected in (('exact', exact), ('near', ~exact)):
+                    tier_counts[tier] += int(selected.sum())
+                    matched_local_rows[tier].update(local_rows[selected].tolist())
+                print(f"   {rows_read} platform rows read, {sum(match_counts.values())} matches")
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    
+    output_files = {}
+    for platform, writer in writers.items():
+        if writer.close():
+            output_files[platform] = writer.output_file
+    
+    if tier_stats is not None:
+        elapsed = time.perf_counter() - started
+        for tier in ('exact', 'near') if max_distance > 0 else ('exact',):
+            tier_stats[tier] = {
+                'matches': tier_counts[tier],
+                'local_creatives': len(matched_local_rows[tier]),
+                'seconds': elapsed
+            }
+    
+    total_matches = sum(match_counts.values())
+    print(f"✅ Found {total_matches} matches in {sum(platform_counts.values())} platform creatives")
+    for output in output_files.values():
+        print(f"💾 Saved final mapping to: {output}")
+    
+    return {
+        'platform_counts': dict(sorted(platform_counts.items())),
+        'match_counts': dict(sorted(match_counts.items())),
+        'matched_local': len(matched_local_rows['exact'] | matched_local_rows['near']),
+        'output_files': output_files,
+    }
+
+
+def state_mapping_rows(merged_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mapping rows in the form kept by the incremental state (see match_state.py).
+    
+    Args:
+        merged_df: Matched rows with _local_key and _platform_key columns
+    
+    Returns:
+        DataFrame with match_state.STATE_MAPPING_COLUMNS
+    """
+    rows = mapping_columns(merged_df).reset_index(drop=True)
+    if 'match_tier' not in rows.columns:
+        rows['platform_phash'] = rows['phash']
+        rows['hamming_distance'] = 0
+        rows['match_tier'] = 'exact'
+    rows.insert(0, 'local_key', merged_df['_local_key'].to_numpy())
+    rows.insert(1, 'platform_key', merged_df['_platform_key'].to_numpy())
+    return rows[list(STATE_MAPPING_COLUMNS)]
+
+
+def incremental_hash_matching(local_df: pd.DataFrame, platform_df: pd.DataFrame, state: MatchState,
+                              max_distance: int = 0, index: str = 'mih', workers: int = 1,
+                              verify_pixels: bool = False,
+                              pixel_threshold: float = DEFAULT_PIXEL_THRESHOLD) -> Dict[str, object]:
+    """
+    Bring the mapping kept in the state up to date, matching only the rows that changed.
+    
+    Both inputs are diffed against the row keys stored by the last run:
+    
+    - mapping rows built from a removed (or changed) row are dropped
+    - added local rows go through perform_hash_matching against every platform row
+    - unchanged local rows are only matched against the added platform rows
+    
+    The tier rule of perform_hash_matching is kept, so the result is the
+    mapping a full run would produce: a local creative that gains its first
+    exact match loses its near matches, and one whose exact matches were all
+    removed is matched again in full. If the matching options differ from the
+    stored ones, everything is matched again.
+    
+    Args:
+        local_df: DataFrame containing local creative hashes
+        platform_df: DataFrame containing platform creative hashes
+        state: State of the last run; only read here, see MatchState.apply
+        max_distance: Maximum Hamming distance for a near match; 0 matches exact hashes only
+        index: Near-duplicate search index (see hash_index.SEARCH_METHODS)
+        workers: Worker processes for the brute-force engine
+        verify_pixels: Confirm near matches by comparing the images
+        pixel_threshold: Minimum thumbnail correlation accepted by pixel verification
+    
+    Returns:
+        Dictionary with the updated 'mapping' and the 'inserted' and 'removed'
+        mapping rows (all with match_state.STATE_MAPPING_COLUMNS), and 'update',
+        the arguments for MatchState.apply once the outputs are written
+    """
+    if local_df['phash'].dtype != platform_df['phash'].dtype:
+        raise ValueError("Local and platform hashes have different sizes; regenerate them with the same hash size")
+    
+    options = {
+        'version': STATE_VERSION,
+        'max_distance': max_distance,
+        'hash_dtype': str(local_df['phash'].dtype),
+        'verify_pixels': verify_pixels,
+        'pixel_threshold': pixel_threshold if verify_pixels else None,
+    }
+    stored_options = state.options()
+    reset = stored_options != options
+    if reset and stored_options is not None:
+        print("ℹ️  Matching options changed since the last run; matching everything again")
+    
+    local_keys, platform_keys = row_keys(local_df), row_keys(platform_df)
+    local_df = local_df.assign(_local_key=local_keys)
+    platform_df = platform_df.assign(_platform_key=platform_keys)
+    
+    no_keys = np.empty(0, dtype=np.int64)
+    stored_local = no_keys if reset else state.keys('local')
+    stored_platform = no_keys if reset else state.keys('platform')
+    stored_mapping = state.mapping()
+    
+    local_added = ~keys_isin(local_keys, stored_local)
+    platform_added = ~keys_isin(platform_keys, stored_platform)
+    removed_keys = {'local': stored_local[~keys_isin(stored_local, np.sort(local_keys))],
+                    'platform': stored_platform[~keys_isin(stored_platform, np.sort(platform_keys))]}
+    print(f"🔄 Local creatives: {int(local_added.sum())} added, {len(removed_keys['local'])} removed, "
+          f"{int((~local_added).sum())} unchanged")
+    print(f"🔄 Platform creatives: {int(platform_added.sum())} added, {len(removed_keys['platform'])} removed, "
+          f"{int((~platform_added).sum())} unchanged")
+    
+    # Stored rows built from a row that is gone
+    if reset:
+        gone = np.ones(len(stored_mapping), dtype=bool)
+    else:
+        gone = (keys_isin(stored_mapping['local_key'].to_numpy(), removed_keys['local'])
+                | keys_isin(stored_mapping['platform_key'].to_numpy(), removed_keys['platform']))
+    kept = stored_mapping[~gone]
+    
+    # Unchanged local creatives only need to be matched against the added platform rows
+    started = time.perf_counter()
+    unchanged_rows = np.flatnonzero(~local_added)
+    added_platform_rows = np.flatnonzero(platform_added)
+    local_hashes = local_df['phash'].to_numpy()
+    platform_hashes = platform_df['phash'].to_numpy()
+    if len(unchanged_rows) == 0 or len(added_platform_rows) == 0:
+        local_rows = platform_rows = distances = np.empty(0, dtype=np.int64)
+    elif max_distance > 0:
+        local_rows, platform_rows, distances = find_near_duplicates(
+            local_hashes[unchanged_rows], platform_hashes[added_platform_rows], max_distance,
+            method=index, workers=workers
+        )
+    else:
+        local_rows, platform_rows = find_exact_matches(local_hashes[unchanged_rows],
+                                                       platform_hashes[added_platform_rows])
+        distances = np.zeros(len(local_rows), dtype=np.int64)
+    local_rows, platform_rows = unchanged_rows[local_rows], added_platform_rows[platform_rows]
+    pair_keys = local_keys[local_rows]
+    
+    # Apply the tier rule: near matches only for local creatives without any exact match
+    had_exact = stored_mapping.loc[stored_mapping['match_tier'] == 'exact', 'local_key'].to_numpy()
+    still_exact = kept.loc[kept['match_tier'] == 'exact', 'local_key'].to_numpy()
+    new_exact = np.sort(pair_keys[distances == 0])
+    has_exact = np.sort(np.concatenate([still_exact, new_exact]))
+    lost_exact = np.unique(had_exact[keys_isin(had_exact, np.sort(local_keys[unchanged_rows]))
+                                     & ~keys_isin(had_exact, has_exact)])
+    superseded = ((kept['match_tier'] != 'exact').to_numpy()
+                  & keys_isin(kept['local_key'].to_numpy(), new_exact))
+    
+    keep = ~keys_isin(pair_keys, lost_exact) & ((distances == 0) | ~keys_isin(pair_keys, has_exact))
+    update_df = combine_matched_rows(local_df, platform_df, local_rows[keep], platform_rows[keep], distances[keep])
+    update_df['match_tier'] = np.where(distances[keep] == 0, 'exact', 'near')
+    
+    near = update_df['match_tier'] == 'near'
+    if verify_pixels and near.any():
+        print("🖼️  Verifying new near-duplicate matches pixel by pixel...")
+        verified = verify_pixel_matches(update_df[near], pixel_threshold)
+        update_df.loc[verified.index[verified.eq(True)], 'match_tier'] = 'pixel'
+        update_df = update_df.drop(index=verified.index[verified.eq(False)])
+    print(f"✅ Matched {len(unchanged_rows)} unchanged local creatives against "
+          f"{len(added_platform_rows)} added platform creatives in {time.perf_counter() - started:.2f}s: "
+          f"{len(update_df)} new matches")
+    
+    # Added local creatives, and those that lost every exact match, go through the full tiers
+    rematch_rows = np.flatnonzero(local_added | keys_isin(local_keys, lost_exact))
+    inserted = [state_mapping_rows(update_df)]
+    if len(rematch_rows):
+        if len(lost_exact):
+            print(f"ℹ️  {len(lost_exact)} local creatives lost all their exact matches and are matched again")
+        merged_df = perform_hash_matching(local_df.iloc[rematch_rows], platform_df, max_distance, index,
+                                          None, workers, verify_pixels, pixel_threshold)
+        inserted.append(state_mapping_rows(merged_df))
+    inserted = pd.concat(inserted, ignore_index=True)
+    
+    removed = pd.concat([stored_mapping[gone], kept[superseded]], ignore_index=True)
+    mapping = pd.concat([kept[~superseded], inserted], ignore_index=True)
+    print(f"✅ Mapping updated: {len(inserted)} rows added, {len(removed)} removed, {len(mapping)} in total")
+    
+    return {
+        'mapping': mapping,
+        'inserted': inserted,
+        'removed': removed,
+        'update': {
+            'options': options,
+            'keys': {'local': local_keys, 'platform': platform_keys},
+            'inserted': inserted,
+            'removed_pairs': (removed['local_key'].to_numpy(), removed['platform_key'].to_numpy()),
+            'reset': reset,
+        },
+    }
 
 
 def format_final_mapping(merged_df: pd.DataFrame) -> pd.DataFrame:
@@ -128,9 +786,50 @@ def format_final_mapping(merged_df: pd.DataFrame) -> pd.DataFrame:
     """
     print("\n📋 Formatting final mapping...")
     
+    final_mapping = mapping_columns(merged_df)
+    
+    sort_columns = ['gdrive_filename']
+    if 'hamming_distance' in final_mapping.columns:
+        sort_columns.append('hamming_distance')
+    
+    # Sort by filename for better readability
+    final_mapping = final_mapping.sort_values(sort_columns, kind='stable')
+    
+    print(f"✅ Formatted {len(final_mapping)} matches")
+    
+    return final_mapping
+
+
+def local_name_column(local_df: pd.DataFrame) -> str:
+    """
+    Column that names each local creative in the mapping.
+    
+    fingerprint_local_folder.py scans subfolders, where the same filename can
+    appear in several places, so its relative_path is preferred.
+    
+    Args:
+        local_df: DataFrame containing local creative hashes (or merged rows)
+        
+    Returns:
+        'relative_path' if the hashes have one, 'filename' otherwise (e.g.
+        Drive hashes or files written before relative paths were added)
+    """
+    return 'relative_path' if 'relative_path' in local_df.columns else 'filename'
+
+
+def mapping_columns(merged_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Select and rename the final mapping columns, keeping the row order.
+    
+    Args:
+        merged_df: DataFrame containing merged local and platform data
+        
+    Returns:
+        DataFrame with the final mapping columns
+    """
     # Select and rename columns for clarity
     final_mapping = merged_df[[
-        'filename',      # Local filename
+        local_name_column(merged_df),  # Local file, by relative path where known
         'platform',      # Platform name
         'ad_id',         # Platform ad ID
         'phash'          # Perceptual hash
@@ -139,15 +838,19 @@ def format_final_mapping(merged_df: pd.DataFrame) -> pd.DataFrame:
     # Rename columns for clarity
     final_mapping.columns = ['gdrive_filename', 'platform', 'ad_id', 'phash']
     
-    # Sort by filename for better readability
-    final_mapping = final_mapping.sort_values('gdrive_filename')
+    # Hashes are written back out as hex strings
+    final_mapping['phash'] = hashes_to_hex(final_mapping['phash'].to_numpy())
     
-    print(f"✅ Formatted {len(final_mapping)} matches")
+    # Tiered matching also reports the platform hash, the distance and the tier
+    if 'match_tier' in merged_df.columns:
+        final_mapping['platform_phash'] = hashes_to_hex(merged_df['platform_phash'].to_numpy())
+        final_mapping['hamming_distance'] = merged_df['hamming_distance'].to_numpy()
+        final_mapping['match_tier'] = merged_df['match_tier'].to_numpy()
     
     return final_mapping
 
 
-def save_final_mapping(final_mapping: pd.DataFrame, output_file: str = "final_creative_mapping_META.csv") -> None:
+def save_final_mapping(final_mapping: pd.DataFrame, output_file: str = DEFAULT_OUTPUT_FILE) -> None:
     """
     Save the final mapping to a CSV file.
     
@@ -163,36 +866,130 @@ def save_final_mapping(final_mapping: pd.DataFrame, output_file: str = "final_cr
         raise Exception(f"Error saving final mapping to {output_file}: {e}")
 
 
-def print_summary(local_df: pd.DataFrame, platform_df: pd.DataFrame, final_mapping: pd.DataFrame) -> None:
+def platform_output_file(output_file: str, platform: str) -> str:
+    """
+    Per-platform mapping path derived from the combined output path.
+    
+    Args:
+        output_file: Combined mapping path, e.g. final_creative_mapping_ALL.csv
+        platform: Platform name, e.g. Meta
+        
+    Returns:
+        Path such as final_creative_mapping_META.csv (the platform name replaces
+        a trailing _ALL, otherwise it is appended)
+    """
+    root, extension = os.path.splitext(output_file)
+    if root.endswith('_ALL'):
+        root = root[:-len('_ALL')]
+    name = re.sub(r'[^A-Za-z0-9]+', '_', str(platform)).strip('_').upper() or 'UNKNOWN'
+    return f"{root}_{name}{extension}"
+
+
+def save_platform_mappings(final_mapping: pd.DataFrame, output_file: str,
+                           changed_platforms: Optional[set] = None) -> Dict[str, str]:
+    """
+    Save the combined mapping and one mapping per platform.
+    
+    Args:
+        final_mapping: DataFrame containing the final mapping of every platform
+        output_file: Combined mapping path; per-platform paths are derived from it
+        changed_platforms: Only rewrite the files of these platforms (and any
+            missing file); a changed platform left without matches gets an
+            empty file. None rewrites everything
+        
+    Returns:
+        Dictionary mapping 'ALL' and each platform with matches to its file
+    """
+    if changed_platforms is None or changed_platforms or not os.path.exists(output_file):
+        save_final_mapping(final_mapping, output_file)
+    output_files = {'ALL': output_file}
+    
+    platform_mappings = dict(tuple(final_mapping.groupby(final_mapping['platform'].fillna(''), sort=True)))
+    for platform in sorted(set(platform_mappings) | set(changed_platforms or ())):
+        platform_file = platform_output_file(output_file, platform)
+        platform_mapping = platform_mappings.get(platform, final_mapping.iloc[:0])
+        if changed_platforms is None or platform in changed_platforms or not os.path.exists(platform_file):
+            save_final_mapping(platform_mapping, platform_file)
+        if len(platform_mapping):
+            output_files[platform] = platform_file
+    
+    return output_files
+
+
+def platform_totals(platform_df: pd.DataFrame) -> Dict[str, int]:
+    """
+    Number of platform creatives per platform.
+    
+    Args:
+        platform_df: DataFrame or PlatformHashIndex containing platform creative hashes
+        
+    Returns:
+        Dictionary mapping platform name to creative count
+    """
+    if isinstance(platform_df, PlatformHashIndex):
+        return platform_df.platform_counts()
+    return count_platforms(platform_df)
+
+
+def print_summary(total_local: int, platform_counts: Dict[str, int], match_counts: Dict[str, int],
+                  matched_local: int, output_files: Optional[Dict[str, str]] = None,
+                  tier_stats: Optional[Dict] = None) -> None:
     """
     Print a summary of the matching results.
     
     Args:
-        local_df: DataFrame containing local creative hashes
-        platform_df: DataFrame containing platform creative hashes
-        final_mapping: DataFrame containing successful matches
+        total_local: Number of local creatives
+        platform_counts: Number of platform creatives per platform
+        match_counts: Number of mapping rows per platform
+        matched_local: Number of local creatives with at least one match
+        output_files: Files written, from save_platform_mappings
+        tier_stats: Per-tier counts and timings from perform_hash_matching
     """
-    total_local = len(local_df)
-    total_platform = len(platform_df)
-    successful_matches = len(final_mapping)
+    total_platform = sum(platform_counts.values())
+    successful_matches = sum(match_counts.values())
     
     # Calculate match rates
-    local_match_rate = (successful_matches / total_local * 100) if total_local > 0 else 0
+    local_match_rate = (matched_local / total_local * 100) if total_local > 0 else 0
     platform_match_rate = (successful_matches / total_platform * 100) if total_platform > 0 else 0
     
     print("\n" + "=" * 60)
     print("📊 MATCHING SUMMARY")
     print("=" * 60)
     print(f"Total local creatives fingerprinted: {total_local}")
-    print(f"Total Meta creatives fingerprinted: {total_platform}")
+    print(f"Total platform creatives fingerprinted: {total_platform}")
     print(f"Successful matches found: {successful_matches}")
     print(f"Match Rate (local): {local_match_rate:.1f}%")
     print(f"Match Rate (platform): {platform_match_rate:.1f}%")
+    
+    if len(platform_counts) > 1 or set(match_counts) - set(platform_counts):
+        print("Matches by platform:")
+        for platform in sorted(set(platform_counts) | set(match_counts)):
+            total = platform_counts.get(platform, 0)
+            matches = match_counts.get(platform, 0)
+            rate = (matches / total * 100) if total > 0 else 0
+            print(f"   {platform:<10} {matches} matches for {total} creatives ({rate:.1f}%)")
+    
+    if tier_stats and len(tier_stats) > 1:
+        print("Matches by tier:")
+        for tier in MATCH_TIERS:
+            if tier not in tier_stats:
+                continue
+            stats = tier_stats[tier]
+            line = (f"   {tier:<6} {stats['matches']} matches for {stats['local_creatives']} local creatives "
+                    f"in {stats['seconds']:.2f}s")
+            if 'searched' in stats:
+                line += f" (searched {stats['searched']} unmatched)"
+            if 'rejected' in stats:
+                line += f" ({stats['rejected']} rejected, {stats['unverified']} not checked)"
+            print(line)
+    
     print("=" * 60)
     
     if successful_matches > 0:
-        print("\n🎉 Successfully created mapping between local files and Meta ad IDs!")
-        print(f"📁 Output file: final_creative_mapping_META.csv")
+        platforms = ' and '.join(platform for platform in match_counts if match_counts[platform])
+        print(f"\n🎉 Successfully created mapping between local files and {platforms} ad IDs!")
+        for platform, output_file in (output_files or {}).items():
+            print(f"📁 Output file ({platform}): {output_file}")
     else:
         print("\n⚠️  No matches found. This could indicate:")
         print("   - Different image versions between local and platform")
@@ -200,21 +997,24 @@ def print_summary(local_df: pd.DataFrame, platform_df: pd.DataFrame, final_mappi
         print("   - Different image formats or processing")
 
 
-def validate_input_files(local_file: str, platform_file: str) -> None:
+def validate_input_files(local_file: Optional[str], platform_files: Union[None, str, Sequence[str]]) -> None:
     """
     Validate that input files exist and are accessible.
     
     Args:
-        local_file: Path to local hashes file
-        platform_file: Path to platform hashes file
+        local_file: Path to local hashes file (None to skip)
+        platform_files: Path or list of paths to platform hashes files (None to skip)
     """
     missing_files = []
     
-    if not os.path.exists(local_file):
+    if local_file and not os.path.exists(local_file):
         missing_files.append(local_file)
     
-    if not os.path.exists(platform_file):
-        missing_files.append(platform_file)
+    if isinstance(platform_files, str):
+        platform_files = [platform_files]
+    for platform_file in platform_files or []:
+        if not os.path.exists(platform_file):
+            missing_files.append(platform_file)
     
     if missing_files:
         print("❌ Missing required input files:")
@@ -233,7 +1033,21 @@ def main():
 Examples:
   python3 match_hashes.py
   python3 match_hashes.py -l my_local_hashes.csv -p my_platform_hashes.csv
+  python3 match_hashes.py -p platform_creative_hashes_META.csv platform_creative_hashes_GOOGLE.csv
   python3 match_hashes.py -o my_final_mapping.csv
+  python3 match_hashes.py --max-distance 4
+  python3 match_hashes.py --max-distance 4 --index bktree
+  python3 match_hashes.py --max-distance 6 --top-k 1 --index brute
+  python3 match_hashes.py --max-distance 8 --index brute --workers 0
+  python3 match_hashes.py --max-distance 6 --verify-pixels
+  python3 match_hashes.py --max-distance 6 --assignment one-to-one
+  python3 match_hashes.py --stream -p platform_export_full.csv --max-distance 2
+  python3 match_hashes.py --incremental match_state.db --changes mapping_changes.csv
+  python3 match_hashes.py --build-index platform_index/
+  python3 match_hashes.py --index-dir platform_index/ -l new_uploads.csv --max-distance 4
+  python3 match_hashes.py --serve --max-distance 4
+  python3 match_hashes.py --serve --index-dir platform_index/ --socket /tmp/hash-match.sock
+  python3 match_hashes.py --index-dir platform_index/ --lookup banner.jpg uploads/ --top-k 3
         """
     )
     
@@ -245,14 +1059,150 @@ Examples:
     
     parser.add_argument(
         "-p", "--platform-file",
-        default="platform_creative_hashes_META.csv",
-        help="Platform hashes CSV file (default: platform_creative_hashes_META.csv)"
+        nargs="+",
+        metavar="FILE",
+        help="Platform hashes CSV file(s); several files are matched together in one pass "
+             "(default: platform_creative_hashes_ALL.csv, or platform_creative_hashes_META.csv if there is no ALL file)"
     )
     
     parser.add_argument(
         "-o", "--output",
-        default="final_creative_mapping_META.csv",
-        help="Output CSV filename (default: final_creative_mapping_META.csv)"
+        default=DEFAULT_OUTPUT_FILE,
+        help=f"Combined output CSV filename; one file per platform is written next to it, "
+             f"e.g. final_creative_mapping_META.csv (default: {DEFAULT_OUTPUT_FILE})"
+    )
+    
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        default=0,
+        metavar="K",
+        help="Also match hashes that differ by up to K bits (default: 0, exact matches only)"
+    )
+    
+    parser.add_argument(
+        "--index",
+        choices=SEARCH_METHODS,
+        default="mih",
+        help="Near-duplicate engine used with --max-distance: multi-index hashing, BK-tree "
+             "or blocked brute-force scan (default: mih)"
+    )
+    
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        metavar="N",
+        help="Keep only the N closest platform matches per local creative"
+    )
+    
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for the brute-force engine (default: 1, 0 = all cores)"
+    )
+    
+    parser.add_argument(
+        "--assignment",
+        choices=ASSIGNMENT_MODES,
+        default="all",
+        help="Keep every candidate match (all), pair each local creative and platform ad at most once "
+             "with the smallest total distance (one-to-one), or give each ad its closest local creative "
+             "(many-to-one) (default: all)"
+    )
+    
+    parser.add_argument(
+        "--verify-pixels",
+        action="store_true",
+        help="Confirm near-duplicate matches by comparing the local image with the platform thumbnail"
+    )
+    
+    parser.add_argument(
+        "--pixel-threshold",
+        type=float,
+        default=DEFAULT_PIXEL_THRESHOLD,
+        help=f"Minimum image correlation accepted by --verify-pixels (default: {DEFAULT_PIXEL_THRESHOLD})"
+    )
+    
+    parser.add_argument(
+        "--build-index",
+        metavar="DIR",
+        help="Build a persistent index of the platform hashes file in DIR and exit"
+    )
+    
+    parser.add_argument(
+        "--index-dir",
+        metavar="DIR",
+        help="Match against a prebuilt platform index instead of parsing the platform CSV"
+    )
+    
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the platform file in chunks instead of loading it, for exports larger than memory; "
+             "matches are written in platform file order as they are found"
+    )
+    
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_STREAM_CHUNK_ROWS,
+        metavar="ROWS",
+        help=f"Platform rows read per chunk with --stream (default: {DEFAULT_STREAM_CHUNK_ROWS})"
+    )
+    
+    parser.add_argument(
+        "--incremental",
+        metavar="STATE",
+        help="Keep the inputs of each run in the STATE database and only match the rows added or changed "
+             "since the last run; the mapping files are patched instead of rebuilt"
+    )
+    
+    parser.add_argument(
+        "--changes",
+        metavar="FILE",
+        help="With --incremental, write the mapping rows inserted and removed by this run to FILE"
+    )
+    
+    parser.add_argument(
+        "--lookup",
+        nargs="+",
+        metavar="PATH",
+        help="Reverse image lookup: print the nearest platform ads for these image files or folders "
+             "(--top-k per image, default 5; --max-distance caps the distance)"
+    )
+    
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep the platform hashes loaded and answer match queries over HTTP instead of matching a local file"
+    )
+    
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address for --serve to listen on (default: 127.0.0.1)"
+    )
+    
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port for --serve to listen on (default: 8765)"
+    )
+    
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Serve on a Unix socket at PATH instead of a TCP port"
+    )
+    
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="How often --serve checks the platform file or index for changes (default: 2, 0 = never)"
     )
     
     parser.add_argument(
@@ -263,26 +1213,158 @@ Examples:
     
     args = parser.parse_args()
     
+    if not 0 <= args.max_distance <= 64:
+        parser.error("--max-distance must be between 0 and 64")
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    
+    if args.verify_pixels and not (args.max_distance or args.top_k):
+        parser.error("--verify-pixels checks near-duplicate matches; use it with --max-distance or --top-k")
+    if args.build_index and args.index_dir:
+        parser.error("--build-index and --index-dir cannot be combined")
+    if args.serve and (args.build_index or args.verify_pixels):
+        parser.error("--serve cannot be combined with --build-index or --verify-pixels")
+    if args.lookup and (args.serve or args.build_index or args.verify_pixels):
+        parser.error("--lookup cannot be combined with --serve, --build-index or --verify-pixels")
+    if args.stream:
+        if args.serve or args.lookup or args.build_index or args.index_dir:
+            parser.error("--stream reads the platform CSV; it cannot be combined with --serve, --lookup, "
+                         "--build-index or --index-dir")
+        if args.top_k or args.verify_pixels or args.assignment != 'all':
+            parser.error("--top-k, --verify-pixels and --assignment need every match at once and do not work with --stream")
+        if args.chunk_size < 1:
+            parser.error("--chunk-size must be at least 1")
+    
+    if args.incremental:
+        if args.serve or args.lookup or args.build_index or args.index_dir or args.stream:
+            parser.error("--incremental diffs the platform CSV; it cannot be combined with --serve, --lookup, "
+                         "--build-index, --index-dir or --stream")
+        if args.top_k or args.assignment != 'all':
+            parser.error("--top-k and --assignment depend on every match at once and do not work with --incremental")
+    if args.changes and not args.incremental:
+        parser.error("--changes needs --incremental")
+    
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    platform_files = args.platform_file or default_platform_files()
+    # Index staleness can only be tracked for a single source file
+    source_file = platform_files[0] if len(platform_files) == 1 else None
+    
     try:
         print("🔍 Creative Hash Matching System")
         print("=" * 40)
         
+        if args.build_index:
+            # Index the platform side once; later runs match against it with --index-dir
+            validate_input_files(None, platform_files)
+            platform_df = load_platform_hashes(platform_files)
+            print(f"\n🗂️  Building platform index in {args.build_index}...")
+            started = time.perf_counter()
+            platform_index = build_platform_index(platform_df, args.build_index, source_file)
+            print(f"✅ Indexed {len(platform_index)} platform creatives "
+                  f"({platform_index.manifest['substrings']} substring tables) in {time.perf_counter() - started:.2f}s")
+            return
+        
+        if args.lookup:
+            # Imported here: match_service imports this module to load the platform CSV
+            from match_service import DEFAULT_LOOKUP_TOP_K, MatchService, lookup_image_files
+            
+            validate_input_files(None, None if args.index_dir else platform_files)
+            print("\n📂 Loading platform hashes...")
+            service = MatchService(None if args.index_dir else platform_files, args.index_dir)
+            top_k = args.top_k or DEFAULT_LOOKUP_TOP_K
+            
+            print(f"\n🔎 Nearest {top_k} platform ads per image:")
+            for result in lookup_image_files(service, args.lookup, top_k, args.max_distance or None):
+                if 'error' in result:
+                    print(f"✗ {result['name']}: {result['error']}")
+                    continue
+                print(f"\n{result['name']} (phash {result['hash']})")
+                if not result['matches']:
+                    print("   no platform ads within the distance limit")
+                for match in result['matches']:
+                    print(f"   {match['hamming_distance']:>2} bits  {match['platform']:<8} {match['ad_id']:<20} "
+                          f"{match.get('creative_name', '')}")
+            return
+        
+        if args.serve:
+            # Imported here: match_service imports this module to load the platform CSV
+            from match_service import MatchService, run_match_server
+            
+            validate_input_files(None, None if args.index_dir else platform_files)
+            print("\n📂 Loading platform hashes...")
+            service = MatchService(None if args.index_dir else platform_files, args.index_dir,
+                                   args.max_distance, args.top_k)
+            run_match_server(service, args.host, args.port, args.socket, args.reload_interval, args.verbose)
+            return
+        
         # Validate input files
-        validate_input_files(args.local_file, args.platform_file)
+        validate_input_files(args.local_file, None if args.index_dir else platform_files)
+        
+        if args.stream:
+            print("\n📂 Loading local hashes...")
+            local_df = load_local_hashes(args.local_file)
+            if args.index != 'mih':
+                print(f"ℹ️  --stream indexes the local hashes with mih; --index {args.index} is ignored")
+            
+            tier_stats = {}
+            results = stream_hash_matching(local_df, platform_files, args.output,
+                                           args.max_distance, args.chunk_size, tier_stats)
+            print_summary(len(local_df), results['platform_counts'], results['match_counts'],
+                          results['matched_local'], results['output_files'], tier_stats)
+            return
+        
+        if args.incremental:
+            print("\n📂 Loading input files...")
+            local_df = load_local_hashes(args.local_file)
+            platform_df = load_platform_hashes(platform_files)
+            
+            with MatchState(args.incremental) as state:
+                results = incremental_hash_matching(local_df, platform_df, state, args.max_distance, args.index,
+                                                    workers, args.verify_pixels, args.pixel_threshold)
+                
+                columns = ['gdrive_filename', 'platform', 'ad_id', 'phash']
+                sort_columns = ['gdrive_filename']
+                if args.max_distance > 0:
+                    columns += ['platform_phash', 'hamming_distance', 'match_tier']
+                    sort_columns.append('hamming_distance')
+                final_mapping = results['mapping'][columns].sort_values(sort_columns, kind='stable')
+                changes = mapping_changes(results['inserted'], results['removed'], columns)
+                
+                # Outputs first, state last: if the run is interrupted, the next one redoes the same diff
+                output_files = save_platform_mappings(final_mapping, args.output,
+                                                      set(changes['platform'].fillna('')))
+                if args.changes:
+                    changes.to_csv(args.changes, index=False)
+                    print(f"💾 Saved {len(changes)} mapping changes to: {args.changes}")
+                state.apply(**results['update'])
+            
+            match_counts = final_mapping['platform'].fillna('').value_counts().to_dict()
+            print_summary(len(local_df), platform_totals(platform_df), match_counts,
+                          final_mapping['gdrive_filename'].nunique(), output_files)
+            return
         
         # Load input data
         print("\n📂 Loading input files...")
         local_df = load_local_hashes(args.local_file)
-        platform_df = load_platform_hashes(args.platform_file)
+        if args.index_dir:
+            platform_df = load_platform_index(args.index_dir)
+        else:
+            platform_df = load_platform_hashes(platform_files)
         
         if args.verbose:
             print(f"\nLocal data preview:")
             print(local_df.head())
             print(f"\nPlatform data preview:")
-            print(platform_df.head())
+            if isinstance(platform_df, PlatformHashIndex):
+                print(platform_df.take(np.arange(min(5, len(platform_df)))))
+            else:
+                print(platform_df.head())
         
         # Perform hash matching
-        merged_df = perform_hash_matching(local_df, platform_df)
+        tier_stats = {}
+        merged_df = perform_hash_matching(local_df, platform_df, args.max_distance, args.index,
+                                          args.top_k, workers, args.verify_pixels, args.pixel_threshold,
+                                          tier_stats, args.assignment)
         
         if len(merged_df) == 0:
             print("\n⚠️  No matches found. Check that both files contain the same images.")
@@ -295,11 +1377,13 @@ Examples:
         # Format final mapping
         final_mapping = format_final_mapping(merged_df)
         
-        # Save results
-        save_final_mapping(final_mapping, args.output)
+        # Save the combined and per-platform mappings
+        output_files = save_platform_mappings(final_mapping, args.output)
         
         # Print summary
-        print_summary(local_df, platform_df, final_mapping)
+        match_counts = final_mapping['platform'].fillna('').value_counts().to_dict()
+        print_summary(len(local_df), platform_totals(platform_df), match_counts,
+                      final_mapping['gdrive_filename'].nunique(), output_files, tier_stats)
         
         if args.verbose:
             print(f"\nFinal mapping preview:")
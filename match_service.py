@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+"""
+Hash Match Service
+
+Long-running server behind `match_hashes.py --serve`. The platform hashes are
+loaded once (from the platform CSV or a prebuilt index directory) and kept
+warm in memory, so each query only pays for the lookup itself rather than
+Python startup, CSV parsing and index building.
+
+Endpoints (JSON responses):
+
+- `GET  /health`: index size, source and load time
+- `GET  /match?hash=<hex>[&hash=<hex>...][&max_distance=K][&top_k=N]`
+- `POST /match` with `{"hashes": [...], "max_distance": K, "top_k": N}`
+- `POST /match/image` with raw image bytes as the body (same query
+  parameters as GET /match); the image is decoded and phashed the same way
+  as the fingerprinting scripts
+- `POST /lookup`: reverse image lookup, the top_k nearest platform creatives
+  (default 5, at any distance unless max_distance is set) for each image;
+  either a raw image body or a JSON batch
+  `{"images": [{"name": ..., "data": <base64>}], "top_k": N}`
+
+The server listens on a local TCP port or a Unix socket. A background thread
+polls the platform CSV (or the index manifest) and swaps in a freshly loaded
+index when it changes; queries in flight keep using the index they started with.
+"""
+
+import base64
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import UnidentifiedImageError
+
+from fingerprint_local_folder import DEFAULT_CHUNK_SIZE, chunked, iter_image_files
+from hash_codec import hashes_to_hex, hex_to_hashes
+from hash_index import limit_per_local_row
+from image_hashing import BatchHasher, load_image_for_hashing
+from platform_index import MANIFEST_FILE, PlatformHashIndex
+
+# Seconds between checks of the platform source for changes
+DEFAULT_RELOAD_INTERVAL = 2.0
+
+# Largest request body accepted (raw images included)
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+# Hashes accepted in one batch query
+MAX_BATCH_HASHES = 100_000
+
+# Images accepted in one /lookup request
+MAX_LOOKUP_IMAGES = 1_000
+
+# Platform creatives returned per image by a reverse image lookup
+DEFAULT_LOOKUP_TOP_K = 5
+
+
+class MatchService:
+    """
+    Warm platform index with hot reload, shared by all request threads.
+    """
+
+    def __init__(self, platform_file: Union[None, str, Sequence[str]] = None, index_dir: Optional[str] = None,
+                 max_distance: int = 0, top_k: Optional[int] = None):
+        """
+        Load the platform hashes.
+
+        Args:
+            platform_file: Platform hashes CSV, or a list of them (used when index_dir is not given)
+            index_dir: Prebuilt index directory from --build-index
+            max_distance: Default search radius for queries that do not set one
+            top_k: Default per-hash result limit for queries that do not set one
+        """
+        if not platform_file and not index_dir:
+            raise ValueError("MatchService needs a platform file or an index directory")
+
+        self.platform_files = [platform_file] if isinstance(platform_file, str) else list(platform_file or [])
+        self.index_dir = index_dir
+        self.max_distance = max_distance
+        self.top_k = top_k
+        self.loaded_at = None
+        self.reloads = 0
+
+        self._signature = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self.index = self._load()
+
+    @property
+    def source(self) -> str:
+        """The file or directory the index is loaded from."""
+        return self.index_dir or ', '.join(self.platform_files)
+
+    def _source_signature(self):
+        paths = [os.path.join(self.index_dir, MANIFEST_FILE)] if self.index_dir else self.platform_files
+        try:
+            stats = [os.stat(path) for path in paths]
+        except OSError:
+            return None
+        return tuple((stat.st_size, stat.st_mtime_ns) for stat in stats)
+
+    def _load(self) -> PlatformHashIndex:
+        # Imported here: match_hashes imports this module for --serve
+        from match_hashes import load_platform_hashes
+
+        signature = self._source_signature()
+        if self.index_dir:
+            index = PlatformHashIndex(self.index_dir)
+        else:
+            index = PlatformHashIndex.from_dataframe(load_platform_hashes(self.platform_files))
+
+        self._signature = signature
+        self.loaded_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        return index
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the index if its source changed since it was loaded.
+
+        The new index is built before it replaces the old one, so a failed
+        reload (e.g. a half-written CSV) keeps serving the previous index.
+
+        Returns:
+            True if a new index was swapped in
+        """
+        signature = self._source_signature()
+        if signature is None or signature == self._signature:
+            return False
+
+        with self._lock:
+            if signature == self._signature:
+                return False
+            try:
+                index = self._load()
+            except Exception as e:
+                print(f"⚠️  Reload of {self.source} failed, keeping the current index: {e}")
+                return False
+            self.index = index
+            self.reloads += 1
+
+        print(f"🔄 Reloaded {len(index)} platform creatives from {self.source}")
+        return True
+
+    def start_watching(self, interval: float = DEFAULT_RELOAD_INTERVAL) -> None:
+        """
+        Poll the source for changes in a background thread.
+
+        Args:
+            interval: Seconds between checks
+        """
+        def watch():
+            while not self._stop.wait(interval):
+                self.reload_if_changed()
+
+        self._watcher = threading.Thread(target=watch, name="index-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        """Stop the reload thread."""
+        self._stop.set()
+
+    def match_hashes(self, hashes: Sequence[str], max_distance: Optional[int] = None,
+                     top_k: Optional[int] = None) -> List[Dict]:
+        """
+        Look up hex hashes in the platform index.
+
+        Args:
+            hashes: Hexadecimal phash strings
+            max_distance: Search radius in bits (default: the service default)
+            top_k: Keep only the top_k closest platform creatives per hash
+
+        Returns:
+            One result per input hash, in order: {"hash", "matches": [{ad_id,
+            platform, phash, hamming_distance, ...}]}, closest first
+
+        Raises:
+            ValueError: If a hash is not a valid 64-bit hex string
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        top_k = self.top_k if top_k is None else top_k
+        return self._search(hashes, max_distance, top_k)
+
+    def nearest(self, hashes: Sequence[str], top_k: int = DEFAULT_LOOKUP_TOP_K,
+                max_distance: Optional[int] = None) -> List[Dict]:
+        """
+        Find the top_k closest platform creatives for each hex hash, at any distance.
+
+        Args:
+            hashes: Hexadecimal phash strings
+            top_k: Number of platform creatives returned per hash
+            max_distance: Optional cap on the distance (None searches all distances)
+
+        Returns:
+            Results shaped like match_hashes()
+
+        Raises:
+            ValueError: If a hash is not a valid 64-bit hex string
+        """
+        return self._search(hashes, max_distance, top_k)
+
+    def _search(self, hashes: Sequence[str], max_distance: Optional[int], top_k: Optional[int]) -> List[Dict]:
+        if max_distance is not None and not 0 <= max_distance <= 64:
+            raise ValueError("max_distance must be between 0 and 64")
+        if top_k is not None and top_k < 1:
+            raise ValueError("top_k must be at least 1")
+
+        queries = hex_to_hashes(list(hashes))
+        if queries.dtype != np.uint64:
+            raise ValueError("Only 64-bit hashes can be matched")
+
+        index = self.index
+        if max_distance is None or max_distance > 0:
+            query_rows, index_rows, distances = index.find_near(queries, max_distance, top_k)
+        else:
+            query_rows, index_rows = index.find_exact(queries)
+            distances = np.zeros(len(query_rows), dtype=np.uint8)
+            if top_k is not None:
+                query_rows, index_rows, distances = limit_per_local_row(query_rows, index_rows, distances, top_k)
+
+        # Built from plain lists rather than index.take(): a DataFrame per
+        # request costs more than the lookup itself
+        columns = {column: index.column(column, index_rows) for column in index.columns}
+        columns['phash'] = hashes_to_hex(index.hashes[index_rows])
+        columns['hamming_distance'] = distances.tolist()
+
+        results = [{'hash': value, 'matches': []} for value in hashes_to_hex(queries)]
+        for position, query_row in enumerate(query_rows.tolist()):
+            results[query_row]['matches'].append({name: values[position] for name, values in columns.items()})
+        return results
+
+    def hash_images(self, images: Sequence[bytes]) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Decode images and compute their phash with the fingerprinting pipeline.
+
+        Uses the same decode (load_image_for_hashing) and batched phash
+        (BatchHasher) as fingerprint_local_folder, so a file hashed here gets
+        exactly the hash it has in local_creative_hashes.csv.
+
+        Args:
+            images: Encoded image bytes
+
+        Returns:
+            (hex phash or None, error message or None) per image, in order
+        """
+        results = [None] * len(images)
+        batcher = BatchHasher(batch_size=max(1, len(images)))
+
+        for position, data in enumerate(images):
+            try:
+                completed = batcher.add(position, load_image_for_hashing(io.BytesIO(data)))
+            except UnidentifiedImageError:
+                results[position] = (None, "Not a valid image")
+                continue
+            except Exception as e:
+                results[position] = (None, f"Could not decode image: {e}")
+                continue
+            for done_position, hashes in completed:
+                results[done_position] = (hashes['phash'], None)
+
+        for position, hashes in batcher.flush():
+            results[position] = (hashes['phash'], None)
+        return results
+
+    def lookup_images(self, images: Sequence[Tuple[str, bytes]], top_k: int = DEFAULT_LOOKUP_TOP_K,
+                      max_distance: Optional[int] = None) -> List[Dict]:
+        """
+        Reverse image lookup: the top_k nearest platform creatives for each image.
+
+        All images are hashed as one batch and matched with a single index query.
+
+        Args:
+            images: (name, encoded image bytes) pairs
+            top_k: Number of platform creatives returned per image
+            max_distance: Optional cap on the distance (None searches all distances)
+
+        Returns:
+            One entry per image, in order: {"name", "hash", "matches"} like
+            nearest(), or {"name", "error"} for images that could not be decoded
+        """
+        hashed = self.hash_images([data for _, data in images])
+        valid = [position for position, (phash, _) in enumerate(hashed) if phash is not None]
+        matches = iter(self.nearest([hashed[position][0] for position in valid], top_k, max_distance)) if valid else iter(())
+
+        results = []
+        for (name, _), (phash, error) in zip(images, hashed):
+            if phash is None:
+                results.append({'name': name, 'error': error})
+            else:
+                results.append({'name': name, **next(matches)})
+        return results
+
+
+def lookup_image_files(service: MatchService, paths: Sequence[str], top_k: int = DEFAULT_LOOKUP_TOP_K,
+                       max_distance: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict]:
+    """
+    Reverse image lookup for files and folders, in batches.
+
+    Folders are scanned recursively for image files the same way as
+    fingerprint_local_folder.py.
+
+    Args:
+        service: Loaded MatchService
+        paths: Image files and/or folders
+        top_k: Number of platform creatives returned per image
+        max_distance: Optional cap on the distance (None searches all distances)
+        chunk_size: Images hashed and matched per batch
+
+    Yields:
+        lookup_images() results, with the file path as the name
+
+    Raises:
+        FileNotFoundError: If a path does not exist
+    """
+    def iter_files():
+        for path in paths:
+            if os.path.isdir(path):
+                yield from (entry.path for entry in iter_image_files(Path(path)))
+            elif os.path.exists(path):
+                yield path
+            else:
+                raise FileNotFoundError(path)
+
+    for chunk in chunked(iter_files(), chunk_size):
+        images = []
+        for path in chunk:
+            with open(path, 'rb') as f:
+                images.append((path, f.read()))
+        yield from service.lookup_images(images, top_k, max_distance)
+
+
+class MatchRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler for the match endpoints; `server.service` is the MatchService."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'CreativeHashMatch/1.0'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path == '/health':
+            service = self.server.service
+            self._send_json(200, {
+                'status': 'ok',
+                'platform_creatives': len(service.index),
+                'source': service.source,
+                'loaded_at': service.loaded_at,
+                'reloads': service.reloads,
+            })
+        elif url.path == '/match':
+            self._handle_match(params.get('hash', []), params)
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint: {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        # The body is read by length, so the length has to be present and sane first
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self._send_json(411, {'error': "Content-Length header required"})
+            self.close_connection = True
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._send_json(400, {'error': f"Invalid Content-Length: {self.headers.get('Content-Length')}"})
+            self.close_connection = True
+            return
+        if length > MAX_REQUEST_BYTES:
+            self._send_json(413, {'error': f"Request body larger than {MAX_REQUEST_BYTES} bytes"})
+            self.close_connection = True
+            return
+        body = self.rfile.read(length)
+
+        if url.path == '/match':
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                self._send_json(400, {'error': "Body must be JSON: {\"hashes\": [...]}"})
+                return
+            for key in ('max_distance', 'top_k'):
+                if key in payload:
+                    params[key] = [str(payload[key])]
+            self._handle_match(payload.get('hashes', []), params)
+        elif url.path == '/match/image':
+            (phash, error), = self.server.service.hash_images([body])
+            if error:
+                self._send_json(400, {'error': error})
+                return
+            self._handle_match([phash], params)
+        elif url.path == '/lookup':
+            self._handle_lookup(body, params)
+        else:
+            self._send_json(404, {'error': f"Unknown endpoint: {url.path}"})
+
+    def _handle_lookup(self, body: bytes, params: Dict[str, List[str]]) -> None:
+        # JSON batch {"images": [{"name", "data" (base64)}], "top_k", "max_distance"},
+        # or a single raw image as the body with top_k/max_distance in the query string
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                payload = json.loads(body or b'{}')
+                images = [(str(image.get('name', position)), base64.b64decode(image['data'], validate=True))
+                          for position, image in enumerate(payload.get('images', []))]
+            except (ValueError, TypeError, KeyError, AttributeError):
+                self._send_json(400, {'error': "Body must be JSON: {\"images\": [{\"name\": ..., \"data\": <base64>}]}"})
+                return
+            for key in ('max_distance', 'top_k'):
+                if key in payload:
+                    params[key] = [str(payload[key])]
+        else:
+            images = [(params.get('name', ['image'])[0], body)]
+
+        if not images or not any(data for _, data in images):
+            self._send_json(400, {'error': "No images given"})
+            return
+        if len(images) > MAX_LOOKUP_IMAGES:
+            self._send_json(400, {'error': f"At most {MAX_LOOKUP_IMAGES} images per request"})
+            return
+
+        started = time.perf_counter()
+        try:
+            top_k = int(params['top_k'][0]) if 'top_k' in params else DEFAULT_LOOKUP_TOP_K
+            max_distance = int(params['max_distance'][0]) if 'max_distance' in params else None
+            results = self.server.service.lookup_images(images, top_k, max_distance)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        self._send_json(200, {'results': results, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)})
+
+    def _handle_match(self, hashes: List[str], params: Dict[str, List[str]]) -> None:
+        if not hashes:
+            self._send_json(400, {'error': "No hashes given"})
+            return
+        if len(hashes) > MAX_BATCH_HASHES:
+            self._send_json(400, {'error': f"At most {MAX_BATCH_HASHES} hashes per request"})
+            return
+
+        started = time.perf_counter()
+        try:
+            max_distance = int(params['max_distance'][0]) if 'max_distance' in params else None
+            top_k = int(params['top_k'][0]) if 'top_k' in params else None
+            results = self.server.service.match_hashes(hashes, max_distance, top_k)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        self._send_json(200, {'results': results, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)})
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server listening on a Unix domain socket."""
+
+    address_family = socket.AF_UNIX
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _remove_stale_socket(socket_path: str) -> None:
+    """
+    Remove a socket file left behind by a server that is no longer running.
+
+    Args:
+        socket_path: Unix socket path about to be bound
+
+    Raises:
+        FileExistsError: If the path is not a socket, or a server still listens on it
+    """
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{socket_path} exists and is not a socket; choose another --socket path")
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise FileExistsError(f"Another server is already listening on {socket_path}")
+
+
+def run_match_server(service: MatchService, host: str = '127.0.0.1', port: int = 8765,
+                     socket_path: Optional[str] = None, reload_interval: float = DEFAULT_RELOAD_INTERVAL,
+                     verbose: bool = False) -> None:
+    """
+    Serve match queries until interrupted.
+
+    Args:
+        service: Loaded MatchService
+        host: TCP host to bind (ignored with socket_path)
+        port: TCP port to bind (ignored with socket_path)
+        socket_path: Unix socket path to listen on instead of TCP
+        reload_interval: Seconds between source change checks (0 disables hot reload)
+        verbose: Log every request
+    """
+    socket_id = None
+    if socket_path:
+        _remove_stale_socket(socket_path)
+        server = UnixHTTPServer(socket_path, MatchRequestHandler)
+        address = f"unix:{socket_path}"
+        # Identifies the socket file this server created, the only one it may remove
+        created = os.stat(socket_path)
+        socket_id = (created.st_dev, created.st_ino)
+    else:
+        server = ThreadingHTTPServer((host, port), MatchRequestHandler)
+        server.daemon_threads = True
+        address = f"http://{host}:{server.server_port}"
+
+    server.service = service
+    server.verbose = verbose
+
+    if reload_interval > 0:
+        service.start_watching(reload_interval)
+
+    # Shut down cleanly (removing the socket file) when stopped by a service manager
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    print(f"🚀 Serving {len(service.index)} platform creatives from {service.source} on {address}")
+    print("   Endpoints: GET /health, GET|POST /match, POST /match/image, POST /lookup (Ctrl+C to stop)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down match service")
+    finally:
+        service.stop_watching()
+        server.server_close()
+        if socket_id is not None:
+            try:
+                current = os.stat(socket_path)
+                if stat.S_ISSOCK(current.st_mode) and (current.st_dev, current.st_ino) == socket_id:
+                    os.remove(socket_path)
+            except FileNotFoundError:
+                pass
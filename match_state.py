@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Incremental Match State
+
+SQLite record of the inputs behind the last mapping written by
+match_hashes.py --incremental, so the next run only matches what changed.
+
+Every local and platform row is identified by a 64-bit digest of its
+content (the n-th copy of an identical row gets its own key), and every
+mapping row is stored together with the keys of the local and platform
+rows that produced it. A changed row shows up as one removed key and one
+added key; removing a key drops the mapping rows built from it. The keys of
+each side are stored as one sorted array, which is read and diffed in a
+fraction of a second even for millions of rows.
+"""
+
+import json
+import sqlite3
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Bumped whenever the row digests or the stored mapping change meaning
+STATE_VERSION = 1
+
+# Columns of a stored mapping row: the two row keys, then the mapping columns
+# (platform_phash, hamming_distance and match_tier are kept even for exact-only runs)
+STATE_MAPPING_COLUMNS = ('local_key', 'platform_key', 'gdrive_filename', 'platform', 'ad_id', 'phash',
+                         'platform_phash', 'hamming_distance', 'match_tier')
+
+# Input sides with stored row keys
+STATE_SIDES = ('local', 'platform')
+
+
+def row_keys(df: pd.DataFrame) -> np.ndarray:
+    """
+    Content key of each row.
+
+    Args:
+        df: Input DataFrame (local or platform hashes, as loaded for matching)
+
+    Returns:
+        int64 array with one key per row; identical rows get distinct keys by
+        their order of appearance
+    """
+    digests = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    copies = pd.Series(digests).groupby(digests).cumcount().to_numpy()
+    keys = pd.util.hash_pandas_object(pd.DataFrame({'digest': digests, 'copy': copies}), index=False)
+    return keys.to_numpy().view(np.int64)
+
+
+def keys_isin(values: np.ndarray, sorted_keys: np.ndarray) -> np.ndarray:
+    """
+    Which values are among the keys (np.isin for sorted int64 keys).
+
+    A binary search into the sorted keys; np.isin and np.setdiff1d hash both
+    arrays instead, which is several times slower on millions of keys.
+    """
+    if len(sorted_keys) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_keys, values)
+    positions[positions == len(sorted_keys)] = 0
+    return sorted_keys[positions] == values
+
+
+def _tagged_digests(mapping: pd.DataFrame) -> pd.MultiIndex:
+    """(digest of the row's text, copy number) of each row."""
+    text = mapping.astype(object).where(mapping.notna(), '').astype(str)
+    digests = pd.util.hash_pandas_object(text, index=False).to_numpy()
+    return pd.MultiIndex.from_arrays([digests, pd.Series(digests).groupby(digests).cumcount().to_numpy()])
+
+
+def mapping_changes(inserted: pd.DataFrame, removed: pd.DataFrame, columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Net change feed between two sets of mapping rows.
+
+    A row that is removed and inserted again with the same values (e.g. when
+    only a column outside the mapping changed) cancels out. Values are compared
+    as they are written to the CSV, since rows read back from the state can
+    hold an ad_id with a different type than rows built from the inputs.
+
+    Args:
+        inserted: Mapping rows added by a run
+        removed: Mapping rows dropped by the run
+        columns: Mapping columns to compare and report
+
+    Returns:
+        DataFrame with a 'change' column ('inserted' or 'removed') followed by columns
+    """
+    columns = list(columns)
+    inserted, removed = inserted[columns].reset_index(drop=True), removed[columns].reset_index(drop=True)
+    inserted_tags, removed_tags = _tagged_digests(inserted), _tagged_digests(removed)
+
+    changes = pd.concat([
+        inserted[~inserted_tags.isin(removed_tags)].assign(change='inserted'),
+        removed[~removed_tags.isin(inserted_tags)].assign(change='removed'),
+    ], ignore_index=True)
+    return changes[['change'] + columns]
+
+
+class MatchState:
+    """
+    Input row keys and keyed mapping rows of the last incremental run.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Open (or create) the state database.
+
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path
+
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS row_keys (side TEXT PRIMARY KEY, keys BLOB NOT NULL)")
+            # ad_id has no declared type so ids keep whatever type they were loaded with
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS mapping (
+                    local_key INTEGER NOT NULL,
+                    platform_key INTEGER NOT NULL,
+                    gdrive_filename TEXT,
+                    platform TEXT,
+                    ad_id,
+                    phash TEXT,
+                    platform_phash TEXT,
+                    hamming_distance INTEGER,
+                    match_tier TEXT,
+                    PRIMARY KEY (local_key, platform_key)
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS mapping_platform_key ON mapping (platform_key)")
+
+    def options(self) -> Optional[Dict]:
+        """
+        Matching options the stored mapping was built with.
+
+        Returns:
+            Dictionary of options, or None for a new state
+        """
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'options'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def keys(self, side: str) -> np.ndarray:
+        """
+        Keys of the input rows behind the stored mapping.
+
+        Args:
+            side: 'local' or 'platform'
+
+        Returns:
+            Sorted int64 array of row keys
+        """
+        if side not in STATE_SIDES:
+            raise ValueError(f"Unknown side: {side} (choose from {', '.join(STATE_SIDES)})")
+        row = self._conn.execute("SELECT keys FROM row_keys WHERE side = ?", (side,)).fetchone()
+        return np.frombuffer(row[0], dtype=np.int64).copy() if row else np.empty(0, dtype=np.int64)
+
+    def mapping(self) -> pd.DataFrame:
+        """
+        The stored mapping rows, in the order they were added.
+
+        Returns:
+            DataFrame with STATE_MAPPING_COLUMNS
+        """
+        mapping = pd.read_sql_query(f"SELECT {', '.join(STATE_MAPPING_COLUMNS)} FROM mapping ORDER BY rowid",
+                                    self._conn)
+        for column in ('local_key', 'platform_key', 'hamming_distance'):
+            mapping[column] = mapping[column].astype(np.int64)
+        return mapping
+
+    def apply(self, options: Dict, keys: Dict[str, np.ndarray], inserted: pd.DataFrame,
+              removed_pairs: Tuple[np.ndarray, np.ndarray], reset: bool = False) -> None:
+        """
+        Record the result of a run, in a single transaction.
+
+        Args:
+            options: Matching options the mapping was built with
+            keys: Row keys of the current inputs per side ('local', 'platform')
+            inserted: New mapping rows with STATE_MAPPING_COLUMNS
+            removed_pairs: (local_keys, platform_keys) of the mapping rows to drop
+            reset: Discard the stored mapping first (e.g. when the options changed)
+        """
+        with self._conn:
+            if reset:
+                self._conn.execute("DELETE FROM mapping")
+            else:
+                self._conn.executemany("DELETE FROM mapping WHERE local_key = ? AND platform_key = ?",
+                                       zip(removed_pairs[0].tolist(), removed_pairs[1].tolist()))
+
+            for side in STATE_SIDES:
+                self._conn.execute("INSERT OR REPLACE INTO row_keys (side, keys) VALUES (?, ?)",
+                                   (side, np.sort(np.asarray(keys[side], dtype=np.int64)).tobytes()))
+
+            rows = inserted[list(STATE_MAPPING_COLUMNS)]
+            rows = rows.astype(object).where(rows.notna(), None)
+            self._conn.executemany(
+                f"INSERT INTO mapping ({', '.join(STATE_MAPPING_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(STATE_MAPPING_COLUMNS))})",
+                rows.itertuples(index=False, name=None)
+            )
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('options', ?)",
+                               (json.dumps(options, sort_keys=True),))
+
+    def close(self) -> None:
+        """Close the database."""
+        self._conn.close()
+
+    def __enter__(self) -> "MatchState":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Persistent Platform Hash Index
+
+On-disk index of platform creative hashes that match runs memory-map instead
+of re-parsing the platform CSV and rebuilding their lookup structures every
+time. The platform side changes slowly, so the index is built once with
+`match_hashes.py --build-index DIR` and reused by `--index-dir DIR`.
+
+An index directory contains flat binary arrays plus a JSON manifest. Every
+array file name starts with the id of the build that wrote it, and the
+manifest is replaced last, so rebuilding an index in place never changes the
+files a reader has already opened:
+
+- `<build>.hashes.u64`: platform phashes as uint64, sorted, so exact
+  lookups are a binary search
+- `<build>.<column>.offsets` / `<build>.<column>.bytes`: UTF-8 string
+  columns (ad_id, platform, ...) in the same row order, as int64 offsets
+  into a byte blob
+- `<build>.mih_<j>.keys` / `<build>.mih_<j>.positions`: the multi-index
+  hashing substring tables used for near-duplicate search
+- `index.json`: row count, array dtypes, stored columns and the size and
+  modification time of the CSV the index was built from
+
+Opening an index only maps these files; queries touch the pages they need,
+so lookup cost for a small batch of local hashes does not depend on the
+number of platform creatives.
+"""
+
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from hash_index import MultiIndexHash, blocked_search, limit_per_local_row
+
+INDEX_FORMAT_VERSION = 1
+
+MANIFEST_FILE = 'index.json'
+
+# Array files written by a build: "<build id>.<array name>"
+_ARRAY_FILE = re.compile(r'([0-9a-f]+)\.(hashes\.u64|[^.]+\.(offsets|bytes)|mih_\d+\.(keys|positions))')
+
+# Platform CSV columns kept in the index when present
+STORED_COLUMNS = ('ad_id', 'platform', 'creative_name', 'thumbnail_url')
+
+
+def _write_array(index_dir: str, name: str, array: np.ndarray) -> None:
+    """Write a raw array file."""
+    with open(os.path.join(index_dir, name), 'wb') as f:
+        f.write(np.ascontiguousarray(array).tobytes())
+
+
+def _map_array(index_dir: str, name: str, dtype: str, count: int) -> np.ndarray:
+    """Memory-map a raw array file read-only (empty files cannot be mapped)."""
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(os.path.join(index_dir, name), dtype=dtype, mode='r', shape=(count,))
+
+
+def source_signature(source_file: Optional[str]) -> Optional[Dict[str, object]]:
+    """
+    Identify the current state of a source file.
+
+    Args:
+        source_file: Path to the platform CSV, or None
+
+    Returns:
+        Dictionary with absolute path, size and mtime_ns, or None if there is no such file
+    """
+    if not source_file or not os.path.exists(source_file):
+        return None
+    stat = os.stat(source_file)
+    return {'path': os.path.abspath(source_file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def count_platforms(platform_df: pd.DataFrame) -> Dict[str, int]:
+    """
+    Count platform creatives per platform.
+
+    Args:
+        platform_df: Platform hashes with a platform column
+
+    Returns:
+        Dictionary mapping platform name to row count, sorted by name
+    """
+    counts = platform_df['platform'].fillna('').astype(str).value_counts()
+    return {str(name): int(counts[name]) for name in sorted(counts.index)}
+
+
+def build_platform_index(platform_df: pd.DataFrame, index_dir: str, source_file: Optional[str] = None,
+                         substrings: Optional[int] = None) -> "PlatformHashIndex":
+    """
+    Write a platform index directory.
+
+    Args:
+        platform_df: Platform hashes as loaded by match_hashes.load_platform_hashes (uint64 phash)
+        index_dir: Directory to write (created if needed; an existing index is replaced)
+        source_file: CSV the hashes came from, recorded so stale indexes can be detected
+        substrings: Multi-index hashing substring count (default: chosen from the row count)
+
+    Returns:
+        The newly written index, opened
+
+    Raises:
+        ValueError: If the hashes are not 64-bit
+    """
+    hashes = platform_df['phash'].to_numpy()
+    if hashes.dtype != np.uint64:
+        raise ValueError("The platform index only supports 64-bit hashes")
+
+    os.makedirs(index_dir, exist_ok=True)
+    build_id = f"{time.time_ns():x}"
+
+    order = np.argsort(hashes, kind='stable')
+    sorted_hashes = hashes[order]
+    _write_array(index_dir, f"{build_id}.hashes.u64", sorted_hashes)
+
+    columns = [column for column in STORED_COLUMNS if column in platform_df.columns]
+    for column in columns:
+        values = platform_df[column].iloc[order]
+        encoded = [b'' if pd.isna(value) else str(value).encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        _write_array(index_dir, f"{build_id}.{column}.offsets", offsets)
+        _write_array(index_dir, f"{build_id}.{column}.bytes", np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+    mih = MultiIndexHash(sorted_hashes, substrings)
+    tables = []
+    for j, (keys, positions) in enumerate(zip(mih.keys, mih.positions)):
+        _write_array(index_dir, f"{build_id}.mih_{j}.keys", keys)
+        _write_array(index_dir, f"{build_id}.mih_{j}.positions", positions)
+        tables.append({'keys': keys.dtype.str, 'positions': positions.dtype.str})
+
+    manifest = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'build_id': build_id,
+        'count': int(len(sorted_hashes)),
+        'columns': columns,
+        'substrings': mih.substrings,
+        'tables': tables,
+        'platforms': sorted(str(p) for p in platform_df['platform'].dropna().unique()),
+        'platform_counts': count_platforms(platform_df),
+        'source': source_signature(source_file),
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+    # The manifest is written last, so a reader never sees it describe missing arrays
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    previous_build = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous_build = json.load(f).get('build_id')
+    with open(f"{manifest_path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    # Keep the previous build's arrays for readers that are still opening them
+    for name in os.listdir(index_dir):
+        match = _ARRAY_FILE.fullmatch(name)
+        if match and match.group(1) not in (build_id, previous_build):
+            os.remove(os.path.join(index_dir, name))
+
+    return PlatformHashIndex(index_dir)
+
+
+class PlatformHashIndex:
+    """
+    Read-only, memory-mapped platform hash index.
+
+    Row ids returned by the lookups refer to the index's own (hash-sorted)
+    row order; take() turns them into a DataFrame with the stored columns.
+    from_dataframe() builds the same structure in memory, without files.
+    """
+
+    def __init__(self, index_dir: str):
+        """
+        Open an index directory written by build_platform_index.
+
+        Args:
+            index_dir: Index directory
+
+        Raises:
+            FileNotFoundError: If the directory has no index manifest
+            ValueError: If the index was written by an incompatible version
+        """
+        manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No platform index found in {index_dir}")
+
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported platform index version in {index_dir}; rebuild it with --build-index")
+
+        self.index_dir = index_dir
+        self.build_id = self.manifest['build_id']
+        self.count = self.manifest['count']
+        self.columns: List[str] = self.manifest['columns']
+        self.hashes = _map_array(index_dir, f"{self.build_id}.hashes.u64", 'uint64', self.count)
+
+        self._strings = {}
+        for column in self.columns:
+            blob_name = f"{self.build_id}.{column}.bytes"
+            blob_size = os.path.getsize(os.path.join(index_dir, blob_name))
+            self._strings[column] = (
+                _map_array(index_dir, f"{self.build_id}.{column}.offsets", 'int64', self.count + 1),
+                _map_array(index_dir, blob_name, 'uint8', blob_size)
+            )
+
+        tables = [
+            (_map_array(index_dir, f"{self.build_id}.mih_{j}.keys", spec['keys'], self.count),
+             _map_array(index_dir, f"{self.build_id}.mih_{j}.positions", spec['positions'], self.count))
+            for j, spec in enumerate(self.manifest['tables'])
+        ]
+        self.mih = MultiIndexHash(self.hashes, self.manifest['substrings'], tables)
+        self._frame = None
+
+    @classmethod
+    def from_dataframe(cls, platform_df: pd.DataFrame, substrings: Optional[int] = None) -> "PlatformHashIndex":
+        """
+        Build an in-memory index with the same interface as an on-disk one.
+
+        Args:
+            platform_df: Platform hashes as loaded by match_hashes.load_platform_hashes (uint64 phash)
+            substrings: Multi-index hashing substring count (default: chosen from the row count)
+
+        Returns:
+            In-memory PlatformHashIndex
+        """
+        hashes = platform_df['phash'].to_numpy()
+        if hashes.dtype != np.uint64:
+            raise ValueError("The platform index only supports 64-bit hashes")
+
+        order = np.argsort(hashes, kind='stable')
+        index = cls.__new__(cls)
+        index.index_dir = None
+        index.build_id = None
+        index.count = len(hashes)
+        index.columns = [column for column in STORED_COLUMNS if column in platform_df.columns]
+        index.hashes = hashes[order]
+        index.mih = MultiIndexHash(index.hashes, substrings)
+        index.manifest = {
+            'count': index.count,
+            'columns': index.columns,
+            'substrings': index.mih.substrings,
+            'platforms': sorted(str(p) for p in platform_df['platform'].dropna().unique()),
+            'platform_counts': count_platforms(platform_df),
+            'source': None,
+        }
+        index._strings = {}
+        index._frame = platform_df[index.columns].iloc[order].fillna('').astype(str).reset_index(drop=True)
+        return index
+
+    def __len__(self) -> int:
+        return self.count
+
+    def platform_counts(self) -> Dict[str, int]:
+        """
+        Number of indexed creatives per platform.
+
+        Returns:
+            Dictionary mapping platform name to row count, sorted by name
+        """
+        if 'platform_counts' in self.manifest:
+            return self.manifest['platform_counts']
+        # Indexes built before per-platform counts were recorded
+        platforms = pd.DataFrame({'platform': self.column('platform', np.arange(self.count))})
+        return count_platforms(platforms)
+
+    def is_stale(self, source_file: Optional[str] = None) -> bool:
+        """
+        Check whether the source CSV changed since the index was built.
+
+        Args:
+            source_file: CSV to compare against (default: the one recorded at build time)
+
+        Returns:
+            True if the file exists and differs in size or modification time
+        """
+        recorded = self.manifest.get('source')
+        path = source_file or (recorded or {}).get('path')
+        current = source_signature(path)
+        if current is None:
+            return False
+        return recorded is None or (current['size'], current['mtime_ns']) != (recorded['size'], recorded['mtime_ns'])
+
+    def find_exact(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find every index row whose hash equals a query hash.
+
+        Args:
+            hashes: uint64 query hashes
+
+        Returns:
+            (query_rows, index_rows) arrays, sorted by query row
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        low = np.searchsorted(self.hashes, hashes, side='left')
+        high = np.searchsorted(self.hashes, hashes, side='right')
+        counts = high - low
+        query_rows = np.repeat(np.arange(len(hashes)), counts)
+        offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        return query_rows, (np.repeat(low, counts) + offsets).astype(np.int64)
+
+    def find_near(self, hashes: np.ndarray, max_distance: Optional[int],
+                  top_k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find index rows within max_distance bits of each query hash.
+
+        Uses the stored substring tables; without max_distance (pure top-k)
+        the mapped hash array is scanned with the blocked brute-force engine.
+
+        Args:
+            hashes: uint64 query hashes
+            max_distance: Maximum Hamming distance (inclusive), or None for no limit
+            top_k: Keep only the top_k closest rows per query
+
+        Returns:
+            (query_rows, index_rows, distances) arrays, sorted by query row,
+            then distance, then index row
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if max_distance is None:
+            return blocked_search(hashes, self.hashes, None, top_k)
+
+        query_rows, index_rows, distances = self.mih.search(hashes, max_distance)
+        order = np.lexsort((index_rows, distances, query_rows))
+        query_rows, index_rows, distances = query_rows[order], index_rows[order], distances[order]
+        if top_k is not None:
+            return limit_per_local_row(query_rows, index_rows, distances, top_k)
+        return query_rows, index_rows, distances
+
+    def column(self, name: str, rows: np.ndarray) -> List[str]:
+        """
+        Read a stored string column for the given rows.
+
+        Args:
+            name: Column name (one of self.columns)
+            rows: Index row ids
+
+        Returns:
+            List of values ('' where the source value was missing)
+        """
+        if self._frame is not None:
+            return self._frame[name].iloc[np.asarray(rows)].tolist()
+        offsets, blob = self._strings[name]
+        return [blob[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8') for row in np.asarray(rows)]
+
+    def take(self, rows: np.ndarray) -> pd.DataFrame:
+        """
+        Materialize index rows as a DataFrame shaped like the platform CSV.
+
+        Args:
+            rows: Index row ids
+
+        Returns:
+            DataFrame with the stored columns and a uint64 phash column
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        data = {column: self.column(column, rows) for column in self.columns}
+        data['phash'] = np.asarray(self.hashes[rows], dtype=np.uint64)
+        return pd.DataFrame(data)